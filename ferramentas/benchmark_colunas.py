@@ -0,0 +1,146 @@
+########################## Análise de colunas em bloco (NumPy) x caminho em Python
+"""
+1) Confere que analisar_colunas_bytes (colunas_numpy.py) dá o mesmo resultado das funções em Python:
+   linhas_excedentes igual a tem_colunas_excedentes e, juntando as linhas de
+   linhas_quebradas, os mesmos registros de iter_registros_corrigidos. Usa casos
+   montados à mão e arquivos aleatórios (linhas em branco, aspas, CRLF, \\xa0,
+   linhas com colunas a mais, ISO-8859-1).
+2) Mede a vazão (MB/s) em um arquivo SAP sintético (padrão 1 GB, gravado em
+   pasta temporária e lido via mmap) contra a validação em Python usada na carga
+   (iter_registros_validados).
+
+Uso:
+    python ferramentas/benchmark_colunas.py [--tamanho-mb 1024] [--sem-benchmark]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from colunas_numpy import analisar_colunas_arquivo, analisar_colunas_bytes  # noqa: E402
+from sap_sintetico import gerar_bytes_sap, gravar_arquivo_sap  # noqa: E402
+
+
+CASOS = {
+    "simples": "A|B|C\n1|2|3\n4|5|6\n",
+    "bom": "\ufeffA|B|C\n1|2|3\n",
+    "crlf e aspas quebradas": 'A|B|C\r\n1|"x\r\ny"|3\r\n4|5|6\r\n',
+    "primeira linha em branco": "\nA|B\n1|2\n",
+    "vazio": "",
+    "só quebras": "\n\n\n",
+    "colunas excedentes": "A|B\n1|2\n\n1|2|3\n4|5\n6|7|8|9\n",
+    "registro incompleto no fim": "A|B|C\n1|2|3\n4|5",
+    "linha só com aspas": 'A|B\n""\n1|"2"\n  "  \n3|4\n',
+    "espaço unicode": "A|B\n\xa0\n1|2\n\u3000\xa0\n3|\xa04\n",
+    "quebra em três linhas": "A|B|C|D\n1|2\n3\n|4\n5|6|7|8\n",
+    "sem quebra no fim": "A|B\n1|2",
+    "separador de linha incomum": "A|B\r1|2\n",
+}
+
+
+# Registros montados a partir dos spans de linhas_quebradas (mesma junção com espaço)
+def registros_pelos_spans(content, analise):
+    linhas = content.lstrip('\ufeff').split('\n')
+    inicio_span = {inicio: fim for inicio, fim in analise['linhas_quebradas']}
+    registros, numero = [], 1
+    while numero <= len(linhas):
+        fim = inicio_span.get(numero, numero)
+        partes = [linha.replace('"', '').strip() for linha in linhas[numero - 1:fim]]
+        registro = " ".join(parte for parte in partes if parte)
+        if registro:
+            registros.append(registro)
+        numero = fim + 1
+    return registros
+
+
+def conferir(nome, dados, encoding, bloco=None):
+    content = dados.decode(encoding).lstrip('\ufeff')
+    analise = analisar_colunas_bytes(dados, encoding, bloco)
+    if analise is None:
+        return True  # separador de linha incomum: o caminho em Python é usado
+    esperado_excedentes = main.tem_colunas_excedentes(content)
+    esperado_registros = list(main.iter_registros_corrigidos(StringIO(content)))
+    obtido_registros = registros_pelos_spans(content, analise)
+    if analise['linhas_excedentes'] != esperado_excedentes or obtido_registros != esperado_registros:
+        print(f"[DIVERGENTE] {nome} ({encoding}, bloco {bloco})\n"
+              f"  excedentes: {esperado_excedentes} x {analise['linhas_excedentes']}\n"
+              f"  registros:  {esperado_registros[:5]} x {obtido_registros[:5]}")
+        return False
+    return True
+
+
+def gerar_aleatorio(rnd):
+    linhas = list(gerar_bytes_sap(rnd.randint(200, 5000), num_colunas=rnd.randint(2, 8),
+                                  taxa_quebras=0.2, seed=rnd.random()).decode('utf-8').split('\n'))
+    for _ in range(rnd.randint(0, 5)):
+        i = rnd.randrange(len(linhas))
+        linhas[i] = rnd.choice(["", "   ", '""', "\xa0", linhas[i] + "|extra", linhas[i] + '|"', "|||"])
+    fim = rnd.choice(["\n", "\r\n"])
+    return fim.join(linhas)
+
+
+def verificar(seed=0, aleatorios=300):
+    falhas = 0
+    for nome, content in CASOS.items():
+        for encoding in ('utf-8', 'ISO-8859-1'):
+            try:
+                dados = content.encode(encoding)
+            except UnicodeEncodeError:
+                continue
+            for bloco in (None, 4, 7):
+                falhas += not conferir(nome, dados, encoding, bloco)
+    rnd = random.Random(seed)
+    for i in range(aleatorios):
+        content = gerar_aleatorio(rnd)
+        encoding = rnd.choice(['utf-8', 'ISO-8859-1'])
+        dados = content.encode(encoding, errors='replace')
+        falhas += not conferir(f"aleatório {i}", dados, encoding, rnd.choice([None, 16, 333]))
+    print(f"{len(CASOS)} casos e {aleatorios} arquivos aleatórios verificados, {falhas} divergências.")
+    return falhas
+
+
+def medir(tamanho_mb):
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'CONTABIL_20240101.txt')
+        tamanho = gravar_arquivo_sap(caminho, tamanho_mb * 1024 * 1024)
+        mb = tamanho / 1024 / 1024
+
+        inicio = time.perf_counter()
+        analise = analisar_colunas_arquivo(caminho)
+        tempo_bloco = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        relatorio = main.ValidationReport()
+        with open(caminho, encoding='utf-8', newline='') as arquivo:
+            for _ in main.iter_registros_validados(arquivo, relatorio):
+                pass
+        tempo_python = time.perf_counter() - inicio
+
+    print(f"Arquivo sintético: {mb:.0f} MB, {analise['linhas']} linhas, "
+          f"{len(analise['linhas_quebradas'])} registros quebrados.")
+    print(f"  NumPy (mmap):  {tempo_bloco:6.1f} s  {mb / tempo_bloco:7.1f} MB/s")
+    print(f"  Python:        {tempo_python:6.1f} s  {mb / tempo_python:7.1f} MB/s")
+    print(f"  Ganho:         {tempo_python / tempo_bloco:.1f}x")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Análise de colunas em bloco (NumPy) x Python')
+    parser.add_argument('--tamanho-mb', type=int, default=1024)
+    parser.add_argument('--sem-benchmark', action='store_true', help='só a verificação de resultados')
+    args = parser.parse_args()
+
+    falhas = verificar()
+    if not args.sem_benchmark:
+        medir(args.tamanho_mb)
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
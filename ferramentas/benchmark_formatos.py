@@ -0,0 +1,92 @@
+########################## Benchmark CSV x Parquet do arquivo de carga
+"""
+Compara o arquivo de carga em CSV (formato atual) com o Parquet comprimido
+(OUTPUT_FORMAT=parquet) em arquivos SAP sintéticos: bytes enviados e tempo de
+geração (correção + conversão). Com --dataset, também carrega os dois formatos em
+tabelas de teste do BigQuery e mede a latência da carga (upload + load job);
+nesse caso são usadas as credenciais padrão do ambiente.
+
+Uso:
+    python ferramentas/benchmark_formatos.py [--tamanhos-mb 10 50] [--dataset projeto.dataset]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes_gcp import FakeStorageClient  # noqa: E402
+from sap_sintetico import gravar_arquivo_sap  # noqa: E402
+
+
+PARTITION_DATE = date(2024, 1, 1)
+
+
+def medir_geracao(blob, formato):
+    inicio = time.perf_counter()
+    total = sum(len(parte) for parte in main.iter_load_bytes(blob, 'utf-8', PARTITION_DATE, formato))
+    return total, time.perf_counter() - inicio
+
+
+def medir_carga(client, blob, table_id, formato, columns):
+    from google.cloud import bigquery
+
+    if formato == 'parquet':
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+    else:
+        job_config = bigquery.LoadJobConfig(
+            schema=[bigquery.SchemaField('PARTITIONDATE', 'DATE')]
+            + [bigquery.SchemaField(col, 'STRING') for col in columns],
+            source_format=bigquery.SourceFormat.CSV,
+            field_delimiter='|',
+            skip_leading_rows=1,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+    inicio = time.perf_counter()
+    _, local = main.spool_file_records(blob)
+    with local:
+        main.stream_file_to_load_job(client, local, table_id, PARTITION_DATE, job_config, formato).result()
+    return time.perf_counter() - inicio
+
+
+def main_benchmark(tamanhos_mb, dataset=None):
+    client = None
+    if dataset:
+        from google.cloud import bigquery
+        client = bigquery.Client()
+
+    print(f"{'MB':>6} {'formato':>8} {'bytes':>14} {'razão':>7} {'geração s':>10} {'MB/s':>8} {'carga s':>8}")
+    with tempfile.TemporaryDirectory() as raiz:
+        bucket = FakeStorageClient(raiz).bucket('benchmark')
+        for tamanho_mb in tamanhos_mb:
+            blob = bucket.blob(f"DADOS_1/SINTETICO_{tamanho_mb}MB_20240101.txt")
+            tamanho = gravar_arquivo_sap(os.path.join(raiz, 'origem.txt'), tamanho_mb * 1024 * 1024)
+            blob.upload_from_filename(os.path.join(raiz, 'origem.txt'))
+            relatorio = main.scan_file(blob)
+            columns = main.handle_duplicate_columns(relatorio.header)
+
+            bytes_csv = None
+            for formato in ('csv', 'parquet'):
+                total, segundos = medir_geracao(blob, formato)
+                bytes_csv = bytes_csv or total
+                carga = ''
+                if client:
+                    carga = f"{medir_carga(client, blob, f'{dataset}.benchmark_{formato}', formato, columns):.2f}"
+                print(f"{tamanho_mb:>6} {formato:>8} {total:>14,} {total / bytes_csv:>7.2f} "
+                      f"{segundos:>10.2f} {tamanho / segundos / 1024 / 1024:>8.1f} {carga:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos-mb', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--dataset', help="projeto.dataset para medir também a carga no BigQuery")
+    args = parser.parse_args()
+    main_benchmark(args.tamanhos_mb, args.dataset)
@@ -0,0 +1,148 @@
+########################## Carga em partes x arquivo de carga único
+"""
+1) Confere que stream_file_to_temp_shards (carga em partes) gera os mesmos registros e
+   o mesmo relatório de validação de stream_file_to_temp_blob: os casos de
+   verifica_streaming e arquivos SAP sintéticos aleatórios (registros quebrados, linhas
+   em branco, aspas, CRLF, colunas a mais, ISO-8859-1, registro incompleto no fim), com
+   partes bem pequenas para forçar registros quebrados entre uma parte e outra.
+2) Mede os dois caminhos em arquivos de tamanhos crescentes (arquivos locais via
+   FakeStorageClient) e imprime o ganho por tamanho. O ganho depende dos núcleos
+   disponíveis (SHARD_WORKERS, padrão os.cpu_count()): com 1 CPU o pool de processos
+   não paraleliza nada e só acrescenta a cópia das partes entre os processos.
+
+Uso:
+    python ferramentas/benchmark_partes.py [--tamanhos-mb 16 64 256] [--parte-mb 8] [--sem-benchmark]
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes_gcp import FakeStorageClient  # noqa: E402
+from sap_sintetico import gerar_bytes_sap, gravar_arquivo_sap  # noqa: E402
+from verifica_streaming import CASOS  # noqa: E402
+
+
+# Campos do relatório que devem ser iguais nos dois caminhos
+CAMPOS = [
+    'encoding', 'deteccao_encoding', 'bom', 'bytes_lidos', 'primeira_linha_em_branco', 'colunas_header',
+    'linhas_excedentes', 'registro_muito_longo', 'linhas', 'separadores', 'linhas_juntadas', 'registros', 'header', 'header_linha',
+    'header_no_primeiro_registro', 'registros_fora_do_header',
+]
+
+
+def linhas_do_arquivo(dados):
+    linhas = dados.split(b'\n')
+    return linhas[:-1] if linhas and not linhas[-1] else linhas
+
+
+def conferir(bucket, nome, dados, tamanho_parte, chunk_size=None):
+    origem = bucket.blob(f"origem/{nome}")
+    origem.upload_from_string(dados)
+    esperado = main.stream_file_to_temp_blob(origem, bucket.blob(f"temp/{nome}"), '2024-01-01', chunk_size)
+    obtido = main.stream_file_to_temp_shards(origem, bucket, f"partes/{nome}", '2024-01-01', tamanho_parte, chunk_size)
+
+    # Arquivos rejeitados não deixam arquivo de carga em nenhum dos dois caminhos
+    temp = bucket.blob(f"temp/{nome}")
+    gravado = temp.exists()
+    linhas = linhas_do_arquivo(temp.download_as_bytes()) if gravado else []
+    if gravado:
+        temp.delete()
+    cabecalhos, corpo = set(), []
+    for parte in obtido.partes:
+        linhas_parte = linhas_do_arquivo(gzip.decompress(bucket.blob(parte).download_as_bytes()))
+        cabecalhos.add(linhas_parte[0])
+        corpo += linhas_parte[1:]
+
+    divergencias = [campo for campo in CAMPOS if getattr(esperado, campo) != getattr(obtido, campo)]
+    if esperado.motivo_rejeicao() and (gravado or obtido.partes):
+        divergencias.append('arquivo de carga de arquivo rejeitado')
+    if linhas[1:] != corpo or cabecalhos - set(linhas[:1]) or bool(linhas) != bool(obtido.partes):
+        divergencias.append('registros')
+    if divergencias:
+        print(f"[DIVERGENTE] {nome} (partes de {tamanho_parte} bytes, bloco {chunk_size}): {divergencias}")
+        for campo in divergencias[:3]:
+            if campo in CAMPOS:
+                print(f"  {campo}: {getattr(esperado, campo)!r:.200} x {getattr(obtido, campo)!r:.200}")
+        return False
+    return True
+
+
+def gerar_aleatorio(rnd):
+    linhas = gerar_bytes_sap(rnd.randint(500, 20000), num_colunas=rnd.randint(2, 8), taxa_quebras=0.2,
+                             seed=rnd.random()).decode('utf-8').split('\n')
+    for _ in range(rnd.randint(0, 6)):
+        i = rnd.randrange(len(linhas))
+        linhas[i] = rnd.choice(["", "   ", '""', "\xa0", linhas[i] + "|extra", linhas[i] + '|"', "|||", "ção|é"])
+    conteudo = rnd.choice(["\n", "\r\n"]).join(linhas)
+    if rnd.random() < 0.3:
+        conteudo = conteudo.rstrip('\r\n')  # registro sem quebra de linha no fim
+    return conteudo.encode(rnd.choice(['utf-8', 'ISO-8859-1']), errors='replace')
+
+
+def verificar(seed=0, aleatorios=60):
+    falhas = 0
+    with tempfile.TemporaryDirectory() as raiz:
+        bucket = FakeStorageClient(raiz).bucket('bucket-teste')
+        for nome, dados in CASOS.items():
+            for tamanho_parte in (1, 5, 1024):
+                falhas += not conferir(bucket, f"{nome.replace(' ', '_')}.txt", dados, tamanho_parte, 7)
+        rnd = random.Random(seed)
+        for i in range(aleatorios):
+            dados = gerar_aleatorio(rnd)
+            falhas += not conferir(bucket, f"aleatorio{i}.txt", dados, rnd.choice([1, 64, 333, 4096]),
+                                   rnd.choice([None, 100, 1000]))
+    print(f"{len(CASOS)} casos e {aleatorios} arquivos aleatórios verificados, {falhas} divergências.")
+    return falhas
+
+
+def medir(tamanhos_mb, parte_mb):
+    print(f"\n{main.shard_pool.max_workers} processos no pool, {os.cpu_count()} CPUs, partes de {parte_mb} MB")
+    print(f"{'tamanho':>9} {'único s':>9} {'MB/s':>7} {'partes s':>9} {'MB/s':>7} {'ganho':>6} "
+          f"{'partes':>6} {'enviado':>15}")
+    main.shard_pool.get().submit(int).result()  # inicia os processos antes de medir
+    with tempfile.TemporaryDirectory() as raiz:
+        bucket = FakeStorageClient(raiz).bucket('bucket-teste')
+        os.makedirs(bucket.path, exist_ok=True)
+        for tamanho_mb in tamanhos_mb:
+            origem = bucket.blob(f"origem/SINTETICO_{tamanho_mb}.txt")
+            mb = gravar_arquivo_sap(origem.path, int(tamanho_mb * 1024 * 1024), taxa_quebras=0.01) / 1024 / 1024
+
+            inicio = time.perf_counter()
+            unico = main.stream_file_to_temp_blob(origem, bucket.blob('temp/unico'), '2024-01-01')
+            tempo_unico = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            partes = main.stream_file_to_temp_shards(origem, bucket, 'temp/partes', '2024-01-01',
+                                                     int(parte_mb * 1024 * 1024))
+            tempo_partes = time.perf_counter() - inicio
+            for parte in partes.partes:
+                bucket.delete_blob(parte)
+
+            enviado = f"{unico.bytes / 2 ** 20:.0f} -> {partes.bytes / 2 ** 20:.0f} MB"
+            print(f"{mb:>6.0f} MB {tempo_unico:>9.2f} {mb / tempo_unico:>7.1f} {tempo_partes:>9.2f} "
+                  f"{mb / tempo_partes:>7.1f} {tempo_unico / tempo_partes:>5.1f}x {len(partes.partes):>6} {enviado:>15}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Carga em partes x arquivo de carga único')
+    parser.add_argument('--tamanhos-mb', type=float, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--parte-mb', type=float, default=main.shard_size_mb / 4)
+    parser.add_argument('--sem-benchmark', action='store_true', help='só a verificação de resultados')
+    args = parser.parse_args()
+
+    falhas = verificar()
+    if not args.sem_benchmark:
+        medir(args.tamanhos_mb, args.parte_mb)
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
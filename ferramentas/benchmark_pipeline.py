@@ -0,0 +1,254 @@
+########################## Benchmark de ponta a ponta do process_data, sem GCP
+"""
+Executa process_data (a mesma rota / do Cloud Run) sobre arquivos SAP sintéticos
+gravados no Cloud Storage local de fakes_gcp, com o BigQuery também falso
+(load jobs com latência simulada). Para cada cenário mede:
+
+- vazão: MB de arquivos de origem processados por segundo (tempo total da requisição);
+- MB baixados do Cloud Storage (com --banda-mb-s o download também leva tempo);
+- chamadas ao Cloud Storage (exists, cópias e remoções; com --latencia-gcs cada uma
+  leva esse tempo) e ao BigQuery;
+- pico de memória (RSS máximo do processo; cada cenário roda em um subprocesso);
+- latência por fase (média, p50, p95 e máximo), a partir das linhas gravadas em
+  LOG.METRICAS pela instrumentação do main.py.
+
+Com --salvar os resultados são gravados em JSON; com --comparar, um resultado salvo
+antes é usado como referência e o script retorna 1 se algum cenário ficar mais lento
+(vazão) ou usar mais memória que a tolerância permite.
+
+Uso:
+    python ferramentas/benchmark_pipeline.py [--cenarios grande_utf8 ...] [--escala 0.5]
+    python ferramentas/benchmark_pipeline.py --salvar base.json
+    python ferramentas/benchmark_pipeline.py --comparar base.json [--tolerancia 0.2]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Cada cenário: arquivos gerados (quantidade, tamanho em MB, tabelas, opções do
+# gerador) e a configuração de main.py usada na execução
+CENARIOS = {
+    'muitos_pequenos': {
+        'arquivos': 40, 'tamanho_mb': 0.25, 'tabelas': 8,
+        'gerador': {'num_colunas': 20},
+        'config': {'max_workers': 4},
+    },
+    'grande_utf8': {
+        'arquivos': 1, 'tamanho_mb': 64, 'tabelas': 1,
+        'gerador': {'num_colunas': 40, 'taxa_quebras': 0.01},
+        'config': {'max_workers': 1},
+    },
+    'grande_em_partes': {
+        'arquivos': 1, 'tamanho_mb': 64, 'tabelas': 1,
+        'gerador': {'num_colunas': 40, 'taxa_quebras': 0.01},
+        'config': {'max_workers': 1, 'sharded_load_min_mb': 32, 'shard_size_mb': 16},
+    },
+    'latin1_quebras': {
+        'arquivos': 4, 'tamanho_mb': 8, 'tabelas': 4,
+        'gerador': {'num_colunas': 40, 'taxa_quebras': 0.05, 'encoding': 'ISO-8859-1'},
+        'config': {'max_workers': 4},
+    },
+    'latin1_nomes_tecnicos': {
+        'arquivos': 6, 'tamanho_mb': 6, 'tabelas': 3,
+        'gerador': {'num_colunas': 40, 'encoding': 'ISO-8859-1', 'nomes_tecnicos': True},
+        'config': {'max_workers': 3},
+    },
+    'mesma_tabela': {
+        'arquivos': 8, 'tamanho_mb': 4, 'tabelas': 1,
+        'gerador': {'num_colunas': 40},
+        'config': {'max_workers': 4, 'async_load_jobs': True},
+    },
+    'header_duplicado_parquet': {
+        'arquivos': 4, 'tamanho_mb': 8, 'tabelas': 2,
+        'gerador': {'num_colunas': 60, 'colunas_duplicadas': True},
+        'config': {'max_workers': 2, 'async_load_jobs': True, 'output_format': 'parquet'},
+    },
+}
+
+
+# Percentil simples (interpolação linear) de uma lista ordenada
+def percentil(valores, p):
+    if len(valores) == 1:
+        return valores[0]
+    posicao = (len(valores) - 1) * p
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(valores) - 1)
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (posicao - inferior)
+
+
+def latencia_por_fase(linhas_metricas):
+    duracoes = {}
+    for linha in linhas_metricas:
+        duracoes.setdefault(linha['Fase'], []).append(linha['Duracao'])
+    fases = {}
+    for fase, valores in sorted(duracoes.items()):
+        valores.sort()
+        fases[fase] = {
+            'n': len(valores),
+            'total': round(sum(valores), 4),
+            'media': round(statistics.fmean(valores), 4),
+            'p50': round(percentil(valores, 0.5), 4),
+            'p95': round(percentil(valores, 0.95), 4),
+            'max': round(valores[-1], 4),
+        }
+    return fases
+
+
+# Pico de RSS do processo em MB (ru_maxrss é em KB no Linux e em bytes no macOS)
+def pico_rss_mb():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 / 1024 if sys.platform == 'darwin' else pico / 1024
+
+
+# Executa um cenário neste processo e retorna o resultado (chamado no subprocesso)
+def executar_cenario(nome, escala=1.0, latencia_job=0.5, latencia_api=0.05, banda_mb_s=None, latencia_gcs=0.0):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+    from fakes_gcp import FakeBigQueryClient, FakeStorageClient
+    from sap_sintetico import gravar_arquivo_sap
+
+    cenario = CENARIOS[nome]
+    with tempfile.TemporaryDirectory() as raiz:
+        storage_client = FakeStorageClient(raiz, banda_mb_s, latencia_gcs)
+        bq_client = FakeBigQueryClient(storage_client, latencia_job=latencia_job, latencia_api=latencia_api)
+        main.client_registry.override(storage=lambda: storage_client, bigquery=lambda: bq_client)
+        for opcao, valor in cenario['config'].items():
+            setattr(main, opcao, valor)
+        main.load_job_poll_interval = min(main.load_job_poll_interval, latencia_job or 0.1)
+
+        bucket = storage_client.bucket(main.bucket_name)
+        os.makedirs(bucket.path, exist_ok=True)
+        tamanho_total = 0
+        for i in range(cenario['arquivos']):
+            # Tabelas SINTETICO0, SINTETICO1...; uma data (partição) diferente por arquivo
+            nome_arquivo = f"SINTETICO{i % cenario['tabelas']}_2024{1 + i // 28:02d}{1 + i % 28:02d}.txt"
+            blob = bucket.blob(f"{main.folder_name}/{nome_arquivo}")
+            tamanho_total += gravar_arquivo_sap(
+                blob.path, int(cenario['tamanho_mb'] * escala * 1024 * 1024), seed=i, **cenario['gerador']
+            )
+
+        rss_antes = pico_rss_mb()
+        inicio = time.perf_counter()
+        with open(os.devnull, 'w') as saida, contextlib.redirect_stdout(saida):
+            resposta = main.process_data()
+        segundos = time.perf_counter() - inicio
+
+        metricas = bq_client.inseridas.get(f"{main.project_id}.{main.log_dataset_name}.{main.metrics_table_name}", [])
+        arquivos = [linha for linha in metricas if linha['Fase'] == 'arquivo']
+        mb = tamanho_total / 1024 / 1024
+        return {
+            'cenario': nome,
+            'resposta': list(resposta),
+            'arquivos': cenario['arquivos'],
+            'sucessos': sum(1 for linha in arquivos if linha['Status'] == 'SUCESSO'),
+            'mb': round(mb, 2),
+            'segundos': round(segundos, 3),
+            'mb_por_segundo': round(mb / segundos, 2),
+            'mb_baixados': round(storage_client.bytes_baixados / 1024 / 1024, 2),
+            'linhas_carregadas': sum(bq_client.particoes.values()),
+            'rss_pico_mb': round(pico_rss_mb(), 1),
+            'rss_geracao_mb': round(rss_antes, 1),
+            'chamadas_bigquery': bq_client.chamadas,
+            'chamadas_storage': storage_client.chamadas,
+            'fases': latencia_por_fase(metricas),
+        }
+
+
+# Executa o cenário em um subprocesso (pico de RSS isolado por cenário)
+def executar_em_subprocesso(nome, args):
+    comando = [sys.executable, os.path.abspath(__file__), '--executar', nome, '--escala', str(args.escala),
+               '--latencia-job', str(args.latencia_job), '--latencia-api', str(args.latencia_api),
+               '--latencia-gcs', str(args.latencia_gcs)]
+    if args.banda_mb_s:
+        comando += ['--banda-mb-s', str(args.banda_mb_s)]
+    saida = subprocess.run(comando, capture_output=True, text=True)
+    if saida.returncode != 0:
+        raise RuntimeError(f"Cenário {nome} falhou:\n{saida.stderr}")
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def imprimir(resultado):
+    print(f"\n== {resultado['cenario']}: {resultado['arquivos']} arquivos, {resultado['mb']} MB, "
+          f"{resultado['sucessos']} com sucesso, {resultado['linhas_carregadas']:,} linhas carregadas")
+    print(f"   {resultado['segundos']:.2f} s  {resultado['mb_por_segundo']:.1f} MB/s  "
+          f"{resultado['mb_baixados']:.1f} MB baixados  RSS máximo {resultado['rss_pico_mb']:.0f} MB  "
+          f"resposta {resultado['resposta'][1]}")
+    print(f"   Cloud Storage: {resultado['chamadas_storage']}")
+    print(f"   {'fase':<20} {'n':>5} {'total s':>9} {'média':>8} {'p50':>8} {'p95':>8} {'máx':>8}")
+    for fase, valores in resultado['fases'].items():
+        print(f"   {fase:<20} {valores['n']:>5} {valores['total']:>9.3f} {valores['media']:>8.4f} "
+              f"{valores['p50']:>8.4f} {valores['p95']:>8.4f} {valores['max']:>8.4f}")
+
+
+# Compara com um resultado salvo; retorna a lista de regressões encontradas
+def comparar(resultados, referencia, tolerancia):
+    regressoes = []
+    for resultado in resultados:
+        base = referencia.get(resultado['cenario'])
+        if not base:
+            continue
+        if resultado['mb_por_segundo'] < base['mb_por_segundo'] * (1 - tolerancia):
+            regressoes.append(f"{resultado['cenario']}: vazão {resultado['mb_por_segundo']} MB/s "
+                              f"(referência {base['mb_por_segundo']} MB/s)")
+        if resultado['rss_pico_mb'] > base['rss_pico_mb'] * (1 + tolerancia):
+            regressoes.append(f"{resultado['cenario']}: RSS máximo {resultado['rss_pico_mb']} MB "
+                              f"(referência {base['rss_pico_mb']} MB)")
+        if resultado['sucessos'] != base['sucessos']:
+            regressoes.append(f"{resultado['cenario']}: {resultado['sucessos']} arquivos com sucesso "
+                              f"(referência {base['sucessos']})")
+    return regressoes
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cenarios', nargs='+', choices=list(CENARIOS), default=list(CENARIOS))
+    parser.add_argument('--escala', type=float, default=1.0, help='multiplica o tamanho dos arquivos')
+    parser.add_argument('--latencia-job', type=float, default=0.5, help='duração simulada dos load jobs (s)')
+    parser.add_argument('--latencia-api', type=float, default=0.05, help='atraso de get/create/update_table (s)')
+    parser.add_argument('--latencia-gcs', type=float, default=0.0,
+                        help='atraso de exists/cópia/remoção no Cloud Storage (s)')
+    parser.add_argument('--banda-mb-s', type=float, help='velocidade simulada de download do Cloud Storage')
+    parser.add_argument('--salvar', help='grava os resultados neste arquivo JSON')
+    parser.add_argument('--comparar', help='resultado JSON de referência')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='piora aceita na comparação (0.2 = 20%%)')
+    parser.add_argument('--executar', help=argparse.SUPPRESS)  # uso interno (subprocesso)
+    args = parser.parse_args()
+
+    if args.executar:
+        print(json.dumps(executar_cenario(args.executar, args.escala, args.latencia_job, args.latencia_api,
+                                          args.banda_mb_s, args.latencia_gcs)))
+        return 0
+
+    resultados = []
+    for nome in args.cenarios:
+        resultado = executar_em_subprocesso(nome, args)
+        imprimir(resultado)
+        resultados.append(resultado)
+
+    if args.salvar:
+        with open(args.salvar, 'w', encoding='utf-8') as destino:
+            json.dump({r['cenario']: r for r in resultados}, destino, indent=2, ensure_ascii=False)
+        print(f"\nResultados gravados em {args.salvar}.")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as origem:
+            regressoes = comparar(resultados, json.load(origem), args.tolerancia)
+        for regressao in regressoes:
+            print(f"[REGRESSÃO] {regressao}")
+        if regressoes:
+            return 1
+        print(f"\nSem regressões em relação a {args.comparar} (tolerância {args.tolerancia:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
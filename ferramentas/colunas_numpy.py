@@ -0,0 +1,145 @@
+########################## Análise de colunas em bloco com NumPy (ferramenta)
+"""
+Análise da quantidade de colunas por linha direto nos bytes do arquivo, com NumPy:
+mesmo resultado de tem_colunas_excedentes e das junções de iter_registros_corrigidos
+(main.py), a cerca de 3x a vazão da validação em Python. Não é usada na carga (a
+validação em streaming de main.py já rejeita o arquivo na primeira linha com colunas a
+mais); fica aqui para análises de arquivos locais e para benchmark_colunas.py.
+
+Exige numpy (não faz parte do requirements.txt da aplicação).
+
+Uso:
+    from colunas_numpy import analisar_colunas_arquivo
+    analisar_colunas_arquivo('/tmp/ARQUIVO_20240101.txt')
+"""
+
+import codecs
+import mmap
+import os
+
+import numpy as np
+
+
+# Trabalha direto nos bytes (bytes, bytearray ou mmap de um arquivo local), sem
+# decodificar, localizando os \n e os | com NumPy e contando os separadores de cada
+# linha com searchsorted nos limites das linhas. O "|" nunca aparece dentro de
+# caracteres multibyte, então vale para UTF-8 e ISO-8859-1.
+analise_bloco_bytes = 16 * 1024 * 1024  # bytes processados por janela
+
+
+# Verifica se a janela tem separadores de linha que o str.splitlines reconhece além
+# do \n e do \r\n (\r sozinho, \x0b, \x0c, \x1c-\x1e, \x85, \u2028, \u2029).
+# controle são as posições dos bytes < 0x20 da janela (poucos: \n, \r, \t).
+def _tem_separador_de_linha_extra(janela, controle, utf8):
+    valores = janela[controle]
+    if np.isin(valores, (0x0b, 0x0c, 0x1c, 0x1d, 0x1e)).any():
+        return True
+    retornos = controle[(valores == 13) & (controle + 1 < len(janela))]
+    if (janela[retornos + 1] != 10).any():
+        return True
+    if not utf8:
+        return bool((janela == 0x85).any())
+    c2 = np.flatnonzero(janela[:-1] == 0xc2)
+    if (janela[c2 + 1] == 0x85).any():
+        return True
+    e2 = np.flatnonzero(janela[:-2] == 0xe2)
+    return bool(((janela[e2 + 1] == 0x80) & ((janela[e2 + 2] | 1) == 0xa9)).any())
+
+
+# Analisa a quantidade de colunas de cada linha e devolve um dict com:
+#   linhas_excedentes: mesmo resultado de tem_colunas_excedentes (numeração entre as linhas não vazias)
+#   linhas_quebradas: (primeira, última) linha física (1 = primeira linha do arquivo) de cada
+#                     registro que iter_registros_corrigidos monta juntando linhas
+#   colunas_header e linhas (quantidade de linhas físicas)
+# Retorna None quando o arquivo tem separadores de linha incomuns (ver acima), para que
+# quem chamou use o caminho em Python.
+def analisar_colunas_bytes(dados, encoding='utf-8', bloco=None):
+    bloco = bloco or analise_bloco_bytes
+    utf8 = codecs.lookup(encoding).name == 'utf-8'
+    buffer = np.frombuffer(dados, dtype=np.uint8)
+    if utf8 and buffer[:3].tobytes() == codecs.BOM_UTF8:
+        buffer = buffer[3:]  # BOM, removido como no fluxo de leitura
+
+    separadores, com_conteudo, com_conteudo_sem_aspas = [], [], []
+    inicio, total = 0, len(buffer)
+    while inicio < total:
+        # Janela terminada em \n (aumenta se a linha for maior que o bloco)
+        fim = min(inicio + bloco, total)
+        quebras = np.flatnonzero(buffer[inicio:fim] == 10)
+        while fim < total and not len(quebras):
+            fim = min(fim + bloco, total)
+            quebras = np.flatnonzero(buffer[inicio:fim] == 10)
+        if fim < total:
+            fim = inicio + quebras[-1] + 1
+        janela = buffer[inicio:fim]
+        controle = np.flatnonzero(janela < 0x20)
+        if _tem_separador_de_linha_extra(janela, controle, utf8):
+            return None
+
+        # Separadores por linha: posições dos "|" e searchsorted nos limites das linhas
+        inicios = np.concatenate(([0], quebras[quebras + 1 < len(janela)] + 1))
+        limites = np.append(inicios, len(janela))
+        contagem = np.diff(np.searchsorted(np.flatnonzero(janela == 124), limites))
+        separadores.append(contagem)
+
+        # Linha com "|" nunca é vazia (nem sem as aspas). As sem separador (linhas em
+        # branco e pedaços de registros quebrados, poucas) são conferidas em Python
+        # com o mesmo strip do fluxo normal
+        conteudo = contagem > 0
+        conteudo_sem_aspas = conteudo.copy()
+        for i in np.flatnonzero(~conteudo).tolist():
+            linha = janela[limites[i]:limites[i + 1]].tobytes().decode(encoding, errors='replace')
+            conteudo[i] = bool(linha.strip())
+            conteudo_sem_aspas[i] = conteudo[i] and bool(linha.replace('"', '').strip())
+
+        com_conteudo.append(conteudo)
+        com_conteudo_sem_aspas.append(conteudo_sem_aspas)
+        inicio = fim
+
+    if not separadores:
+        return {'linhas_excedentes': [], 'linhas_quebradas': [], 'colunas_header': 0, 'linhas': 0}
+    separadores = np.concatenate(separadores)
+    com_conteudo = np.concatenate(com_conteudo)
+    com_conteudo_sem_aspas = np.concatenate(com_conteudo_sem_aspas)
+
+    # Linhas com mais colunas que o header (primeira linha não vazia)
+    nao_vazias = np.flatnonzero(com_conteudo)
+    colunas_header = int(separadores[nao_vazias[0]]) + 1 if len(nao_vazias) else 0
+    excedentes = (np.flatnonzero(separadores[nao_vazias[1:]] >= colunas_header) + 2).tolist()
+
+    # Registros quebrados: mesma regra de iter_registros_corrigidos, que usa os separadores
+    # da primeira linha física e junta as linhas até somar essa quantidade. Só as linhas
+    # com quantidade diferente iniciam uma junção, então o laço em Python é curto.
+    num_separadores = int(separadores[0])
+    linhas = np.flatnonzero(com_conteudo_sem_aspas)
+    contagens = separadores[linhas]
+    quebradas = []
+    ultima = -1
+    for k in np.flatnonzero(contagens != num_separadores).tolist():
+        if k <= ultima:
+            continue
+        soma, j = int(contagens[k]), k
+        while soma != num_separadores and j + 1 < len(linhas):
+            if soma > num_separadores:  # nunca fecha: vai até o fim do arquivo
+                j = len(linhas) - 1
+                break
+            j += 1
+            soma += int(contagens[j])
+        quebradas.append((int(linhas[k]) + 1, int(linhas[j]) + 1))
+        ultima = j
+
+    return {
+        'linhas_excedentes': excedentes,
+        'linhas_quebradas': quebradas,
+        'colunas_header': colunas_header,
+        'linhas': len(separadores),
+    }
+
+
+# Mesma análise sobre um arquivo local, mapeado em memória (sem ler o arquivo inteiro)
+def analisar_colunas_arquivo(caminho, encoding='utf-8', bloco=None):
+    with open(caminho, 'rb') as arquivo:
+        if os.fstat(arquivo.fileno()).st_size == 0:
+            return analisar_colunas_bytes(b'', encoding, bloco)
+        with mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            return analisar_colunas_bytes(mapa, encoding, bloco)
@@ -0,0 +1,105 @@
+########################## Eventos de finalize do GCS para testar o endpoint /evento
+"""
+Monta payloads equivalentes aos enviados pelo GCS quando um objeto é gravado
+(notificação do bucket via push do Pub/Sub, ou CloudEvent do Eventarc) e envia
+para o endpoint /evento de main.py.
+
+Uso contra o servidor local (python main.py):
+    python ferramentas/evento_gcs.py "DADOS_1/TABELA_20240101.txt" --generation 1
+
+Uso em processo, com o Cloud Storage local de fakes_gcp (o BigQuery continua
+sendo o cliente configurado em main.client_registry):
+    python ferramentas/evento_gcs.py "DADOS_1/TABELA_20240101.txt" --gcs-local /tmp/gcs
+
+--repetir N envia o mesmo evento N vezes, para conferir a deduplicação.
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import urllib.request
+import uuid
+
+
+# Push do Pub/Sub de uma notificação OBJECT_FINALIZE do bucket
+def evento_pubsub(bucket, name, generation, message_id=None):
+    recurso = {'kind': 'storage#object', 'bucket': bucket, 'name': name, 'generation': str(generation)}
+    return {
+        'message': {
+            'attributes': {
+                'bucketId': bucket,
+                'objectId': name,
+                'objectGeneration': str(generation),
+                'eventType': 'OBJECT_FINALIZE',
+                'payloadFormat': 'JSON_API_V1',
+            },
+            'data': base64.b64encode(json.dumps(recurso).encode('utf-8')).decode('ascii'),
+            'messageId': message_id or uuid.uuid4().hex,
+        },
+        'subscription': 'projects/local/subscriptions/sap-finalize',
+    }, {}
+
+
+# CloudEvent do Eventarc em modo binário (corpo = recurso do objeto, metadados nos headers)
+def evento_cloudevent(bucket, name, generation, event_id=None):
+    headers = {
+        'ce-id': event_id or uuid.uuid4().hex,
+        'ce-type': 'google.cloud.storage.object.v1.finalized',
+        'ce-source': f'//storage.googleapis.com/projects/_/buckets/{bucket}',
+        'ce-specversion': '1.0',
+    }
+    return {'bucket': bucket, 'name': name, 'generation': str(generation)}, headers
+
+
+def enviar_url(url, corpo, headers):
+    dados = json.dumps(corpo).encode('utf-8')
+    pedido = urllib.request.Request(url, data=dados, headers={'Content-Type': 'application/json', **headers})
+    try:
+        with urllib.request.urlopen(pedido) as resposta:
+            return resposta.status, resposta.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Envia um evento de finalize do GCS para /evento')
+    parser.add_argument('objeto', help='nome do objeto (ex.: DADOS_1/TABELA_20240101.txt)')
+    parser.add_argument('--bucket', default=None, help='bucket (padrão: bucket_name de main.py)')
+    parser.add_argument('--generation', default=None, help='generation do objeto (padrão: a atual no bucket local)')
+    parser.add_argument('--formato', choices=['pubsub', 'eventarc'], default='pubsub')
+    parser.add_argument('--url', default=None, help='URL do endpoint (ex.: http://localhost:8080/evento)')
+    parser.add_argument('--gcs-local', default=None, help='pasta do Cloud Storage local (fakes_gcp)')
+    parser.add_argument('--repetir', type=int, default=1, help='quantas vezes enviar o mesmo evento')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main as app_main
+
+    bucket = args.bucket or app_main.bucket_name
+    if args.gcs_local:
+        from fakes_gcp import FakeStorageClient
+        storage_client = FakeStorageClient(args.gcs_local)
+        app_main.client_registry.override(storage=lambda: storage_client)
+
+    generation = args.generation
+    if generation is None:
+        blob = app_main.get_storage_client().bucket(bucket).get_blob(args.objeto) if not args.url else None
+        generation = blob.generation if blob is not None else 1
+
+    montar = evento_pubsub if args.formato == 'pubsub' else evento_cloudevent
+    corpo, headers = montar(bucket, args.objeto, generation)
+
+    cliente = None if args.url else app_main.app.test_client()
+    for _ in range(args.repetir):
+        if cliente is None:
+            status, texto = enviar_url(args.url, corpo, headers)
+        else:
+            resposta = cliente.post('/evento', json=corpo, headers=headers)
+            status, texto = resposta.status_code, resposta.get_data(as_text=True)
+        print(status, texto)
+
+
+if __name__ == '__main__':
+    main()
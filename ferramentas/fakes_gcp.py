@@ -0,0 +1,405 @@
+########################## Fakes locais do Cloud Storage e do BigQuery (para testes e benchmarks)
+"""
+Implementação mínima, sobre o sistema de arquivos local, da parte da API do
+google.cloud.storage usada em main.py. Cada bucket é uma pasta dentro de `raiz`
+e cada blob é um arquivo nessa pasta, com o nome do objeto codificado (quote),
+já que no GCS "PASTA" e "PASTA/arquivo" podem existir ao mesmo tempo.
+
+FakeBigQueryClient guarda datasets e tabelas em memória e simula os load jobs
+(com latência configurável): os arquivos de carga são lidos do FakeStorageClient
+(load_table_from_uri) ou do stream (load_table_from_file) e só a quantidade de
+linhas por partição é guardada.
+
+Exemplo:
+    client = FakeStorageClient('/tmp/gcs')
+    bucket = client.bucket('br-apps-finance-prd-sap-log')
+    bucket.blob('DADOS_1/TABELA_20240101.txt').upload_from_string('A|B\\n1|2\\n')
+    main.client_registry.override(storage=lambda: client,
+                                  bigquery=lambda: FakeBigQueryClient(client, latencia_job=0.5))
+"""
+
+import base64
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from urllib.parse import quote, unquote
+
+from google.api_core.exceptions import BadRequest, NotFound, PreconditionFailed
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.path, quote(self.name, safe=''))
+
+    def exists(self):
+        self.bucket.client.contar_operacao('exists')
+        return os.path.isfile(self.path)
+
+    # generation: usa o mtime em ns do arquivo (muda a cada regravação); 0 = inexistente
+    @property
+    def generation(self):
+        return os.stat(self.path).st_mtime_ns if os.path.isfile(self.path) else 0
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.isfile(self.path) else None
+
+    # md5_hash no mesmo formato do GCS (base64 do digest); crc32c não é simulado
+    @property
+    def md5_hash(self):
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as arquivo:  # metadado: não conta como download
+            return base64.b64encode(hashlib.md5(arquivo.read()).digest()).decode('ascii')
+
+    crc32c = None
+
+    # Aceita os mesmos parâmetros de Blob.open (chunk_size é ignorado)
+    def open(self, mode='r', chunk_size=None, **kwargs):
+        if 'w' in mode:
+            os.makedirs(self.bucket.path, exist_ok=True)
+        elif not os.path.isfile(self.path):
+            raise NotFound(f"404 No such object: {self.bucket.name}/{self.name}")
+        if 'b' in mode:
+            if 'w' in mode:
+                return GravacaoFake(self.path, self.bucket.client)
+            return LeituraContada(open(self.path, mode), self.bucket.client)
+        return open(self.path, mode, encoding=kwargs.get('encoding', 'utf-8'), newline='')
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        if if_generation_match is not None and if_generation_match != self.generation:
+            raise PreconditionFailed(f"412 generation diferente: {self.bucket.name}/{self.name}")
+        with self.open('wb') as destino:
+            destino.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def upload_from_filename(self, filename, content_type=None):
+        os.makedirs(self.bucket.path, exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def download_as_bytes(self):
+        with self.open('rb') as origem:
+            return origem.read()
+
+    def download_as_text(self, encoding='utf-8'):
+        return self.download_as_bytes().decode(encoding)
+
+    def delete(self):
+        if not os.path.isfile(self.path):
+            raise NotFound(f"404 No such object: {self.bucket.name}/{self.name}")
+        os.remove(self.path)
+
+
+# Arquivo aberto para leitura que soma os bytes baixados no cliente e, com banda
+# definida, simula o tempo de download
+class LeituraContada:
+    def __init__(self, arquivo, client):
+        self._arquivo = arquivo
+        self._client = client
+
+    def read(self, size=-1):
+        dados = self._arquivo.read(size)
+        self._client.contar_download(len(dados))
+        return dados
+
+    def close(self):
+        self._arquivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Arquivo aberto para gravação com o mesmo comportamento do BlobWriter: o objeto só é
+# criado (ou substituído) no close; com exceção dentro do with o envio é descartado
+# (terminate) e o objeto anterior, se existir, continua como estava
+class GravacaoFake:
+    def __init__(self, path, client):
+        envios = os.path.join(client.raiz, '.envios')
+        os.makedirs(envios, exist_ok=True)
+        self._path = path
+        self._envio = os.path.join(envios, uuid.uuid4().hex)
+        self._arquivo = open(self._envio, 'wb')
+
+    def write(self, dados):
+        return self._arquivo.write(dados)
+
+    def close(self):
+        if not self._arquivo.closed:
+            self._arquivo.close()
+            os.replace(self._envio, self._path)
+
+    def terminate(self):
+        self._arquivo.close()
+        os.remove(self._envio)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.terminate()
+        else:
+            self.close()
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(self.client.raiz, self.name)
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.client.contar_operacao('get_blob')
+        blob = self.blob(name)
+        return blob if os.path.isfile(blob.path) else None
+
+    # fields (projeção da listagem) é aceito e ignorado
+    def list_blobs(self, prefix='', fields=None):
+        if not os.path.isdir(self.path):
+            return []
+        nomes = (unquote(arquivo) for arquivo in os.listdir(self.path))
+        return [self.blob(nome) for nome in sorted(nomes) if nome.startswith(prefix)]
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        self.client.contar_operacao('copy_blob')
+        novo = destination_bucket.blob(new_name)
+        novo.upload_from_filename(blob.path)
+        return novo
+
+    def rename_blob(self, blob, new_name):
+        novo = self.copy_blob(blob, self, new_name)
+        self.client.contar_operacao('delete')
+        blob.delete()
+        return novo
+
+    def delete_blob(self, blob_name):
+        self.client.contar_operacao('delete_blob')
+        self.blob(blob_name).delete()
+
+
+class FakeStorageClient:
+    def __init__(self, raiz, banda_mb_s=None, latencia_operacao=0.0):
+        self.raiz = raiz
+        self.banda_mb_s = banda_mb_s  # velocidade simulada de download (None = sem atraso)
+        self.latencia_operacao = latencia_operacao  # atraso de exists/cópia/remoção (s)
+        self.bytes_baixados = 0
+        self.chamadas = {}
+        self._lock = threading.Lock()
+        os.makedirs(raiz, exist_ok=True)
+
+    # Conta a chamada de metadados/cópia/remoção e simula a latência da API
+    def contar_operacao(self, metodo):
+        with self._lock:
+            self.chamadas[metodo] = self.chamadas.get(metodo, 0) + 1
+        if self.latencia_operacao:
+            time.sleep(self.latencia_operacao)
+
+    def contar_download(self, quantidade):
+        with self._lock:
+            self.bytes_baixados += quantidade
+        if self.banda_mb_s and quantidade:
+            time.sleep(quantidade / (self.banda_mb_s * 1024 * 1024))
+
+    def bucket(self, bucket_name):
+        return FakeBucket(self, bucket_name)
+
+
+class FakeJob:
+    def __init__(self, latencia, executar=None):
+        self._fim = time.monotonic() + latencia
+        self._executar = executar
+        self._lock = threading.Lock()
+        self._erro = None
+        self.output_rows = None
+        self.output_bytes = None
+
+    def _concluir(self):
+        with self._lock:
+            if self._executar is not None:
+                executar, self._executar = self._executar, None
+                try:
+                    self.output_rows, self.output_bytes = executar() or (None, None)
+                except Exception as e:
+                    self._erro = e
+
+    def done(self):
+        if time.monotonic() < self._fim:
+            return False
+        self._concluir()
+        return True
+
+    def result(self, timeout=None):
+        espera = self._fim - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self._concluir()
+        if self._erro is not None:
+            raise self._erro
+        return self
+
+
+class FakeBigQueryClient:
+    def __init__(self, storage_client, latencia_job=0.0, latencia_api=0.0, project='projeto-local'):
+        self.storage_client = storage_client
+        self.project = project
+        self.latencia_job = latencia_job  # duração simulada de load jobs e queries
+        self.latencia_api = latencia_api  # atraso de get_table/create_table/update_table
+        self._lock = threading.Lock()
+        self.datasets = set()
+        self.tabelas = {}  # table_id -> bigquery.Table
+        self.particoes = {}  # (table_id, 'AAAAMMDD') -> linhas carregadas
+        self.inseridas = {}  # table_id -> linhas de insert_rows_json
+        self.chamadas = {}  # método -> quantidade de chamadas
+
+    def _contar(self, metodo, latencia=0.0):
+        with self._lock:
+            self.chamadas[metodo] = self.chamadas.get(metodo, 0) + 1
+        if latencia:
+            time.sleep(latencia)
+
+    def dataset(self, dataset_name):
+        from google.cloud import bigquery
+        return bigquery.DatasetReference(self.project, dataset_name)
+
+    def get_dataset(self, dataset_ref):
+        self._contar('get_dataset', self.latencia_api)
+        if dataset_ref.dataset_id not in self.datasets:
+            raise NotFound(f"Dataset {dataset_ref} não encontrado")
+        return dataset_ref
+
+    def create_dataset(self, dataset):
+        self._contar('create_dataset', self.latencia_api)
+        self.datasets.add(dataset.dataset_id)
+        return dataset
+
+    def get_table(self, table_id):
+        self._contar('get_table', self.latencia_api)
+        table = self.tabelas.get(str(table_id))
+        if table is None:
+            raise NotFound(f"Tabela {table_id} não encontrada")
+        return table
+
+    def create_table(self, table):
+        self._contar('create_table', self.latencia_api)
+        with self._lock:
+            self.tabelas[f"{table.project}.{table.dataset_id}.{table.table_id}"] = table
+        return table
+
+    def update_table(self, table, fields):
+        self._contar('update_table', self.latencia_api)
+        with self._lock:
+            self.tabelas[f"{table.project}.{table.dataset_id}.{table.table_id}"] = table
+        return table
+
+    # Só o DELETE de partição de delete_existing_partition_data é interpretado
+    def query(self, query):
+        self._contar('query')
+        encontrado = re.search(r"DELETE FROM `([^`]+)`\s+WHERE PARTITIONDATE = DATE\('([0-9-]+)'\)", query)
+
+        def executar():
+            if encontrado:
+                chave = (encontrado.group(1), encontrado.group(2).replace('-', ''))
+                with self._lock:
+                    self.particoes.pop(chave, None)
+        return FakeJob(self.latencia_job, executar)
+
+    # Aceita uma URI ou uma lista de URIs (arquivos CSV podem estar com gzip)
+    def load_table_from_uri(self, source_uris, destination, job_config=None):
+        self._contar('load_table_from_uri')
+        blobs = []
+        for source_uri in [source_uris] if isinstance(source_uris, str) else source_uris:
+            bucket_name, _, name = source_uri[len('gs://'):].partition('/')
+            blobs.append(self.storage_client.bucket(bucket_name).blob(name))
+
+        # Como no BigQuery, os arquivos são lidos quando o job executa (antes de result/done),
+        # direto do disco: a leitura pelo BigQuery não conta como download do serviço
+        def executar():
+            arquivos = []
+            for blob in blobs:
+                with open(blob.path, 'rb') as arquivo:
+                    dados = arquivo.read()
+                arquivos.append(gzip.decompress(dados) if dados[:2] == b'\x1f\x8b' else dados)
+            return self._carregar(arquivos, destination, job_config)
+        return FakeJob(self.latencia_job, executar)
+
+    def load_table_from_file(self, file_obj, destination, job_config=None, **kwargs):
+        self._contar('load_table_from_file')
+        partes = []
+        while True:
+            parte = file_obj.read(8 * 1024 * 1024)
+            if not parte:
+                break
+            partes.append(parte)
+        dados = b"".join(partes)
+        return FakeJob(self.latencia_job, lambda: self._carregar([dados], destination, job_config))
+
+    # Conta as linhas dos arquivos de carga e atualiza a partição de destino
+    # (skip_leading_rows vale para cada arquivo, como no BigQuery)
+    def _carregar(self, arquivos, destination, job_config):
+        table_id, _, particao = str(destination).partition('$')
+        if table_id not in self.tabelas:
+            raise NotFound(f"Tabela {table_id} não encontrada")
+        linhas, primeira = 0, ''
+        for dados in arquivos:
+            if dados[:4] == b'PAR1':
+                import pyarrow.parquet as pq
+                tabela = pq.read_table(io.BytesIO(dados), columns=['PARTITIONDATE'])
+                quantidade = tabela.num_rows
+                primeira = primeira or (str(tabela.column(0)[0]) if quantidade else '')
+            else:
+                pular = getattr(job_config, 'skip_leading_rows', 0) or 0
+                registros = dados.split(b'\n')[pular:]
+                registros = [registro for registro in registros if registro]
+                self._validar_csv(self.tabelas[table_id], registros, job_config)
+                quantidade = len(registros)
+                primeira = primeira or (registros[0].split(b'|', 1)[0].decode('utf-8') if quantidade else '')
+            linhas += quantidade
+        chave = (table_id, particao or primeira.replace('-', ''))
+        with self._lock:
+            if str(getattr(job_config, 'write_disposition', '')) == 'WRITE_TRUNCATE':
+                self.particoes[chave] = linhas
+            else:
+                self.particoes[chave] = self.particoes.get(chave, 0) + linhas
+        return linhas, sum(len(dados) for dados in arquivos)
+
+    # Como no BigQuery: o schema informado na carga deve ser o da tabela, e registros com
+    # menos colunas só são aceitos com allow_jagged_rows
+    @staticmethod
+    def _validar_csv(table, registros, job_config):
+        schema = getattr(job_config, 'schema', None)
+        if not schema:
+            return
+        colunas = [field.name for field in schema]
+        if colunas != [field.name for field in table.schema]:
+            raise BadRequest(f"Provided Schema does not match Table {table.table_id}")
+        jagged = getattr(job_config, 'allow_jagged_rows', False)
+        for numero, registro in enumerate(registros, 1):
+            campos = registro.count(b'|') + 1
+            if campos > len(colunas) or (campos < len(colunas) and not jagged):
+                raise BadRequest(f"Error while reading data, error message: CSV table has {campos} columns "
+                                 f"in row {numero}, expected {len(colunas)}")
+
+    def insert_rows_json(self, table, json_rows, **kwargs):
+        self._contar('insert_rows_json')
+        with self._lock:
+            self.inseridas.setdefault(str(table), []).extend(json_rows)
+        return []
@@ -0,0 +1,141 @@
+########################## Tempo de início da instância
+"""
+Mede, em processos novos (como uma instância nova do Cloud Run), o tempo do
+`import main`, o aquecimento (/warmup, quando existe) e a latência das primeiras
+requisições de varredura, cada uma com um arquivo pequeno em DADOS_1. O Cloud Storage
+e o BigQuery são os fakes locais de fakes_gcp, com atraso por chamada de API; as
+fábricas dos clientes importam as bibliotecas do Google, como as fábricas padrão, para
+que o custo desses imports apareça onde aconteceria em produção.
+
+Para cada requisição são impressas a duração e a quantidade de chamadas às APIs do
+Cloud Storage e do BigQuery. Cenários:
+    sem_aquecimento -> primeira requisição logo após o import
+    com_aquecimento -> GET /warmup antes da primeira requisição
+
+Uso:
+    python ferramentas/medir_startup.py [--repeticoes 3] [--requisicoes 3] [--latencia-api 0.05]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CENARIOS = ['sem_aquecimento', 'com_aquecimento']
+MARCADOR = 'RESULTADO '  # linha do subprocesso com as medidas (o restante é o log de main)
+
+
+# Executa um cenário neste processo (chamado no subprocesso) e retorna as medidas
+def executar_cenario(cenario, requisicoes, latencia_api, latencia_cliente):
+    inicio = time.perf_counter()
+    import main
+    resultado = {
+        'import_main': time.perf_counter() - inicio,
+        'google_no_import': sorted(m for m in ('google.cloud.storage', 'google.cloud.bigquery') if m in sys.modules),
+    }
+
+    sys.path.insert(0, os.path.join(RAIZ_REPO, 'ferramentas'))
+    from fakes_gcp import FakeBigQueryClient, FakeStorageClient
+
+    with tempfile.TemporaryDirectory() as raiz:
+        storage_client = FakeStorageClient(raiz, latencia_operacao=latencia_api)
+        bq_client = FakeBigQueryClient(storage_client, latencia_job=0.0, latencia_api=latencia_api)
+
+        # Mesmo custo das fábricas padrão: import da biblioteca e criação do cliente
+        def fabrica(modulo, cliente):
+            def criar():
+                __import__(modulo)
+                time.sleep(latencia_cliente)
+                return cliente
+            return criar
+
+        main.client_registry.override(storage=fabrica('google.cloud.storage', storage_client),
+                                      bigquery=fabrica('google.cloud.bigquery', bq_client))
+        bucket = storage_client.bucket(main.bucket_name)
+        os.makedirs(bucket.path, exist_ok=True)
+        app = main.app.test_client()
+
+        def chamadas():
+            return sum(storage_client.chamadas.values()) + sum(bq_client.chamadas.values())
+
+        if cenario == 'com_aquecimento':
+            antes, inicio = chamadas(), time.perf_counter()
+            resposta = app.get('/warmup')
+            resultado['warmup'] = None if resposta.status_code == 404 else {
+                'status': resposta.status_code, 'duracao': time.perf_counter() - inicio,
+                'chamadas': chamadas() - antes,
+            }
+
+        resultado['requisicoes'] = []
+        for i in range(requisicoes):
+            bucket.blob(f"{main.folder_name}/STARTUP_2024010{i + 1}.txt").upload_from_string("A|B\n1|2\n")
+            antes, inicio = chamadas(), time.perf_counter()
+            resposta = app.get('/')
+            resultado['requisicoes'].append({
+                'status': resposta.status_code, 'duracao': time.perf_counter() - inicio,
+                'chamadas': chamadas() - antes,
+            })
+        main.logger.flush(timeout=5)
+    return resultado
+
+
+def medir(cenario, args):
+    comando = [sys.executable, os.path.abspath(__file__), '--filho', cenario,
+               '--requisicoes', str(args.requisicoes), '--latencia-api', str(args.latencia_api),
+               '--latencia-cliente', str(args.latencia_cliente)]
+    saida = subprocess.run(comando, cwd=RAIZ_REPO, capture_output=True, text=True, check=True).stdout
+    linha = next(linha for linha in saida.splitlines() if linha.startswith(MARCADOR))
+    return json.loads(linha[len(MARCADOR):])
+
+
+def mediana(valores):
+    return statistics.median(valores) * 1000
+
+
+def imprimir(cenario, resultados):
+    print(f"\n{cenario} ({len(resultados)} processos, medianas)")
+    print(f"  import main: {mediana([r['import_main'] for r in resultados]):7.0f} ms"
+          f"  (google.cloud carregado no import: {', '.join(resultados[0]['google_no_import']) or 'não'})")
+    if 'warmup' in resultados[0]:
+        if resultados[0]['warmup'] is None:
+            print("  /warmup:     indisponível (404)")
+        else:
+            print(f"  /warmup:     {mediana([r['warmup']['duracao'] for r in resultados]):7.0f} ms"
+                  f"  {resultados[0]['warmup']['chamadas']:>3} chamadas de API"
+                  f"  (status {resultados[0]['warmup']['status']})")
+    for i in range(len(resultados[0]['requisicoes'])):
+        requisicoes = [r['requisicoes'][i] for r in resultados]
+        print(f"  requisição {i + 1}: {mediana([r['duracao'] for r in requisicoes]):6.0f} ms"
+              f"  {requisicoes[0]['chamadas']:>3} chamadas de API  (status {requisicoes[0]['status']})")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Tempo de import, aquecimento e primeiras requisições')
+    parser.add_argument('--repeticoes', type=int, default=3, help='processos por cenário')
+    parser.add_argument('--requisicoes', type=int, default=3, help='requisições por processo')
+    parser.add_argument('--latencia-api', type=float, default=0.05,
+                        help='atraso (s) de cada chamada às APIs do Cloud Storage e do BigQuery')
+    parser.add_argument('--latencia-cliente', type=float, default=0.1,
+                        help='atraso (s) da criação de cada cliente (descoberta de credenciais)')
+    parser.add_argument('--cenarios', nargs='+', choices=CENARIOS, default=CENARIOS)
+    parser.add_argument('--filho', choices=CENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.filho:
+        sys.path.insert(0, RAIZ_REPO)
+        resultado = executar_cenario(args.filho, args.requisicoes, args.latencia_api, args.latencia_cliente)
+        print(MARCADOR + json.dumps(resultado))
+        return 0
+
+    for cenario in args.cenarios:
+        imprimir(cenario, [medir(cenario, args) for _ in range(args.repeticoes)])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
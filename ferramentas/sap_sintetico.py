@@ -0,0 +1,88 @@
+########################## Gerador de arquivos sintéticos no formato dos extratos SAP
+"""
+Gera arquivos separados por | parecidos com os extratos SAP que chegam em DADOS_1:
+header com acentos, espaços e nomes duplicados, valores com vírgula decimal,
+datas dd.mm.aaaa e textos entre aspas com quebras de linha no meio.
+
+Exemplo:
+    gravar_arquivo_sap('/tmp/CONTABIL_20240101.txt', 50 * 1024 * 1024, encoding='ISO-8859-1')
+"""
+
+import random
+
+
+COLUNAS_SAP = [
+    "Empresa", "Nº documento", "Exercício", "Item", "Data de lançamento", "Data do documento",
+    "Tipo de documento", "Conta do Razão", "Centro de custo", "Centro de lucro",
+    "Montante em MI", "Montante em MI", "Moeda", "Chave de lançamento", "Texto",
+    "Atribuição", "Referência", "Usuário", "Divisão", "Fornecedor",
+]
+
+
+# Nomes técnicos (ASCII) das mesmas colunas, como nas extrações feitas direto das tabelas
+COLUNAS_SAP_TECNICAS = [
+    "BUKRS", "BELNR", "GJAHR", "BUZEI", "BUDAT", "BLDAT", "BLART", "HKONT", "KOSTL", "PRCTR",
+    "DMBTR", "DMBTR", "WAERS", "BSCHL", "SGTXT", "ZUONR", "XBLNR", "USNAM", "GSBER", "LIFNR",
+]
+
+
+# Retorna o header com num_colunas colunas (repete os nomes SAP, gerando duplicados)
+def gerar_header(num_colunas=40, colunas_duplicadas=True, nomes_tecnicos=False):
+    colunas = COLUNAS_SAP_TECNICAS if nomes_tecnicos else COLUNAS_SAP
+    nomes = []
+    for i in range(num_colunas):
+        nome = colunas[i % len(colunas)]
+        if not colunas_duplicadas and nome in nomes:
+            nome = f"{nome} {i}"
+        nomes.append(nome)
+    return nomes
+
+
+def gerar_valor(rnd, coluna, taxa_quebras):
+    if coluna.startswith("Data"):
+        return f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.{rnd.randint(2019, 2025)}"
+    if coluna.startswith("Montante"):
+        return f"{rnd.randint(-999999, 999999):,}".replace(",", ".") + f",{rnd.randint(0, 99):02d}"
+    if coluna in ("Texto", "Referência"):
+        texto = " ".join(rnd.choice(["Pagamento", "fornecedor", "ação", "lançamento", "NF", "São Paulo",
+                                     "conciliação", "ajuste", "março", "crédito"])
+                         for _ in range(rnd.randint(1, 6)))
+        if rnd.random() < taxa_quebras:
+            meio = rnd.randint(0, len(texto))
+            return f'"{texto[:meio]}\n{texto[meio:]}"'
+        return texto
+    if coluna == "Moeda":
+        return rnd.choice(["BRL", "USD", "EUR"])
+    if rnd.random() < 0.05:
+        return ""
+    return str(rnd.randint(0, 10 ** rnd.randint(1, 10)))
+
+
+# Gera as linhas do arquivo (com \n) até atingir aproximadamente tamanho_bytes caracteres
+def gerar_linhas_sap(tamanho_bytes, num_colunas=40, taxa_quebras=0.01, colunas_duplicadas=True, seed=0,
+                     nomes_tecnicos=False):
+    rnd = random.Random(seed)
+    header = gerar_header(num_colunas, colunas_duplicadas)  # nomes descritivos definem os valores
+    linha = "|".join(gerar_header(num_colunas, colunas_duplicadas, nomes_tecnicos)) + "\n"
+    total = len(linha)
+    yield linha
+    while total < tamanho_bytes:
+        linha = "|".join(gerar_valor(rnd, coluna, taxa_quebras) for coluna in header) + "\n"
+        total += len(linha)
+        yield linha
+
+
+# Grava um arquivo sintético no encoding pedido (utf-8 ou ISO-8859-1) e retorna o tamanho em bytes
+def gravar_arquivo_sap(caminho, tamanho_bytes, encoding='utf-8', **kwargs):
+    total = 0
+    with open(caminho, 'wb') as destino:
+        for linha in gerar_linhas_sap(tamanho_bytes, **kwargs):
+            dados = linha.encode(encoding)
+            destino.write(dados)
+            total += len(dados)
+    return total
+
+
+# Retorna o conteúdo de um arquivo sintético em bytes (para arquivos pequenos)
+def gerar_bytes_sap(tamanho_bytes, encoding='utf-8', **kwargs):
+    return "".join(gerar_linhas_sap(tamanho_bytes, **kwargs)).encode(encoding)
@@ -0,0 +1,118 @@
+########################## Verificação da normalização dos nomes das colunas
+"""
+Compara normalize_header / sanitize_column_name (padrões compilados + cache LRU)
+com a implementação anterior (re.sub/re.match a cada chamada), que segue as regras
+de nomes do PHP: espaço vira "_", cada caractere fora de [a-zA-Z0-9_] vira "__",
+"_" na frente de nome iniciado por dígito, corte em 128 caracteres e sufixo 2, 3...
+nas colunas repetidas. Usa headers montados à mão, headers SAP sintéticos e
+headers aleatórios, e mede o tempo das duas versões em headers repetidos.
+
+Uso:
+    python ferramentas/verifica_colunas.py [quantidade_aleatoria]
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import normalize_header, sanitize_column_name  # noqa: E402
+from sap_sintetico import gerar_header  # noqa: E402
+
+
+# Cópia da versão anterior de sanitize_column_name
+def sanitize_column_name_legado(name):
+    name = name.replace(' ', '_')
+    name = re.sub(r'[^a-zA-Z0-9_]', '__', name)
+    if re.match(r'^[0-9]', name):
+        name = '_' + name
+    return name[:128]
+
+
+# Cópia da versão anterior de handle_duplicate_columns
+def handle_duplicate_columns_legado(columns):
+    column_count = {}
+    new_columns = []
+    for col in columns:
+        sanitized_col = sanitize_column_name_legado(col)
+        if sanitized_col in column_count:
+            column_count[sanitized_col] += 1
+            sanitized_col = f"{sanitized_col}{column_count[sanitized_col] + 1}"
+        else:
+            column_count[sanitized_col] = 0
+        new_columns.append(sanitized_col)
+    return new_columns
+
+
+HEADERS = [
+    "A|B|C",
+    "Empresa|Nº documento|Exercício|Montante em MI|Montante em MI|Montante em MI",
+    "1ª coluna|2024|_3|a b  c| espaço no início|fim |",
+    "Valor|Valor|Valor2|Valor|valor",
+    "x" * 127 + "é|" + "y" * 130 + "|" + "y" * 130,
+    "ção|ÇÃO|São Paulo|C/C|R$|%|(a)|[b]|a.b|a-b|a\tb",
+    "",
+    "||",
+    "9|9|_9",
+    "Ω|名前|emoji 😀| ",
+]
+
+
+def gerar_header_aleatorio(rnd):
+    alfabeto = "abcAZ09_ -.ºçãé/|$ \t😀"
+    return "".join(rnd.choice(alfabeto) for _ in range(rnd.randint(0, 80)))
+
+
+def verificar(quantidade_aleatoria=2000):
+    rnd = random.Random(0)
+    headers = list(HEADERS)
+    headers += ["|".join(gerar_header(n, duplicadas)) for n in (5, 40, 120) for duplicadas in (True, False)]
+    headers += [gerar_header_aleatorio(rnd) for _ in range(quantidade_aleatoria)]
+
+    falhas = 0
+    for header in headers + headers:  # duas vezes: a segunda vem do cache
+        esperado = handle_duplicate_columns_legado(header.split('|'))
+        obtido = list(normalize_header(header))
+        sanitizados = [sanitize_column_name(col) for col in header.split('|')]
+        if obtido != esperado or sanitizados != [sanitize_column_name_legado(c) for c in header.split('|')]:
+            falhas += 1
+            print(f"[DIVERGENTE] {header!r}\n  antes:  {esperado}\n  depois: {obtido}")
+    print(f"{len(headers)} headers verificados (duas vezes), {falhas} divergências.")
+    return falhas
+
+
+# Tempo para normalizar o header de 300 arquivos de 20 tabelas (headers repetidos)
+def medir():
+    headers = ["|".join(gerar_header(40 + i % 20)) for i in range(20)] * 15
+    normalize_header.cache_clear()
+    sanitize_column_name.cache_clear()
+
+    inicio = time.perf_counter()
+    for header in headers:
+        columns = handle_duplicate_columns_legado(header.split('|'))
+        [sanitize_column_name_legado(col) for col in columns]  # segunda passada de compare_columns
+    tempo_legado = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for header in headers:
+        columns = normalize_header(header)
+        [sanitize_column_name(col) for col in columns]
+    tempo_novo = time.perf_counter() - inicio
+
+    print(f"{len(headers)} headers: antes {tempo_legado * 1000:.1f} ms, "
+          f"com cache {tempo_novo * 1000:.1f} ms ({tempo_legado / tempo_novo:.0f}x). "
+          f"{normalize_header.cache_info()}")
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    falhas = verificar(quantidade)
+    medir()
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
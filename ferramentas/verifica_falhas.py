@@ -0,0 +1,151 @@
+########################## Falhas inesperadas durante a execução
+"""
+Executa process_data sobre o Cloud Storage e o BigQuery locais de fakes_gcp em
+cenários com erros inesperados e confere que os arquivos das outras tabelas terminam
+como terminariam sem o erro (movidos para Sucesso, temp limpo, partição carregada).
+
+Cenários:
+    erro_na_preparacao -> a preparação de uma tabela lança uma exceção enquanto o
+                          load job de outra tabela ainda está rodando (modo assíncrono
+                          e modo com threads devem dar o mesmo resultado)
+    manifesto_corrompido -> o objeto do manifesto de uma partição está truncado; os
+                            arquivos são carregados normalmente e o objeto é regravado
+
+Uso:
+    python ferramentas/verifica_falhas.py [--cenarios erro_na_preparacao ...]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes_gcp import FakeBigQueryClient, FakeStorageClient  # noqa: E402
+
+
+# Configuração de main.py usada em um cenário, restaurada no fim
+@contextlib.contextmanager
+def configuracao(**valores):
+    anteriores = {nome: getattr(main, nome) for nome in valores}
+    for nome, valor in valores.items():
+        setattr(main, nome, valor)
+    try:
+        yield
+    finally:
+        for nome, valor in anteriores.items():
+            setattr(main, nome, valor)
+
+
+# Cloud Storage e BigQuery locais, registrados em main.client_registry
+@contextlib.contextmanager
+def ambiente(latencia_job=0.0):
+    with tempfile.TemporaryDirectory() as raiz:
+        storage_client = FakeStorageClient(raiz)
+        bq_client = FakeBigQueryClient(storage_client, latencia_job=latencia_job)
+        bq_client.datasets.add(main.dataset_name)
+        main.client_registry.override(storage=lambda: storage_client, bigquery=lambda: bq_client)
+        bucket = storage_client.bucket(main.bucket_name)
+        os.makedirs(bucket.path, exist_ok=True)
+        yield bucket, bq_client
+
+
+def executar():
+    saida = io.StringIO()
+    with contextlib.redirect_stdout(saida):
+        resposta = main.process_data()
+    main.logger.flush(timeout=5)
+    return resposta, saida.getvalue()
+
+
+# A preparação de ERRO falha depois que o job de LENTA já foi disparado
+def erro_na_preparacao(async_load_jobs):
+    falhas = []
+    prepare_partition_replace = main.prepare_partition_replace
+
+    def preparar_particao(client, table_id, *args, **kwargs):
+        if table_id.endswith('.ERRO'):
+            time.sleep(0.2)
+            raise RuntimeError("erro simulado na preparação da partição")
+        return prepare_partition_replace(client, table_id, *args, **kwargs)
+
+    with ambiente(latencia_job=1.0) as (bucket, bq_client), \
+            configuracao(async_load_jobs=async_load_jobs, max_workers=2, load_job_poll_interval=0.05,
+                         prepare_partition_replace=preparar_particao):
+        for tabela in ('LENTA', 'ERRO'):
+            bucket.blob(f"{main.folder_name}/{tabela}_20240101.txt").upload_from_string("A|B\n1|2\n")
+        (_, status), _ = executar()
+
+        if status != 500:
+            falhas.append(f"status {status}, esperado 500 (o erro é repassado)")
+        sucesso = f"{main.target_folder}/{main.success_folder}/LENTA/LENTA_20240101.txt"
+        if not bucket.blob(sucesso).exists():
+            falhas.append("arquivo de LENTA não foi movido para Sucesso")
+        if bucket.blob(f"{main.target_folder}/{main.failure_folder}/LENTA_20240101.txt").exists():
+            falhas.append("arquivo de LENTA ficou em Falha")
+        if bucket.blob(f"{main.target_folder}/temp/LENTA_20240101.txt").exists():
+            falhas.append("arquivo de carga de LENTA ficou em temp")
+        if not bq_client.particoes.get((f"{main.project_id}.{main.dataset_name}.LENTA", '20240101')):
+            falhas.append("partição de LENTA não foi carregada")
+    return falhas
+
+
+# Objeto do manifesto truncado para TRUNCADO; OUTRA tem o manifesto em ordem
+def manifesto_corrompido():
+    falhas = []
+    with ambiente() as (bucket, bq_client), configuracao(use_manifest=True):
+        prefixo = f"{main.target_folder}/{main.manifest_prefix}"
+        bucket.blob(f"{prefixo}/TRUNCADO/20240101.json").upload_from_string('{"arquivo": "DADOS_1/TRUNCADO_2024')
+        for tabela in ('TRUNCADO', 'OUTRA'):
+            bucket.blob(f"{main.folder_name}/{tabela}_20240101.txt").upload_from_string("A|B\n1|2\n")
+        (_, status), saida = executar()
+
+        if status != 200:
+            falhas.append(f"status {status}, esperado 200")
+        if "Não foi possível ler o manifesto" not in saida:
+            falhas.append("leitura do manifesto corrompido não ficou no log")
+        for tabela in ('TRUNCADO', 'OUTRA'):
+            if not bq_client.particoes.get((f"{main.project_id}.{main.dataset_name}.{tabela}", '20240101')):
+                falhas.append(f"partição de {tabela} não foi carregada")
+        try:
+            entrada = json.loads(bucket.blob(f"{prefixo}/TRUNCADO/20240101.json").download_as_text())
+            if entrada.get('arquivo') != f"{main.folder_name}/TRUNCADO_20240101.txt":
+                falhas.append(f"manifesto regravado com conteúdo inesperado: {entrada}")
+        except ValueError as e:
+            falhas.append(f"manifesto continua corrompido: {e}")
+    return falhas
+
+
+CENARIOS = {
+    'erro_na_preparacao': [('assíncrono', lambda: erro_na_preparacao(True)),
+                           ('threads', lambda: erro_na_preparacao(False))],
+    'manifesto_corrompido': [('objeto truncado', manifesto_corrompido)],
+}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Falhas inesperadas durante a execução')
+    parser.add_argument('--cenarios', nargs='+', choices=list(CENARIOS), default=list(CENARIOS))
+    args = parser.parse_args()
+
+    divergencias = 0
+    for cenario in args.cenarios:
+        for variante, verificar in CENARIOS[cenario]:
+            falhas = verificar()
+            print(f"[{'OK' if not falhas else 'DIVERGENTE'}] {cenario} ({variante})")
+            for falha in falhas:
+                print(f"  {falha}")
+            divergencias += bool(falhas)
+    print(f"{sum(len(v) for c, v in CENARIOS.items() if c in args.cenarios)} verificações, "
+          f"{divergencias} divergências.")
+    return 1 if divergencias else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,125 @@
+########################## Verificação do reparo de linhas quebradas
+"""
+Compara iter_registros_corrigidos / replace_invalid_characters (passada única)
+com a implementação antiga em loop de ponto fixo, usando entradas com quebras
+de linha montadas à mão e entradas aleatórias.
+
+Uso:
+    python ferramentas/verifica_reparo.py [quantidade_aleatoria]
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import replace_invalid_characters  # noqa: E402
+
+
+# Cópia da versão anterior de replace_invalid_characters (loop até não haver mudanças).
+# Com registro incompleto no fim do arquivo a versão antiga nunca terminava, por isso
+# existe um limite de passadas: quando ele é atingido retornamos a última iteração.
+def replace_invalid_characters_legado(content, max_passadas=50):
+    content = content.replace('"', '')
+    linhas = content.splitlines()
+    header = linhas[0].strip()
+    num_separadores = header.count("|")
+
+    texto_corrigido = content
+    for _ in range(max_passadas):
+        linhas = texto_corrigido.splitlines()
+        linhas_corrigidas = []
+        linha_pendente = ""
+        mudou = False
+
+        for linha in linhas:
+            linha = linha.strip()
+
+            if not linha:
+                continue
+
+            if linha_pendente:
+                linha = linha_pendente + linha
+                linha_pendente = ""
+
+            if linha.count("|") == num_separadores:
+                linhas_corrigidas.append(linha)
+            else:
+                linha_pendente = linha + " "
+                mudou = True
+
+        if linha_pendente:
+            linhas_corrigidas.append(linha_pendente)
+            mudou = True
+
+        texto_corrigido = "\n".join(linhas_corrigidas)
+
+        if not mudou:
+            return texto_corrigido, True
+
+    return texto_corrigido.strip(), False
+
+
+CASOS = {
+    "sem quebras": "A|B|C\n1|2|3\n4|5|6\n",
+    "quebra dentro de aspas": 'A|B|C\n1|"texto\nquebrado"|3\n4|5|6',
+    "quebra em várias linhas": 'A|B|C\n1|"a\nb\nc\nd"|3\n4|5|6\n',
+    "linhas em branco": "A|B|C\n\n1|2|3\n\n\n4|5|6\n\n",
+    "espaços nas bordas": "  A|B|C  \n  1|2|3\t\n4|5|6   ",
+    "crlf": "A|B|C\r\n1|2\r\n|3\r\n4|5|6\r\n",
+    "separadores unicode": "A|B|C 1|2|3\x0c4|5\x856",
+    "quebra logo após separador": "A|B|C\n1|\n2|3\n",
+    "registro incompleto no fim": "A|B|C\n1|2|3\n4|5",
+    "aspas sem quebra": 'A|"B"|C\n"1"|2|"3"\n',
+    "somente header": "A|B|C",
+    "header sem separador": "A\n1\n2\n",
+}
+
+
+# Gera um arquivo aleatório com registros completos quebrados em pontos arbitrários
+def gerar_caso_aleatorio(rnd):
+    num_colunas = rnd.randint(1, 6)
+    linhas = ["|".join(f"COL {i}" for i in range(num_colunas))]
+    for _ in range(rnd.randint(0, 30)):
+        campos = []
+        for _ in range(num_colunas):
+            campo = "".join(rnd.choice("ab 1çã") for _ in range(rnd.randint(0, 8)))
+            if rnd.random() < 0.3:
+                meio = rnd.randint(0, len(campo))
+                quebra = rnd.choice(["\n", "\r\n", "\n\n", " \n "])
+                campo = f'"{campo[:meio]}{quebra}{campo[meio:]}"'
+            campos.append(campo)
+        linhas.append("|".join(campos))
+    return rnd.choice(["\n", "\r\n"]).join(linhas) + rnd.choice(["", "\n"])
+
+
+# Retorna (idêntico, convergiu) para um conteúdo
+def comparar(nome, content):
+    esperado, convergiu = replace_invalid_characters_legado(content)
+    obtido = replace_invalid_characters(content)
+    if obtido != esperado:
+        print(f"[DIVERGENTE] {nome}\n  entrada:  {content!r}\n  legado:   {esperado!r}\n  novo:     {obtido!r}")
+        return False, convergiu
+    return True, convergiu
+
+
+def main(quantidade_aleatoria=2000):
+    falhas = sem_convergencia = 0
+    casos = list(CASOS.items())
+
+    rnd = random.Random(20240101)
+    casos += [(f"aleatório #{i}", gerar_caso_aleatorio(rnd)) for i in range(quantidade_aleatoria)]
+
+    for nome, content in casos:
+        identico, convergiu = comparar(nome, content)
+        falhas += not identico
+        sem_convergencia += not convergiu
+
+    print(f"{len(casos) - falhas}/{len(casos)} casos idênticos à versão antiga "
+          f"({sem_convergencia} casos em que a versão antiga não terminava, comparados com a última passada).")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,138 @@
+########################## Verificação do pipeline em streaming
+"""
+Executa stream_file_to_temp_blob sobre arquivos locais (via FakeStorageClient) e
+compara o resultado com o processamento antigo em memória (download_as_text +
+tem_colunas_excedentes + replace_invalid_characters + find_valid_header).
+Usa blocos de leitura bem pequenos para forçar quebras de linha, BOM e
+caracteres multibyte divididos entre blocos.
+
+Uso:
+    python ferramentas/verifica_streaming.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (  # noqa: E402
+    find_valid_header,
+    replace_invalid_characters,
+    stream_file_to_temp_blob,
+    tem_colunas_excedentes,
+)
+from fakes_gcp import FakeStorageClient  # noqa: E402
+
+
+CASOS = {
+    "simples": "A|B|C\n1|2|3\n4|5|6\n".encode('utf-8'),
+    "bom utf-8": "\ufeffA|B|C\n1|2|3\n".encode('utf-8'),
+    "latin-1": "AÇÃO|DESCRIÇÃO\nção|é\n".encode('ISO-8859-1'),
+    "utf-8 multibyte": "AÇÃO|DESCRIÇÃO\nção|ééééé\n".encode('utf-8'),
+    "crlf e aspas quebradas": 'A|B|C\r\n1|"x\r\ny"|3\r\n4|5|6\r\n'.encode('utf-8'),
+    "primeira linha em branco": "\nA|B\n1|2\n".encode('utf-8'),
+    "arquivo vazio": b"",
+    "somente bom": "\ufeff".encode('utf-8'),
+    "colunas excedentes": "A|B\n1|2\n\n1|2|3\n4|5\n6|7|8|9\n".encode('utf-8'),
+    "header com coluna vazia": "A||C\n1|2|3\n4|5|6\n".encode('utf-8'),
+    "registro incompleto no fim": "A|B|C\n1|2|3\n4|5".encode('utf-8'),
+    "linha só com aspas": 'A|B\n""\n1|"2"\n  "  \n3|4\n'.encode('utf-8'),
+    "quebra após campo entre aspas": 'A|B|C\n"1"|\n"2"|3\n'.encode('utf-8'),
+    # Detecção do encoding durante a leitura (sem baixar o arquivo duas vezes)
+    "latin-1 após trecho ascii": ("A|B\n" + "1|2\n" * 20 + "ção|é\n").encode('ISO-8859-1'),
+    "latin-1 no fim": ("A|B\n" + "1|2\n" * 20 + "3|é").encode('ISO-8859-1'),
+    "utf-8 e depois latin-1": "A|Ç\n1|2\n".encode('utf-8') + "3|ção\n".encode('ISO-8859-1'),
+    "latin-1 que parece utf-8": "A|Ã©\n1|é\n".encode('ISO-8859-1'),
+    "bom e latin-1": b"\xef\xbb\xbfA|B\n" + "1|ã\n".encode('ISO-8859-1'),
+}
+
+# Como o encoding deve ser definido em cada caso (os demais: 'ascii' ou 'utf-8')
+DETECCAO = {
+    "latin-1": "troca",
+    "latin-1 após trecho ascii": "troca",
+    "latin-1 no fim": "troca",
+    "utf-8 e depois latin-1": "releitura",
+    "latin-1 que parece utf-8": "releitura",
+    "bom e latin-1": "releitura",
+}
+
+
+# Reproduz o fluxo antigo com o conteúdo inteiro em memória
+def processar_em_memoria(dados, partition_date):
+    try:
+        content, encoding = dados.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        content, encoding = dados.decode('ISO-8859-1'), 'ISO-8859-1'
+    content = content.lstrip('\ufeff')
+
+    primeira = content.splitlines()[0].strip() if content.splitlines() else ""
+    resultado = {'encoding': encoding, 'primeira_linha_em_branco': not primeira}
+    if not primeira:
+        return resultado
+
+    resultado['linhas_excedentes'] = tem_colunas_excedentes(content)
+    if resultado['linhas_excedentes']:
+        return resultado
+
+    content = replace_invalid_characters(content)
+    resultado['header'] = find_valid_header(content)
+    if not resultado['header']:
+        return resultado
+
+    resultado['dados'] = [
+        f"{partition_date}|{line}" for line in content.split('\n')[1:] if line.strip()
+    ]
+    return resultado
+
+
+def processar_em_streaming(bucket, nome, partition_date, chunk_size):
+    temp_blob = bucket.blob(f"temp/{nome}")
+    relatorio = stream_file_to_temp_blob(bucket.blob(nome), temp_blob, partition_date, chunk_size)
+    resultado = {'encoding': relatorio.encoding, 'primeira_linha_em_branco': relatorio.primeira_linha_em_branco}
+    if resultado['primeira_linha_em_branco']:
+        return resultado, relatorio
+
+    resultado['linhas_excedentes'] = relatorio.linhas_excedentes
+    if resultado['linhas_excedentes']:
+        return resultado, relatorio
+
+    resultado['header'] = relatorio.header
+    if not resultado['header']:
+        return resultado, relatorio
+
+    linhas = temp_blob.download_as_text().split('\n')
+    resultado['dados'] = [line for line in linhas[1:] if line]
+    return resultado, relatorio
+
+
+def main():
+    falhas = 0
+    partition_date = "2024-01-01"
+    with tempfile.TemporaryDirectory() as raiz:
+        bucket = FakeStorageClient(raiz).bucket('bucket-teste')
+        for nome, dados in CASOS.items():
+            arquivo = f"{nome.replace(' ', '_')}.txt"
+            bucket.blob(arquivo).upload_from_string(dados)
+            esperado = processar_em_memoria(dados, partition_date)
+            for chunk_size in (1, 3, 7, 1024):
+                obtido, relatorio = processar_em_streaming(bucket, arquivo, partition_date, chunk_size)
+                if obtido != esperado:
+                    falhas += 1
+                    print(f"[DIVERGENTE] {nome} (bloco de {chunk_size} bytes)\n"
+                          f"  em memória: {esperado}\n  streaming:  {obtido}")
+                # Com blocos grandes o arquivo inteiro é lido uma única vez, exceto
+                # quando o UTF-8 falha depois de caracteres UTF-8 válidos
+                deteccao = DETECCAO.get(nome, relatorio.deteccao_encoding)
+                if chunk_size == 1024 and (relatorio.deteccao_encoding != deteccao
+                                           or relatorio.deteccao_encoding in ('ascii', 'utf-8')
+                                           and relatorio.encoding != 'utf-8'):
+                    falhas += 1
+                    print(f"[DETECÇÃO] {nome}: {relatorio.deteccao_encoding} (esperado {deteccao})")
+
+    print(f"{len(CASOS)} arquivos verificados, {falhas} divergências.")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
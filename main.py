@@ -7,11 +7,28 @@ rafael_cardoso@carrefour.com ,
 david_barbato@carrefour.com]
 """
 
-from google.cloud import storage, bigquery
+# google.cloud.storage e google.cloud.bigquery são importados sob demanda (ver
+# new_bigquery_client/new_storage_client): o import dessas bibliotecas é a maior parte
+# do tempo de início da instância
 import re
 from datetime import datetime
 from io import StringIO
+import base64
+import codecs
+import contextvars
+import io
+import itertools
+import json
+import os
+import queue
 import tempfile
+import time
+import threading
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as futures_wait
 
 
 # Definindo nomes e variáveis
@@ -24,77 +41,789 @@ target_folder = 'BI_SI_FILES'
 success_folder = 'Sucesso'
 failure_folder = 'Falha'
 
+# Tamanho dos blocos lidos/gravados no Cloud Storage durante o processamento em streaming
+# (múltiplo de 256 KB, exigido pelo upload resumable)
+stream_chunk_size = 8 * 1024 * 1024
+
+# Tamanho máximo (caracteres) de um registro montado juntando linhas quebradas. Um
+# registro que não fecha as colunas do header até esse tamanho rejeita o arquivo (sem o
+# limite, todo o restante do arquivo seria juntado em um único registro)
+max_registro_chars = 1024 * 1024
+
+# Quantidade de arquivos processados em paralelo (1 = sequencial, como antes).
+# Arquivos da mesma tabela são sempre processados em sequência.
+max_workers = int(os.environ.get('MAX_WORKERS', '1'))
+
+# Dispara todos os load jobs e acompanha em conjunto, em vez de esperar cada
+# load_job.result() antes de seguir para o próximo arquivo
+async_load_jobs = os.environ.get('ASYNC_LOAD_JOBS', '0') == '1'
+
+# Intervalo máximo (segundos) entre consultas ao status dos load jobs no modo assíncrono
+load_job_poll_interval = 5.0
+
+# Como os dados chegam ao BigQuery:
+# 'uri'  -> arquivo de carga gravado em BI_SI_FILES/temp e carregado com load_table_from_uri
+# 'file' -> registros enviados em streaming com load_table_from_file, sem blob temporário
+#           (o arquivo de origem é lido uma vez: os registros validados ficam em um
+#           arquivo local em local_spool_dir até o envio)
+ingest_backend = os.environ.get('INGEST_BACKEND', 'uri')
+# Pasta dos arquivos locais do backend 'file' (None = pasta temporária do sistema). No
+# Cloud Run a pasta temporária ocupa a memória da instância: para arquivos grandes,
+# aponte para um volume montado ou use o backend 'uri'.
+local_spool_dir = os.environ.get('LOCAL_SPOOL_DIR') or None
+# Tentativas do envio de cada arquivo no backend 'file' (o upload é refeito do início)
+file_upload_attempts = int(os.environ.get('FILE_UPLOAD_ATTEMPTS', '3'))
+
+# Como a partição do arquivo é substituída:
+# 'truncate' -> uma única carga WRITE_TRUNCATE em tabela$YYYYMMDD (atômica, sem DML);
+#               tabelas sem partição diária em PARTITIONDATE usam o DELETE como fallback
+# 'dml'      -> sempre DELETE da partição seguido de carga WRITE_APPEND
+partition_replace_mode = os.environ.get('PARTITION_REPLACE_MODE', 'truncate')
+
+# Formato do arquivo de carga: 'csv' (separado por |) ou 'parquet' (colunar comprimido,
+# exige pyarrow). Arquivos que não podem ser convertidos continuam em CSV.
+output_format = os.environ.get('OUTPUT_FORMAT', 'csv')
+parquet_compression = 'snappy'
+parquet_batch_rows = 50000  # registros por lote (row group) no Parquet
+
+# Carga em partes dos arquivos grandes (saída CSV, backend 'uri'): arquivos a partir de
+# sharded_load_min_mb são divididos em partes de shard_size_mb nos limites das linhas.
+# Cada parte é validada, corrigida e comprimida (gzip) em um pool de processos, as partes
+# são enviadas em paralelo para a pasta temp e carregadas por um único load job com
+# todas as URIs, depois da substituição da partição (a carga continua atômica).
+# 0 = desativado (um arquivo de carga por arquivo, como antes).
+sharded_load_min_mb = float(os.environ.get('SHARDED_LOAD_MIN_MB', '0'))
+shard_size_mb = float(os.environ.get('SHARD_SIZE_MB', '64'))
+shard_workers = int(os.environ.get('SHARD_WORKERS', '0')) or os.cpu_count() or 1
+shard_upload_workers = 4  # partes enviadas ao Cloud Storage ao mesmo tempo
+shard_gzip_level = 1  # compressão rápida: o envio costuma ser mais lento que a compressão
+
+# Manifesto das cargas concluídas (BI_SI_FILES/manifest/...): arquivos reenviados com
+# o mesmo conteúdo para a mesma tabela/partição são movidos para Sucesso sem nova carga
+use_manifest = os.environ.get('LOAD_MANIFEST', '0') == '1'
+manifest_prefix = 'manifest'  # um objeto por tabela/partição (ver LoadManifest)
+
+# Movimentações de arquivos (Falha -> Sucesso, arquivos rejeitados) e remoções da pasta
+# temp rodam em segundo plano, em até blob_ops_workers threads; a execução espera todas
+# antes do resumo. A cópia para Falha antes da carga continua sendo feita na hora.
+# 0 = cada operação é feita na hora, na thread do arquivo.
+blob_ops_workers = int(os.environ.get('BLOB_OPS_WORKERS', '8'))
+
+# Planejamento do schema (desativado por padrão): antes das cargas, lê só o header dos
+# arquivos pendentes de tabelas existentes e rejeita os incompatíveis com o schema atual
+# da tabela antes de serem lidos por inteiro. Custa uma leitura de header por arquivo e,
+# para esses arquivos, o motivo da falha passa a ser o schema mesmo que a validação
+# também falhasse. Não cria nem altera tabelas: isso é feito arquivo a arquivo, depois
+# da validação
+schema_plan = os.environ.get('SCHEMA_PLAN', '0') == '1'
+header_plan_max_bytes = 1024 * 1024  # leitura máxima por arquivo para encontrar o header
+header_plan_chunk_size = 32 * 1024  # o header costuma estar nos primeiros KB do arquivo
+header_plan_workers = 8  # headers lidos em paralelo
+
+# Tempo (segundos) que os metadados das tabelas ficam em cache entre requisições
+# (0 = cache apenas durante a execução)
+table_cache_ttl = float(os.environ.get('TABLE_CACHE_TTL', '0'))
+
+# Verificação dos datasets e das pastas do bucket feita uma vez por instância (o
+# resultado fica em cache no processo). 0 = verifica a cada requisição, como antes.
+bootstrap_once = os.environ.get('BOOTSTRAP_ONCE', '1') == '1'
+
+# Log de execução gravado no BigQuery (LOG.LOGS) por uma thread em segundo plano.
+# log() nunca bloqueia: com o buffer cheio a mensagem vai só para o stdout.
+log_table_name = 'LOGS'
+log_buffer_size = 20000  # entradas aguardando gravação
+log_batch_rows = 500  # linhas por insert_rows_json
+log_batch_bytes = 1024 * 1024  # tamanho aproximado máximo de um lote (limite da API é 10 MB)
+log_flush_interval = 2.0  # segundos que a thread espera juntando um lote
+log_flush_timeout = 60.0  # espera máxima pela gravação dos logs no fim da requisição
+
+# Métricas por arquivo e por fase (duração, bytes, linhas), gravadas em LOG.METRICAS
+# e somadas no processo para o endpoint /metrics (formato Prometheus)
+metrics_table_name = 'METRICAS'
+metrics_endpoint_enabled = os.environ.get('METRICS_ENDPOINT', '1') == '1'
+
+
+# Fábricas padrão dos clientes. As bibliotecas do Google são importadas aqui, e não no
+# início do módulo, para que o custo do import fique no aquecimento (/warmup) ou na
+# primeira requisição, e não no boot do gunicorn.
+def new_bigquery_client():
+    from google.cloud import bigquery
+    return bigquery.Client()
+
+
+def new_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+
+# Registro dos clientes do BigQuery e do Cloud Storage compartilhados pelo processo.
+# Cada cliente é criado uma única vez (descoberta de credenciais e sessão HTTP com pool
+# de conexões) e reaproveitado por todas as funções e requisições do gunicorn.
+# As fábricas podem ser substituídas (override) para usar clientes falsos em testes.
+# Os clientes criados são contados na execução atual (contador 'clientes_criados').
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories = {
+            'bigquery': new_bigquery_client,
+            'storage': new_storage_client,
+        }
+        self._clients = {}
+
+    def get(self, kind):
+        client = self._clients.get(kind)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(kind)
+                if client is None:
+                    client = self._factories[kind]()
+                    self._clients[kind] = client
+                    count_in_execution('clientes_criados')
+        return client
+
+    # Substitui as fábricas (ex.: override(storage=lambda: FakeStorageClient(raiz)))
+    # e descarta os clientes já criados
+    def override(self, **factories):
+        with self._lock:
+            self._factories.update(factories)
+            self._clients.clear()
+
+
+client_registry = ClientRegistry()
+
+
+# Cliente do BigQuery compartilhado
+def get_bigquery_client():
+    return client_registry.get('bigquery')
+
+
+# Cliente do Cloud Storage compartilhado
+def get_storage_client():
+    return client_registry.get('storage')
+
+
+# Cache dos metadados (existência e schema) das tabelas do BigQuery.
+# Evita repetir get_table para a mesma tabela em check_table_exists,
+# create_table_if_not_exists e compare_columns: com N arquivos da mesma tabela,
+# só o primeiro consulta a API. create_table/update_table atualizam o cache.
+# Com ttl <= 0 uma entrada só vale para execuções que começaram antes da leitura; com ttl > 0
+# as entradas são reaproveitadas entre requisições até expirarem. Nada é limpo no
+# início de uma requisição, então requisições simultâneas não apagam o cache umas das
+# outras. Tabelas inexistentes não são guardadas. Leituras do cache e consultas à API
+# são contadas na execução atual ('cache_tabelas_leituras' e 'cache_tabelas_consultas').
+class TableMetadataCache:
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tables = {}  # table_id -> (table, momento da leitura)
+
+    # Retorna a tabela (do cache ou da API). Erros da API (ex.: NotFound) são propagados.
+    def get(self, table_id):
+        with self._lock:
+            entrada = self._tables.get(table_id)
+        inicio = execution_start()
+        if entrada and (time.monotonic() - entrada[1] < self.ttl if self.ttl > 0
+                        else inicio is None or entrada[1] >= inicio):
+            count_in_execution('cache_tabelas_leituras')
+            return entrada[0]
+        count_in_execution('cache_tabelas_consultas')
+        table = get_bigquery_client().get_table(table_id)
+        self.put(table_id, table)
+        return table
+
+    def put(self, table_id, table):
+        with self._lock:
+            self._tables[table_id] = (table, time.monotonic())
+
+    def invalidate(self, table_id):
+        with self._lock:
+            self._tables.pop(table_id, None)
+
+
+table_cache = TableMetadataCache(ttl=table_cache_ttl)
+
+
+# Execução (requisição) atual e campos de contexto (arquivo, tabela, fase) do log.
+# São ContextVars: cada requisição do gunicorn tem a sua, e as threads de
+# processamento recebem uma cópia do contexto (submit_with_context).
+execucao_atual = contextvars.ContextVar('execucao_atual', default=None)
+contexto_log = contextvars.ContextVar('contexto_log', default={})
+contadores_lock = threading.Lock()
+
+
+# Momento (time.monotonic) do início da execução atual (None fora de uma requisição)
+def execution_start():
+    execucao = execucao_atual.get()
+    return execucao['inicio'] if execucao is not None else None
+
+
+# Soma em um contador da execução atual. As estatísticas por requisição ficam na
+# execução, e não no processo, para que requisições simultâneas (threads do gunicorn,
+# /evento durante uma varredura) não zerem nem somem os números umas das outras.
+def count_in_execution(nome, quantidade=1):
+    execucao = execucao_atual.get()
+    if execucao is not None:
+        with contadores_lock:
+            execucao['contadores'][nome] += quantidade
+
+
+# Valor de um contador da execução atual
+def execution_count(nome):
+    execucao = execucao_atual.get()
+    return execucao['contadores'][nome] if execucao is not None else 0
+
+
+# Logger da execução: cada log vira uma linha com timestamp, sequência, arquivo, tabela,
+# fase e duração, colocada em um buffer limitado. Uma thread em segundo plano grava o
+# buffer no BigQuery em lotes limitados por linhas e bytes; flush() espera as linhas
+# da execução atual serem gravadas (usado no fim da requisição).
+class ExecutionLogger:
+    def __init__(self, buffer_size, batch_rows, batch_bytes, flush_interval):
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.writer = None  # função (nome da tabela, linhas) que grava um lote (None: save_logs_to_bigquery)
+        self._fila = queue.Queue(maxsize=buffer_size)
+        self._cond = threading.Condition()
+        self._flush_pedido = threading.Event()
+        self._thread = None
+
+    # Inicia uma execução no contexto atual e a retorna
+    def start_execution(self, origem):
+        execucao = {
+            'id': f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}",
+            'origem': origem,
+            'inicio': time.monotonic(),
+            'sequencia': itertools.count(1),
+            'pendentes': 0,
+            'descartadas': 0,
+            'contadores': Counter(),  # estatísticas da requisição (count_in_execution)
+        }
+        execucao_atual.set(execucao)
+        contexto_log.set({})
+        return execucao
+
+    def log(self, message, **campos):
+        print(message)
+        execucao = execucao_atual.get()
+        if execucao is None:
+            return  # Fora de uma requisição (ex.: importação do módulo): só stdout
+        campos = {**contexto_log.get(), **campos}
+        duracao = campos.get('duracao')
+        linha = {
+            'Data': datetime.now().isoformat(),
+            'TXT': message,
+            'Execucao': execucao['id'],
+            'Sequencia': next(execucao['sequencia']),
+            'Arquivo': campos.get('arquivo'),
+            'Tabela': campos.get('tabela'),
+            'Fase': campos.get('fase'),
+            'Duracao': round(duracao, 3) if duracao is not None else None,
+        }
+        self.emit(log_table_name, linha, execucao)
+
+    # Coloca uma linha no buffer para ser gravada na tabela informada (LOGS, METRICAS)
+    def emit(self, tabela, linha, execucao=None):
+        execucao = execucao or execucao_atual.get()
+        if execucao is None:
+            return
+        with self._cond:
+            execucao['pendentes'] += 1
+        try:
+            self._fila.put_nowait((execucao, tabela, linha))
+        except queue.Full:
+            with self._cond:
+                execucao['pendentes'] -= 1
+                execucao['descartadas'] += 1
+        self._start_thread()
+
+    def _start_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='execution-logger', daemon=True)
+                    self._thread.start()
+
+    # Loop da thread: junta um lote (até batch_rows/batch_bytes ou flush_interval) e grava,
+    # com um insert por tabela de destino
+    def _run(self):
+        while True:
+            lote = [self._fila.get()]
+            tamanho = len(lote[0][2].get('TXT') or '')
+            prazo = time.monotonic() + self.flush_interval
+            while len(lote) < self.batch_rows and tamanho < self.batch_bytes:
+                restante = prazo - time.monotonic()
+                if restante <= 0 or (self._flush_pedido.is_set() and self._fila.empty()):
+                    break
+                try:
+                    item = self._fila.get(timeout=min(restante, 0.1))
+                except queue.Empty:
+                    continue
+                lote.append(item)
+                tamanho += len(item[2].get('TXT') or '')
+
+            por_tabela = {}
+            for _, tabela, linha in lote:
+                por_tabela.setdefault(tabela, []).append(linha)
+            for tabela, linhas in por_tabela.items():
+                try:
+                    if self.writer:
+                        self.writer(tabela, linhas)
+                    else:
+                        save_logs_to_bigquery(linhas, project_id, log_dataset_name, tabela)
+                except Exception as e:
+                    print(f"Erros ao salvar logs: {e}")
+            with self._cond:
+                for execucao, _, _ in lote:
+                    execucao['pendentes'] -= 1
+                self._cond.notify_all()
+
+    # Espera a gravação das linhas da execução atual (no máximo timeout segundos).
+    # Retorna True se tudo foi gravado.
+    def flush(self, timeout=None):
+        execucao = execucao_atual.get()
+        if execucao is None:
+            return True
+        if execucao['descartadas']:
+            print(f"{execucao['descartadas']} mensagens de log não foram gravadas no BigQuery (buffer cheio).")
+        self._flush_pedido.set()
+        try:
+            with self._cond:
+                return self._cond.wait_for(lambda: execucao['pendentes'] <= 0, timeout)
+        finally:
+            self._flush_pedido.clear()
+
 
-# Variável para armazenar logs de execução
-execution_logs = set()
+logger = ExecutionLogger(log_buffer_size, log_batch_rows, log_batch_bytes, log_flush_interval)
 
 
-# Função de log customizada para armazenar logs
-# Função de log customizada para armazenar logs
-def log(message):
-    print(message)
-    execution_logs.add(message)  # Adiciona a mensagem ao set
+# Função de log customizada para armazenar logs. Campos opcionais (arquivo, tabela,
+# fase, duracao) completam ou substituem os do contexto (log_context).
+def log(message, **campos):
+    logger.log(message, **campos)
+
+
+# Define arquivo/tabela/fase para os logs feitos dentro do bloco
+@contextmanager
+def log_context(**campos):
+    token = contexto_log.set({**contexto_log.get(), **campos})
+    try:
+        yield
+    finally:
+        contexto_log.reset(token)
+
+
+# Envia fn para o executor com uma cópia do contexto atual (execução e campos do log)
+def submit_with_context(executor, fn, *args):
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+# Totais por fase e por tabela acumulados no processo (expostos em /metrics)
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fases = {}  # fase -> {'execucoes', 'segundos', 'bytes', 'linhas', 'erros'}
+        self.arquivos = {}  # (tabela, status) -> {'execucoes', 'segundos', 'bytes', 'linhas', 'erros'}
+        self.encodings = Counter()  # (encoding, detecção) -> arquivos lidos
+
+    @staticmethod
+    def _somar(totais, duracao, bytes_, linhas, status):
+        totais['execucoes'] += 1
+        totais['segundos'] += duracao
+        totais['bytes'] += bytes_ or 0
+        totais['linhas'] += linhas or 0
+        totais['erros'] += status == 'ERRO'
+
+    def observe(self, fase, tabela, duracao, bytes_=None, linhas=None, status='OK'):
+        novo = lambda: {'execucoes': 0, 'segundos': 0.0, 'bytes': 0, 'linhas': 0, 'erros': 0}
+        with self._lock:
+            self._somar(self.fases.setdefault(fase, novo()), duracao, bytes_, linhas, status)
+            if fase == 'arquivo':
+                self._somar(self.arquivos.setdefault((tabela or '-', status), novo()), duracao, bytes_, linhas, status)
+
+    def observe_encoding(self, encoding, deteccao):
+        with self._lock:
+            self.encodings[(encoding, deteccao)] += 1
+
+    # Texto no formato de exposição do Prometheus
+    def render(self):
+        with self._lock:
+            fases = {fase: dict(totais) for fase, totais in self.fases.items()}
+            arquivos = {chave: dict(totais) for chave, totais in self.arquivos.items()}
+            encodings = dict(self.encodings)
+        linhas = []
+        for nome, campo, descricao in (
+            ('sap_ingest_fase_execucoes_total', 'execucoes', 'Quantidade de execuções da fase'),
+            ('sap_ingest_fase_segundos_total', 'segundos', 'Tempo acumulado na fase'),
+            ('sap_ingest_fase_bytes_total', 'bytes', 'Bytes processados na fase'),
+            ('sap_ingest_fase_linhas_total', 'linhas', 'Linhas/registros processados na fase'),
+            ('sap_ingest_fase_erros_total', 'erros', 'Execuções da fase que terminaram com erro'),
+        ):
+            linhas += [f"# HELP {nome} {descricao}", f"# TYPE {nome} counter"]
+            linhas += [f'{nome}{{fase="{fase}"}} {totais[campo]:g}' for fase, totais in sorted(fases.items())]
+        for nome, campo, descricao in (
+            ('sap_ingest_arquivos_total', 'execucoes', 'Arquivos processados por tabela e status'),
+            ('sap_ingest_arquivo_segundos_total', 'segundos', 'Tempo total dos arquivos por tabela e status'),
+        ):
+            linhas += [f"# HELP {nome} {descricao}", f"# TYPE {nome} counter"]
+            linhas += [f'{nome}{{tabela="{tabela}",status="{status}"}} {totais[campo]:g}'
+                       for (tabela, status), totais in sorted(arquivos.items())]
+        nome = 'sap_ingest_encoding_total'
+        linhas += [f"# HELP {nome} Arquivos lidos por encoding e forma de detecção", f"# TYPE {nome} counter"]
+        linhas += [f'{nome}{{encoding="{encoding}",deteccao="{deteccao}"}} {quantidade}'
+                   for (encoding, deteccao), quantidade in sorted(encodings.items())]
+        return "\n".join(linhas) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+# Registra a métrica de uma fase (duração, bytes, linhas) do arquivo/tabela do contexto:
+# grava em LOG.METRICAS (pelo logger, em segundo plano) e soma nos totais de /metrics
+def record_metric(fase, duracao, bytes_=None, linhas=None, status='OK', encoding=None):
+    contexto = contexto_log.get()
+    metrics_registry.observe(fase, contexto.get('tabela'), duracao, bytes_, linhas, status)
+    execucao = execucao_atual.get()
+    if execucao is None:
+        return
+    logger.emit(metrics_table_name, {
+        'Data': datetime.now().isoformat(),
+        'Execucao': execucao['id'],
+        'Arquivo': contexto.get('arquivo'),
+        'Tabela': contexto.get('tabela'),
+        'Fase': fase,
+        'Duracao': round(duracao, 4),
+        'Bytes': bytes_,
+        'Linhas': linhas,
+        'Status': status,
+        'Encoding': encoding,
+    }, execucao)
+
+
+# Registra as fases internas do streaming de um arquivo, medidas no relatório: download,
+# tentativa descartada com outro encoding, gravação do arquivo de carga e o restante
+# (decodificação, validação e correção dos registros)
+def record_stream_metrics(relatorio, duracao):
+    metrics_registry.observe_encoding(relatorio.encoding, relatorio.deteccao_encoding)
+    record_metric('download', relatorio.tempo_leitura, relatorio.bytes_lidos, encoding=relatorio.encoding)
+    if relatorio.tempo_descartado:
+        record_metric('fallback_encoding', relatorio.tempo_descartado, relatorio.bytes_descartados,
+                      encoding=relatorio.encoding)
+    if relatorio.tempo_gravacao:
+        record_metric('upload_temp', relatorio.tempo_gravacao, relatorio.bytes)
+    processamento = duracao - relatorio.tempo_leitura - relatorio.tempo_gravacao - relatorio.tempo_descartado
+    record_metric('validacao_correcao', max(processamento, 0.0), relatorio.bytes_lidos, relatorio.linhas)
+
+
+# Mede um trecho como uma fase (os logs dentro do bloco também recebem a fase).
+# O bloco pode informar bytes/linhas/status no dict retornado (que recebe a duração
+# ao final); exceções marcam ERRO.
+@contextmanager
+def span(fase):
+    medida = {'bytes': None, 'linhas': None, 'status': 'OK'}
+    inicio = time.monotonic()
+    try:
+        with log_context(fase=fase):
+            yield medida
+    except Exception:
+        medida['status'] = 'ERRO'
+        raise
+    finally:
+        medida['duracao'] = time.monotonic() - inicio
+        record_metric(fase, medida['duracao'], medida['bytes'], medida['linhas'], medida['status'])
 
 
 # Função para obter arquivos .txt tabulados por |
 def get_txt_files(bucket_name, folder_name):
-    client = storage.Client()
+    return list(get_txt_blobs(bucket_name, folder_name))
+
+
+# Função para listar os arquivos .txt com os metadados usados pelo manifesto.
+# Pede à API só os campos necessários, deixando a listagem leve mesmo com milhares
+# de objetos. Retorna um dict nome -> blob, na ordem da listagem.
+def get_txt_blobs(bucket_name, folder_name):
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=f"{folder_name}/")  # garante que só venha de SAP/
-    
-    txt_files = [
-        blob.name for blob in blobs
-        if blob.name.endswith('.txt') and blob.name.startswith(f"{folder_name}/")
-    ]
-    return txt_files
+    blobs = bucket.list_blobs(  # garante que só venha de SAP/
+        prefix=f"{folder_name}/",
+        fields="items(name,generation,md5Hash,crc32c,size),nextPageToken",
+    )
+    return {blob.name: blob for blob in blobs if is_input_file(blob.name, folder_name)}
+
+
+# Função para verificar se um objeto é um arquivo de entrada (.txt dentro da pasta de origem)
+def is_input_file(name, folder_name):
+    return name.endswith('.txt') and name.startswith(f"{folder_name}/")
+
+
+# Função para extrair bucket, objeto e generation de uma notificação de finalize do GCS.
+# Aceita o push do Pub/Sub (notificação do bucket: recurso do objeto em base64 no data
+# e bucketId/objectId/objectGeneration nos attributes) e o CloudEvent do Eventarc,
+# tanto em modo binário (corpo = recurso do objeto, id/tipo nos headers ce-*) quanto
+# estruturado. Retorna None para eventos que não são de finalize. Corpo malformado
+# (JSON que não é objeto, data que não é base64/JSON, bucket/objeto que não são texto)
+# levanta ValueError.
+def parse_gcs_event(payload, headers):
+    if not payload:
+        return None
+
+    # Partes do corpo que precisam ser objetos JSON
+    def objeto(valor, nome):
+        if not isinstance(valor, dict):
+            raise ValueError(f"{nome} não é um objeto JSON: {str(valor)[:100]}")
+        return valor
+
+    objeto(payload, 'corpo do evento')
+    if 'message' in payload:
+        message = objeto(payload['message'], 'message')
+        attributes = objeto(message.get('attributes') or {}, 'message.attributes')
+        if attributes.get('eventType', 'OBJECT_FINALIZE') != 'OBJECT_FINALIZE':
+            return None
+        # base64/JSON inválidos levantam binascii.Error/JSONDecodeError (ValueError)
+        dados = json.loads(base64.b64decode(message['data'])) if message.get('data') else {}
+        objeto(dados, 'message.data')
+        evento = {
+            'id': message.get('messageId') or message.get('message_id'),
+            'bucket': dados.get('bucket') or attributes.get('bucketId'),
+            'name': dados.get('name') or attributes.get('objectId'),
+            'generation': str(dados.get('generation') or attributes.get('objectGeneration') or ''),
+        }
+    else:
+        if 'specversion' in payload:
+            event_id, tipo, dados = payload.get('id'), payload.get('type'), payload.get('data') or {}
+        else:
+            event_id, tipo, dados = headers.get('ce-id'), headers.get('ce-type'), payload
+        if (tipo or 'google.cloud.storage.object.v1.finalized') != 'google.cloud.storage.object.v1.finalized':
+            return None
+        objeto(dados, 'data')
+        evento = {
+            'id': event_id,
+            'bucket': dados.get('bucket'),
+            'name': dados.get('name'),
+            'generation': str(dados.get('generation') or ''),
+        }
+
+    for campo in ('bucket', 'name'):
+        if evento[campo] is not None and not isinstance(evento[campo], str):
+            raise ValueError(f"{campo} do evento não é texto: {str(evento[campo])[:100]}")
+    return evento
+
+
+# Controle de eventos já processados nesta instância (Pub/Sub e Eventarc entregam
+# "pelo menos uma vez"). A chave é bucket/objeto#generation, então a mesma versão do
+# arquivo só é processada uma vez mesmo que o evento chegue repetido ou em paralelo.
+# Guarda só os últimos max_eventos; entre instâncias a idempotência vem da própria
+# carga (o arquivo sai de DADOS_1 e a partição é substituída).
+class EventDeduplicator:
+    def __init__(self, max_eventos=1000):
+        self._lock = threading.Lock()
+        self._processados = deque(maxlen=max_eventos)
+        self._em_andamento = set()
+
+    # Retorna False se a chave já foi processada ou está em processamento
+    def begin(self, chave):
+        with self._lock:
+            if chave in self._em_andamento or chave in self._processados:
+                return False
+            self._em_andamento.add(chave)
+            return True
+
+    # Encerra o processamento; com sucesso=False a chave pode ser reprocessada (reentrega)
+    def finish(self, chave, sucesso=True):
+        with self._lock:
+            self._em_andamento.discard(chave)
+            if sucesso:
+                self._processados.append(chave)
+
+
+event_dedup = EventDeduplicator()
+
+
+# Manifesto das cargas concluídas, guardado como JSON no próprio bucket.
+# Para cada tabela + PARTITIONDATE guarda o checksum (md5/crc32c), o nome e a
+# generation do último arquivo carregado com sucesso. Um arquivo reenviado com o
+# mesmo conteúdo para a mesma tabela/partição é reconhecido e não é recarregado.
+# Cada partição tem o seu objeto (<prefixo>/<TABELA>/<AAAAMMDD>.json): a consulta lê
+# só o objeto da partição do arquivo e a gravação substitui só esse objeto, então o
+# custo por arquivo não cresce com o histórico de cargas e execuções concorrentes
+# (eventos) não disputam um objeto único. Na mesma partição vale a última carga gravada.
+class LoadManifest:
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._entries = {}  # partições já lidas ou gravadas nesta execução (None = sem carga)
+
+    def _path(self, table_name, partition_date):
+        return f"{self.prefix}/{table_name}/{partition_date.strftime('%Y%m%d')}.json"
+
+    # Entrada da partição ou None. Um objeto corrompido ou um erro na leitura só fica no
+    # log e a partição é tratada como não carregada: o manifesto não pode parar a execução.
+    def _entry(self, table_name, partition_date):
+        from google.api_core.exceptions import NotFound
+
+        path = self._path(table_name, partition_date)
+        with self._lock:
+            if path in self._entries:
+                return self._entries[path]
+        try:
+            entrada = json.loads(self.bucket.blob(path).download_as_text())
+            if not isinstance(entrada, dict):
+                raise ValueError(f"conteúdo inesperado ({type(entrada).__name__})")
+        except NotFound:
+            entrada = None
+        except Exception as e:
+            log(f"##FALHA## Não foi possível ler o manifesto {path}, partição tratada como não carregada: {e}")
+            entrada = None
+        with self._lock:
+            return self._entries.setdefault(path, entrada)
+
+    # Identificação do conteúdo de um blob no momento da listagem/leitura (antes de
+    # ser movido), usada tanto na consulta quanto no registro da carga
+    @staticmethod
+    def fingerprint(blob):
+        if blob is None:
+            return None
+        return {'arquivo': blob.name, 'generation': blob.generation, 'md5': blob.md5_hash, 'crc32c': blob.crc32c}
+
+    def is_loaded(self, table_name, partition_date, fingerprint):
+        if fingerprint is None:
+            return False
+        entrada = self._entry(table_name, partition_date)
+        if not entrada:
+            return False
+        if fingerprint['md5'] and entrada.get('md5'):
+            return fingerprint['md5'] == entrada['md5']
+        return bool(fingerprint['crc32c']) and fingerprint['crc32c'] == entrada.get('crc32c')
+
+    # Grava a carga concluída no objeto da partição. Uma falha só fica no log: no pior
+    # caso o mesmo conteúdo é carregado de novo (a partição é substituída).
+    def record(self, table_name, partition_date, fingerprint):
+        if fingerprint is None:
+            return
+        path = self._path(table_name, partition_date)
+        entrada = dict(fingerprint, tabela=table_name, particao=str(partition_date),
+                       carregado_em=datetime.now().isoformat())
+        with self._lock:
+            self._entries[path] = entrada
+        try:
+            self.bucket.blob(path).upload_from_string(
+                json.dumps(entrada, ensure_ascii=False, sort_keys=True), content_type='application/json'
+            )
+        except Exception as e:
+            log(f"##FALHA## Não foi possível atualizar o manifesto {path}: {e}")
+
+# Operações do Cloud Storage (movimentação e remoção de arquivos) executadas em segundo
+# plano por um pool de threads, para que o rename_blob (cópia + remoção) de cada arquivo
+# não bloqueie a preparação e a finalização dos arquivos seguintes. close() espera todas
+# as operações; erros inesperados são propagados nesse momento, como no processamento
+# em paralelo. Com max_workers <= 0 cada operação roda na hora, na thread que a pediu.
+# Não usa o batch da API do Cloud Storage: o batch fica associado ao cliente compartilhado
+# e capturaria as requisições das outras threads enquanto estivesse aberto.
+class BlobOperations:
+    def __init__(self, bucket, max_workers=0):
+        self.bucket = bucket
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 0 else None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    # Executa fn(*args) em segundo plano (com o contexto de log de quem pediu)
+    def submit(self, fn, *args):
+        if self._executor is None:
+            fn(*args)
+            return
+        future = submit_with_context(self._executor, fn, *args)
+        with self._lock:
+            self._futures.append(future)
+
+    # Move um objeto dentro do bucket (o original só é removido depois da cópia)
+    def move(self, origem, destino):
+        with span('movimentacao'):
+            self.bucket.rename_blob(self.bucket.blob(origem), destino)
+
+    # Espera as operações pendentes e encerra o pool
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+
+# Pastas (objetos marcadores) já confirmadas no bucket por este processo:
+# ensure_folder_structure só consulta o Cloud Storage na primeira requisição da instância
+# (ou a cada requisição, com BOOTSTRAP_ONCE=0; ver prepare_instance)
+pastas_confirmadas = set()
+
 
 # Função para verificar e criar estrutura de pastas
 def ensure_folder_structure(bucket_name, target_folder, success_folder, failure_folder):
-    client = storage.Client()
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
-    target_blob = bucket.blob(target_folder)
-    success_blob = bucket.blob(f"{target_folder}/{success_folder}/")
-    failure_blob = bucket.blob(f"{target_folder}/{failure_folder}/")
+    pastas = [
+        (target_folder, f"Pasta {target_folder} criada."),
+        (f"{target_folder}/{success_folder}/", f"Pasta {success_folder} criada dentro de {target_folder}."),
+        (f"{target_folder}/{failure_folder}/", f"Pasta {failure_folder} criada dentro de {target_folder}."),
+    ]
 
-    if not target_blob.exists():
-        target_blob.upload_from_string('')
-        log(f"Pasta {target_folder} criada.")
+    for pasta, mensagem in pastas:
+        if f"{bucket_name}/{pasta}" in pastas_confirmadas:
+            continue
+        blob = bucket.blob(pasta)
+        if not blob.exists():
+            blob.upload_from_string('')
+            log(mensagem)
+        pastas_confirmadas.add(f"{bucket_name}/{pasta}")
 
-    if not success_blob.exists():
-        success_blob.upload_from_string('')
-        log(f"Pasta {success_folder} criada dentro de {target_folder}.")
 
-    if not failure_blob.exists():
-        failure_blob.upload_from_string('')
-        log(f"Pasta {failure_folder} criada dentro de {target_folder}.")
+datasets_confirmados = set()  # datasets já verificados/criados neste processo
 
 
 # Função para criar dataset se não existir
 def create_dataset_if_not_exists(dataset_name):
-    client = bigquery.Client()
+    if dataset_name in datasets_confirmados:
+        return
+    client = get_bigquery_client()
     dataset_ref = client.dataset(dataset_name)
     try:
         client.get_dataset(dataset_ref)
         #log(f"Dataset {dataset_name} já existe.")
     except Exception:
+        from google.cloud import bigquery
         dataset = bigquery.Dataset(dataset_ref)
         dataset.location = "US"
         dataset = client.create_dataset(dataset)
         log(f"Dataset {dataset_name} criado.")
+    datasets_confirmados.add(dataset_name)
+
+
+# Função para preparar a estrutura usada pelas requisições (datasets de dados e de log,
+# pastas do bucket). Com bootstrap_once as verificações ficam em cache no processo e só
+# a primeira requisição (ou o aquecimento) chama as APIs.
+def prepare_instance():
+    if not bootstrap_once:
+        datasets_confirmados.clear()
+        pastas_confirmadas.clear()
+    create_dataset_if_not_exists(dataset_name)
+    create_dataset_if_not_exists(log_dataset_name)
+    ensure_folder_structure(bucket_name, target_folder, success_folder, failure_folder)
 
 # Função para verificar se a tabela existe no BigQuery
 def check_table_exists(project_id, dataset_name, table_name):
-    client = bigquery.Client()
     table_id = f"{project_id}.{dataset_name}.{table_name}"
     try:
-        client.get_table(table_id)
+        table_cache.get(table_id)
         return True
     except Exception as e:
         return False
 
 # Função para criar tabela no BigQuery se não existir
 def create_table_if_not_exists(project_id, dataset_name, table_name, schema):
-    client = bigquery.Client()
+    from google.cloud import bigquery
+
+    client = get_bigquery_client()
     table_id = f"{project_id}.{dataset_name}.{table_name}"
     
     if not check_table_exists(project_id, dataset_name, table_name):
@@ -105,7 +834,8 @@ def create_table_if_not_exists(project_id, dataset_name, table_name, schema):
                 type_=bigquery.TimePartitioningType.DAY,
                 field="PARTITIONDATE"
             )
-            client.create_table(table)
+            table = client.create_table(table)
+            table_cache.put(table_id, table)
             log(f"Tabela {table_id} criada.")
         except Exception as e:
             log(f"##FALHA## Erro ao criar tabela {table_id}: {e}")
@@ -122,19 +852,31 @@ def create_table_if_not_exists(project_id, dataset_name, table_name, schema):
     # Limita o comprimento a 128 caracteres (limite do BigQuery)
     #return name[:128]
 
-# Função para sanitizar os nomes das colunas
+# Padrões da sanitização dos nomes das colunas (compilados uma vez)
+padrao_caractere_invalido = re.compile(r'[^a-zA-Z0-9_]')
+padrao_inicio_numerico = re.compile(r'^[0-9]')
+
+# Quantidade de headers (linha bruta) e de nomes de coluna guardados nos caches LRU.
+# Os arquivos SAP de uma mesma tabela chegam todos os dias com o mesmo header.
+header_cache_size = 512
+column_name_cache_size = 8192
+
+
+# Função para sanitizar os nomes das colunas (memorizada: os mesmos nomes se repetem
+# em todos os arquivos de uma tabela e em compare_columns)
+@lru_cache(maxsize=column_name_cache_size)
 def sanitize_column_name(name):
     # Substitui os espaços por _
     name = name.replace(' ', '_')
     # Remove espaços em branco no início e no fim (trim)
     #name = name.strip()
     # Substitui caracteres inválidos por sublinhado
-    name = re.sub(r'[^a-zA-Z0-9_]', '__', name) #Para ficar identico ao PHP 
+    name = padrao_caractere_invalido.sub('__', name) #Para ficar identico ao PHP 
     #name = re.sub(r'[^a-zA-Z0-9_]+', '_', name) #Para apenas um _ para caracter especial
     #name = re.sub(r'[^a-zA-Z0-9_]', '_', name) #Para apenas um _ para cada caracter especial
     #'/[^a-zA-Z0-9_]/' no PHP
     # Certifica-se de que o nome comece com uma letra ou sublinhado
-    if re.match(r'^[0-9]', name):
+    if padrao_inicio_numerico.match(name):
     #if re.match(r'^[0-9]', sanitized): No PHP
         name = '_' + name
     # Limita o comprimento a 128 caracteres (limite do BigQuery)
@@ -155,6 +897,14 @@ def handle_duplicate_columns(columns):
         new_columns.append(sanitized_col)
     return new_columns
 
+
+# Função para obter as colunas finais (sanitizadas e sem duplicadas) a partir da linha
+# bruta do header, com cache LRU pela própria linha. Retorna uma tupla (imutável,
+# pois é compartilhada entre arquivos e threads).
+@lru_cache(maxsize=header_cache_size)
+def normalize_header(header_line):
+    return tuple(handle_duplicate_columns(header_line.split('|')))
+
 # Função para encontrar o header válido
 def find_valid_header(content):
     # Verifica se uma linha tem colunas vazias
@@ -171,153 +921,573 @@ def find_valid_header(content):
 
 
 # Função para criar tabelas particionadas e inserir dados
-def create_partitioned_tables_and_insert_data(txt_files, project_id, dataset_name, bucket_name, target_folder, success_folder, failure_folder):
-    client = bigquery.Client()
-    storage_client = storage.Client()
+def create_partitioned_tables_and_insert_data(txt_files, project_id, dataset_name, bucket_name, target_folder, success_folder, failure_folder, max_workers=1, ingest_backend='uri', partition_replace_mode='truncate', output_format='csv', use_manifest=False, blobs=None, plan_schemas=False):
+    from google.cloud import bigquery
+
+    client = get_bigquery_client()
+    storage_client = get_storage_client()
     bucket = storage_client.bucket(bucket_name)
+    blobs = blobs or {}  # Metadados (md5/crc32c/generation) vindos da listagem, por nome
+
+    # Manifesto dos conteúdos já carregados (tabela + partição -> checksum do arquivo)
+    manifest = None
+    if use_manifest:
+        manifest = LoadManifest(bucket, f"{target_folder}/{manifest_prefix}")
     
     # Regex que valida nomes no formato:
     # nome sem underline (apenas letras, números e espaços) + _ + 8 dígitos (YYYYMMDD) + .txt
     padrao_nome = re.compile(r'^[A-Za-z0-9]+(?: [A-Za-z0-9]+)*_\d{8}\.txt$')
 
-    # Função auxiliar para mover arquivo para a pasta de falha
-    def move_file_to_failure(file):
+    # Movimentações e remoções de arquivos em segundo plano (esperadas no fim da execução)
+    operacoes = BlobOperations(bucket, blob_ops_workers)
+
+    # Função auxiliar para mover arquivo para a pasta de falha. Antes da carga a cópia é
+    # feita na hora (aguardar=True); arquivos rejeitados são movidos em segundo plano.
+    def move_file_to_failure(file, aguardar=True):
         failure_path = f"{target_folder}/{failure_folder}/{file.split('/')[-1]}"
-        blob = bucket.blob(file)
-        bucket.rename_blob(blob, failure_path)
-        log(f"Arquivo {file} movido para {failure_path}.")
+        move_file(file, failure_path, aguardar)
         return failure_path
 
+    # Move um arquivo do bucket e registra no log (na hora ou em segundo plano)
+    def move_file(file, destino, aguardar=False):
+        def mover():
+            operacoes.move(file, destino)
+            log(f"Arquivo {file} movido para {destino}.")
+
+        if aguardar:
+            mover()
+        else:
+            operacoes.submit(mover)
+
+    # Arquivos que têm arquivo de carga gravado na pasta temp -> caminhos gravados
+    # (vários na carga em partes)
+    arquivos_em_temp = {}
+    # Registros validados de cada arquivo no backend 'file', em arquivo local até o envio
+    arquivos_locais = {}
+
     # Função auxiliar para remover arquivo temporário do Cloud Storage
     def remove_temp_file(file):
-        temp_path = f"{target_folder}/temp/{file.split('/')[-1]}"
-        bucket.delete_blob(temp_path)
-        log(f"Arquivo {file} removido da pasta temp.")
+        temp_paths = arquivos_em_temp.pop(file, None)
+        if not temp_paths:
+            return  # Arquivo de carga não chegou a ser gravado (ou backend 'file')
+
+        # Em segundo plano; uma falha na limpeza não muda o resultado do arquivo
+        def remover(temp_path):
+            try:
+                with span('limpeza_temp'):
+                    bucket.delete_blob(temp_path)
+            except Exception as e:
+                log(f"Arquivo temporário {temp_path} não removido: {e}")
+                return
+            if len(temp_paths) == 1:
+                log(f"Arquivo {file} removido da pasta temp.")
+
+        for temp_path in temp_paths:
+            operacoes.submit(remover, temp_path)
+        if len(temp_paths) > 1:
+            log(f"Remoção das {len(temp_paths)} partes do arquivo {file} da pasta temp agendada.")
+
+    # Retorna o nome da tabela de destino de um arquivo (None se o nome estiver fora do padrão)
+    def table_name_for(file):
+        file_name = file.split('/')[-1]
+        if not padrao_nome.match(file_name):
+            return None
+        return file_name.split('_')[0].replace(' ', '_')
+
+    # Lê os headers dos arquivos pendentes (em paralelo) e encontra os incompatíveis com
+    # as tabelas existentes, antes das cargas. Só lê o header de arquivos de tabelas que
+    # já existem e que não serão ignorados pelo manifesto.
+    def plan_file_schemas():
+        colunas_tabelas = {}
+        for table_name in {table_name_for(file) for file in txt_files} - {None}:
+            try:
+                colunas_tabelas[table_name] = table_column_names(
+                    table_cache.get(f"{project_id}.{dataset_name}.{table_name}"))
+            except Exception:
+                pass  # Tabela nova (mesmo critério de check_table_exists): criada na carga
+
+        pendentes = []
+        for file in txt_files:
+            table_name = table_name_for(file)
+            if table_name not in colunas_tabelas:
+                continue
+            if manifest is not None:
+                date_str = file.split('/')[-1].split('_')[1].replace('.txt', '')
+                partition_date = datetime.strptime(date_str, '%Y%m%d').date()
+                metadata = LoadManifest.fingerprint(blobs.get(file) or bucket.get_blob(file))
+                if manifest.is_loaded(table_name, partition_date, metadata):
+                    continue
+            pendentes.append((file, table_name))
+
+        def read_file_header(file):
+            try:
+                return read_header(bucket.blob(file))
+            except Exception as e:
+                log(f"Header do arquivo {file} não lido no planejamento do schema: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=header_plan_workers) as executor:
+            futures = [submit_with_context(executor, read_file_header, file) for file, _ in pendentes]
+        headers = [(file, table_name, future.result())
+                   for (file, table_name), future in zip(pendentes, futures) if future.result()]
+
+        conflitos = plan_schema_conflicts(colunas_tabelas, headers)
+        log(f"Planejamento do schema: {len(headers)} headers lidos de {len(pendentes)} arquivos "
+            f"de tabelas existentes ({len(txt_files)} na execução), "
+            f"{len(conflitos)} arquivos com schema incompatível.")
+        return conflitos
+
+    # Prepara um arquivo (validação, arquivo de carga, tabela, partição) e dispara o
+    # load job sem esperar. Retorna (resultado, carga); carga é None quando o arquivo
+    # já falhou e não há job a acompanhar.
+    def prepare_file(file):
+        inicio = time.monotonic()
+        with log_context(arquivo=file, tabela=table_name_for(file), fase='preparacao'):
+            try:
+                resultado, carga = prepare_file_steps(file)
+            finally:
+                # Arquivo local do backend 'file' (o envio termina dentro da preparação)
+                arquivo_local = arquivos_locais.pop(file, None)
+                if arquivo_local is not None:
+                    arquivo_local.close()
+            if carga:
+                carga['inicio'] = inicio
+            else:
+                record_metric('arquivo', time.monotonic() - inicio, status=resultado['status'])
+        return resultado, carga
 
-    for file in txt_files:
+    def prepare_file_steps(file):
         file_name = file.split('/')[-1]
+        resultado = {'arquivo': file, 'tabela': table_name_for(file), 'status': 'FALHA', 'motivo': ''}
 
         # Validação do padrão do nome do arquivo
         if not padrao_nome.match(file_name):
             log(f"##FALHA## Nome do arquivo fora do padrão: {file}. Movendo para a pasta de falha.")
-            move_file_to_failure(file)
-            continue
+            move_file_to_failure(file, aguardar=False)
+            resultado['motivo'] = 'Nome do arquivo fora do padrão'
+            return resultado, None
 
         table_name, date_str = file.split('/')[-1].split('_')
         table_name = table_name.replace(' ', '_')  # Substituir espaços por '_'
         date_str = date_str.replace('.txt', '')
         partition_date = datetime.strptime(date_str, '%Y%m%d').date()
         table_id = f"{project_id}.{dataset_name}.{table_name}"
+
+        # Arquivo reenviado com o mesmo conteúdo já carregado nesta tabela/partição:
+        # não refaz a carga, apenas move para a pasta de sucesso
+        metadata = None
+        if manifest is not None:
+            metadata = LoadManifest.fingerprint(blobs.get(file) or bucket.get_blob(file))
+            if manifest.is_loaded(table_name, partition_date, metadata):
+                log(f"Arquivo {file} já foi carregado em {table_id} (PARTITIONDATE {partition_date}) "
+                    f"com o mesmo conteúdo. Carga ignorada.")
+                move_file(file, f"{target_folder}/{success_folder}/{table_name}/{file_name}")
+                resultado['status'] = 'IGNORADO'
+                resultado['motivo'] = 'Conteúdo já carregado (manifesto)'
+                return resultado, None
         
-        # Criação do schema com colunas de string
+        # Schema incompatível com a tabela existente, detectado no planejamento: rejeitado
+        # antes de ler o arquivo inteiro
+        conflito = conflitos_schema.get(file)
+        if conflito is not None:
+            file_columns, table_columns, erro = conflito
+            log_schema_comparison(table_columns, file_columns)
+            log(erro)
+            log(f"##FALHA## Esquema do arquivo {file} não corresponde ao da tabela {table_id}. "
+                f"Movendo para a pasta de falha.")
+            move_file_to_failure(file, aguardar=False)
+            resultado['motivo'] = 'Esquema não corresponde ao da tabela'
+            return resultado, None
+
+        # Processa o arquivo em streaming: valida, corrige as linhas quebradas e grava
+        # o arquivo de carga (com PARTITIONDATE) direto na pasta temp do bucket.
+        # No backend 'file' e na saída Parquet só valida nesta etapa: o Parquet precisa
+        # do header antes do primeiro byte, e no backend 'file' os dados vão direto
+        # para o BigQuery na carga. Arquivos grandes (tamanho vindo da listagem) são
+        # gravados em partes comprimidas (carga em partes).
         blob = bucket.blob(file)
-        encoding = 'utf-8'
-        try:
-            content = blob.download_as_text(encoding=encoding)
-        except UnicodeDecodeError:
-            encoding = 'ISO-8859-1'
-            content = blob.download_as_text(encoding=encoding)
-                
-        # Remover BOM se presente
-        content = content.lstrip('\ufeff')
-        
-        # Validação: primeira linha em branco
-        first_line_raw = content.splitlines()[0].strip() if content.splitlines() else ""
-        if not first_line_raw:
-            log(f"##FALHA## Primeira linha em branco no arquivo {file}. Movendo para a pasta de falha.")
-            move_file_to_failure(file)
-            continue
+        temp_blob = bucket.blob(f"{target_folder}/temp/{file.split('/')[-1]}")
+        tamanho = getattr(blobs.get(file), 'size', None) or 0
+        em_partes = 0 < sharded_load_min_mb * 1024 * 1024 <= tamanho
+        with span('streaming') as medida:
+            if ingest_backend == 'file':
+                relatorio, arquivos_locais[file] = spool_file_records(blob)
+            elif output_format == 'parquet':
+                relatorio = scan_file(blob)
+            elif em_partes:
+                relatorio = stream_file_to_temp_shards(blob, bucket, temp_blob.name, partition_date)
+                arquivos_em_temp[file] = relatorio.partes
+            else:
+                relatorio = stream_file_to_temp_blob(blob, temp_blob, partition_date)
+                arquivos_em_temp[file] = [temp_blob.name] if relatorio.bytes else []
+            medida['bytes'], medida['linhas'] = relatorio.bytes_lidos, relatorio.registros
+        record_stream_metrics(relatorio, medida['duracao'])
         
-        # Função mais colunas
-        linhas_excedentes = tem_colunas_excedentes(content)
-        if linhas_excedentes:
-            log(f"##FALHA## Linhas com mais colunas que o header detectadas no arquivo {file}. "
-                f"Problema encontrado nas linhas: {linhas_excedentes}. Movendo para pasta de falha.")
-            move_file_to_failure(file)
-            continue
+        # Validações do relatório (primeira linha, colunas excedentes, header), na ordem
+        motivo = relatorio.motivo_rejeicao()
+        if motivo:
+            if relatorio.primeira_linha_em_branco:
+                log(f"##FALHA## Primeira linha em branco no arquivo {file}. Movendo para a pasta de falha.")
+            elif relatorio.linhas_excedentes:
+                log(f"##FALHA## Linhas com mais colunas que o header detectadas no arquivo {file}. "
+                    f"Problema encontrado nas linhas: {relatorio.linhas_excedentes}. Movendo para pasta de falha.")
+            elif relatorio.registro_muito_longo:
+                log(f"##FALHA## Registro quebrado que não fecha as colunas do header no arquivo {file} "
+                    f"(linha {relatorio.registro_muito_longo}). Movendo para a pasta de falha.")
+            else:
+                log(f"##FALHA## Header inválido encontrado no arquivo {file}.")
+            remove_temp_file(file)
+            move_file_to_failure(file, aguardar=False)
+            resultado['motivo'] = motivo
+            return resultado, None
 
-              
-        # Função para substituir caracteres inválidos e remover quebras de linha dentro de aspas
-        content = replace_invalid_characters(content)
+        # Header válido encontrado nos registros já corrigidos (mesma regra de find_valid_header)
+        columns = list(normalize_header(relatorio.header_linha))
 
-        # Processamento das colunas usando find_valid_header para garantir um header válido
-        first_line = find_valid_header(content)
-        if not first_line:
-            log(f"##FALHA## Header inválido encontrado no arquivo {file}.")
-            move_file_to_failure(file)
-            continue
-        
-        columns = handle_duplicate_columns(first_line)
         
         schema = [
             bigquery.SchemaField('PARTITIONDATE', 'DATE'),
             *[bigquery.SchemaField(col, "STRING") for col in columns]
         ]
 
+        # Formato do arquivo de carga (Parquet só quando o header é o primeiro registro
+        # e todos os registros têm a quantidade de colunas do header)
+        formato = choose_load_format(relatorio, output_format)
+        if output_format == 'parquet' and formato != 'parquet':
+            log(f"Arquivo {file} será carregado como CSV: header fora do primeiro registro "
+                f"ou registros com quantidade de colunas diferente.")
+        if ingest_backend != 'file' and output_format == 'parquet':
+            with span('upload_temp') as medida:
+                relatorio.bytes = upload_stream_to_blob(
+                    iter_load_bytes(blob, relatorio.encoding, partition_date, formato), temp_blob
+                )
+                arquivos_em_temp[file] = [temp_blob.name]
+                medida['bytes'], medida['linhas'] = relatorio.bytes, relatorio.registros
 
         # Mover arquivo para pasta de falha antes de tentar inserção
         failure_path = move_file_to_failure(file)
 
         # Verifica se a tabela já existe e cria se necessário
-        create_table_if_not_exists(project_id, dataset_name, table_name, schema)
+        with span('tabela'):
+            create_table_if_not_exists(project_id, dataset_name, table_name, schema)
+            tabela_existe = check_table_exists(project_id, dataset_name, table_name)
         
         # Verifica se a tabela foi criada com sucesso antes de continuar
-        if not check_table_exists(project_id, dataset_name, table_name):
+        if not tabela_existe:
             log(f"##FALHA## Tabela {table_id} não foi criada. Verifique os logs para mais detalhes.")
-            continue
+            remove_temp_file(file)
+            resultado['motivo'] = 'Tabela não foi criada'
+            return resultado, None
 
         # Compara as colunas do arquivo com as colunas da tabela
-        if compare_columns(file, columns, table_id):
-            # Sempre deleta a partição antes de inserir (idempotência garantida)
-            delete_existing_partition_data(client, table_id, partition_date)
-            log(f"Dados com PARTITIONDATE {partition_date} removidos de {table_id} (se existiam).")
-                
-            # Prepara os dados para inserção usando tempfile
-            temp_file = tempfile.NamedTemporaryFile(delete=False)
-            with temp_file as tf:
-                tf.write(f"PARTITIONDATE|{first_line}\n".encode('utf-8'))
-                for line in content.split('\n')[1:]:
-                    if line.strip():
-                        tf.write(f"{partition_date}|{line}\n".encode('utf-8'))
-                tf.seek(0)  # Move o cursor para o início do arquivo temporário
-
-                temp_blob = bucket.blob(f"{target_folder}/temp/{file.split('/')[-1]}")
-                temp_blob.upload_from_filename(tf.name)
+        with span('compare_columns'):
+            schema_compativel = compare_columns(file, columns, table_id)
+        if not schema_compativel:
+            log(f"##FALHA## Esquema do arquivo {file} não corresponde ao da tabela {table_id}.")
+            remove_temp_file(file)
+            resultado['motivo'] = 'Esquema não corresponde ao da tabela'
+            return resultado, None
+
+        # Sempre substitui a partição do arquivo (idempotência garantida)
+        with span('particao'):
+            load_destination, write_disposition = prepare_partition_replace(
+                client, table_id, partition_date, partition_replace_mode
+            )
             
-            # Configura carga de dados para BigQuery
+        # O arquivo de carga já foi gravado em temp durante o streaming
+        if relatorio.partes:
+            log(f"Arquivo de carga {temp_blob.name} gerado em {len(relatorio.partes)} partes "
+                f"({relatorio.bytes} bytes com gzip, {relatorio.encoding}, {formato}).")
+        elif ingest_backend != 'file':
+            log(f"Arquivo de carga {temp_blob.name} gerado ({relatorio.bytes} bytes, {relatorio.encoding}, {formato}).")
+
+        # Configura carga de dados para BigQuery
+        if formato == 'parquet':
+            # Parquet é autodescritivo: nomes e tipos das colunas vêm do próprio arquivo
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                write_disposition=write_disposition,
+            )
+        else:
             job_config = bigquery.LoadJobConfig(
                 schema=schema,
                 source_format=bigquery.SourceFormat.CSV,
                 field_delimiter='|',
                 skip_leading_rows=1,
-                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                write_disposition=write_disposition,
             )
-            # Carrega os dados do arquivo temporário diretamente para o BigQuery
-            try:
-                load_job = client.load_table_from_uri(
-                    f"gs://{bucket_name}/{target_folder}/temp/{file.split('/')[-1]}",
-                    table_id,
-                    job_config=job_config
-                )
-                log(f"Carregamento de dados para {table_id} iniciado.")
-                load_job.result()  # Espera o carregamento ser concluído
-                log(f"##SUCESSO## Arquivo {file} carregado para tabela {table_id} com sucesso.")
-                
-                # Mover arquivo para pasta de sucesso após inserção bem-sucedida
-                success_path = f"{target_folder}/{success_folder}/{table_name}/{file.split('/')[-1]}"
-                bucket.rename_blob(bucket.blob(failure_path), success_path)
-                log(f"Arquivo {file} movido para {success_path}.")
-                
-                # Remove arquivo da pasta temp após sucesso
-                remove_temp_file(file)
-                
-            except Exception as e:
-                log(f"##FALHA## Erro ao carregar dados para {table_id}: {str(e)}")
-                remove_temp_file(file)
-        else:
-            log(f"##FALHA## Esquema do arquivo {file} não corresponde ao da tabela {table_id}.")
+        # Carrega os dados do arquivo temporário diretamente para o BigQuery
+        # (ou, no backend 'file', envia os registros guardados no arquivo local)
+        try:
+            with span('inicio_carga'):
+                if ingest_backend == 'file':
+                    load_job = stream_file_to_load_job(
+                        client, arquivos_locais[file], load_destination, partition_date, job_config, formato
+                    )
+                else:
+                    # Na carga em partes, um único job com todas as partes (skip_leading_rows
+                    # vale para cada parte, e todas começam com a linha de header)
+                    load_job = client.load_table_from_uri(
+                        [f"gs://{bucket_name}/{parte}" for parte in relatorio.partes]
+                        or f"gs://{bucket_name}/{target_folder}/temp/{file.split('/')[-1]}",
+                        load_destination,
+                        job_config=job_config
+                    )
+            log(f"Carregamento de dados para {table_id} iniciado.")
+        except Exception as e:
+            log(f"##FALHA## Erro ao carregar dados para {table_id}: {str(e)}")
             remove_temp_file(file)
+            resultado['motivo'] = f'Erro ao carregar dados: {e}'
+            return resultado, None
+
+        return resultado, {
+            'job': load_job, 'table_id': table_id, 'table_name': table_name, 'failure_path': failure_path,
+            'partition_date': partition_date, 'metadata': metadata,
+        }
+
+    # Espera o load job de um arquivo e move o arquivo para Sucesso (ou mantém em Falha).
+    # A movimentação para Sucesso roda em segundo plano; a métrica do arquivo é gravada
+    # quando ela termina, com o status final.
+    def finish_load(resultado, carga):
+        with log_context(arquivo=resultado['arquivo'], tabela=carga['table_name'], fase='carga'):
+            resultado = finish_load_steps(resultado, carga)
+            if resultado['status'] == 'SUCESSO':
+                operacoes.submit(move_loaded_file, resultado, carga)
+            else:
+                record_metric('arquivo', time.monotonic() - carga['inicio'], status=resultado['status'])
+        return resultado
+
+    # Move o arquivo carregado de Falha para Sucesso. Se a movimentação falhar o arquivo
+    # continua em Falha e o resultado passa a ser FALHA, como antes.
+    def move_loaded_file(resultado, carga):
+        file = resultado['arquivo']
+        success_path = f"{target_folder}/{success_folder}/{carga['table_name']}/{file.split('/')[-1]}"
+        try:
+            operacoes.move(carga['failure_path'], success_path)
+            log(f"Arquivo {file} movido para {success_path}.")
+        except Exception as e:
+            log(f"##FALHA## Erro ao mover o arquivo {file} para {success_path}: {str(e)}. "
+                f"O arquivo permanece em {carga['failure_path']}.")
+            resultado['status'] = 'FALHA'
+            resultado['motivo'] = f'Erro ao mover para a pasta de sucesso: {e}'
+        record_metric('arquivo', time.monotonic() - carga['inicio'], status=resultado['status'])
+
+    def finish_load_steps(resultado, carga):
+        file = resultado['arquivo']
+        table_id = carga['table_id']
+        try:
+            with span('carga') as medida:
+                carga['job'].result()  # Espera o carregamento ser concluído
+                medida['bytes'] = getattr(carga['job'], 'output_bytes', None)
+                medida['linhas'] = getattr(carga['job'], 'output_rows', None)
+            log(f"##SUCESSO## Arquivo {file} carregado para tabela {table_id} com sucesso.",
+                duracao=time.monotonic() - carga['inicio'])
+            if manifest is not None:
+                operacoes.submit(manifest.record, carga['table_name'], carga['partition_date'], carga['metadata'])
             
+            # Remove arquivo da pasta temp após sucesso (a movimentação para a pasta de
+            # sucesso é feita por finish_load)
+            remove_temp_file(file)
+            resultado['status'] = 'SUCESSO'
+            
+        except Exception as e:
+            log(f"##FALHA## Erro ao carregar dados para {table_id}: {str(e)}")
+            remove_temp_file(file)
+            resultado['motivo'] = f'Erro ao carregar dados: {e}'
+        return resultado
+
+    # Processa um único arquivo do início ao fim e retorna o resultado para o resumo da execução
+    def process_file(file):
+        resultado, carga = prepare_file(file)
+        return finish_load(resultado, carga) if carga else resultado
+
+    # Planejamento do schema (rejeição antecipada dos headers incompatíveis) antes das cargas
+    conflitos_schema = {}
+    if plan_schemas:
+        with span('planejamento_schema'):
+            conflitos_schema = plan_file_schemas()
+
+    try:
+        if async_load_jobs:
+            resultados = process_files_async(txt_files, table_name_for, prepare_file, finish_load, max_workers)
+        elif max_workers <= 1:
+            resultados = [process_file(file) for file in txt_files]
+        else:
+            resultados = process_files_concurrently(txt_files, table_name_for, process_file, max_workers)
+    finally:
+        # Espera as movimentações e remoções em segundo plano (o resumo usa o status final)
+        with span('operacoes_storage'):
+            operacoes.close()
+    return resultados
+
+
+# Modo concorrente: arquivos da mesma tabela ficam no mesmo grupo e são processados
+# em ordem (DELETE/APPEND da partição e evolução de schema continuam serializados);
+# grupos de tabelas diferentes rodam em paralelo. Arquivos com nome fora do padrão
+# não têm tabela e formam grupos individuais.
+def process_files_concurrently(txt_files, table_name_for, process_file, max_workers):
+    resultados = [None] * len(txt_files)
+    grupos = {}
+    for i, file in enumerate(txt_files):
+        grupos.setdefault(table_name_for(file) or f"#{i}", []).append(i)
+
+    # Processa em sequência os arquivos de um mesmo grupo (mesma tabela)
+    def process_group(indices):
+        return [(i, process_file(txt_files[i])) for i in indices]
+
+    log(f"Processando {len(txt_files)} arquivos de {len(grupos)} tabelas com até {max_workers} workers.")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [submit_with_context(executor, process_group, indices) for indices in grupos.values()]
+
+    # Erros inesperados interrompem a execução, como no modo sequencial
+    for future in futures:
+        for i, resultado in future.result():
+            resultados[i] = resultado
+    return resultados
+
+
+# Modo assíncrono: dispara os load jobs sem bloquear e acompanha todos com um único
+# waiter (wait_load_jobs). A preparação dos arquivos roda em até max_workers threads
+# e, a cada job concluído, o arquivo é finalizado (Sucesso/Falha, limpeza do temp) e
+# o próximo arquivo da mesma tabela é iniciado. Arquivos da mesma tabela continuam em
+# sequência; o tempo total tende ao da tabela mais lenta, e não à soma de todos os jobs.
+def process_files_async(txt_files, table_name_for, prepare_file, finish_load, max_workers=1):
+    resultados = [None] * len(txt_files)
+    filas = {}
+    for i, file in enumerate(txt_files):
+        filas.setdefault(table_name_for(file) or f"#{i}", deque()).append(i)
+
+    preparando = {}  # future da preparação -> (tabela, índice)
+    carregando = {}  # índice -> (tabela, resultado, carga)
+    erro = None  # primeiro erro inesperado, repassado depois que os jobs em andamento terminam
+
+    log(f"Processando {len(txt_files)} arquivos de {len(filas)} tabelas com load jobs assíncronos.")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+
+        # Inicia a preparação do próximo arquivo da tabela (se houver)
+        def iniciar_proximo(tabela):
+            if filas[tabela]:
+                i = filas[tabela].popleft()
+                preparando[submit_with_context(executor, prepare_file, txt_files[i])] = (tabela, i)
+
+        for tabela in filas:
+            iniciar_proximo(tabela)
+
+        while preparando or carregando:
+            # Espera alguma preparação terminar; com jobs em andamento, espera no máximo
+            # um intervalo de consulta antes de verificar os jobs
+            prontos = set()
+            if preparando:
+                prontos, _ = futures_wait(list(preparando), return_when=FIRST_COMPLETED,
+                                          timeout=load_job_poll_interval if carregando else None)
+            for future in prontos:
+                tabela, i = preparando.pop(future)
+                try:
+                    resultado, carga = future.result()
+                except Exception as e:
+                    # Como no modo com threads: os arquivos seguintes da tabela não são
+                    # processados, as demais tabelas continuam e o erro é repassado no fim
+                    erro = erro or e
+                    continue
+                if carga:
+                    carregando[i] = (tabela, resultado, carga)
+                else:
+                    resultados[i] = resultado
+                    iniciar_proximo(tabela)
+
+            if not carregando:
+                continue
+
+            # Com preparações pendentes só consulta os jobs uma vez; senão espera o próximo concluir
+            jobs = {i: carga['job'] for i, (_, _, carga) in carregando.items()}
+            concluidos, _ = wait_load_jobs(jobs, timeout=0 if preparando else None)
+            for i in concluidos:
+                tabela, resultado, carga = carregando.pop(i)
+                try:
+                    resultados[i] = finish_load(resultado, carga)
+                except Exception as e:
+                    erro = erro or e
+                    continue
+                iniciar_proximo(tabela)
+
+    # Erros inesperados interrompem a execução, como nos outros modos
+    if erro is not None:
+        raise erro
+    return resultados
+
+
+# Espera um conjunto de load jobs (dict chave -> job) consultando todos no mesmo loop,
+# como concurrent.futures.wait. Retorna (chaves concluídas, chaves pendentes).
+def wait_load_jobs(jobs, timeout=None, return_when=FIRST_COMPLETED):
+    pendentes = set(jobs)
+    concluidos = set()
+    inicio = time.monotonic()
+    intervalo = min(0.5, load_job_poll_interval)
+
+    while True:
+        for chave in list(pendentes):
+            try:
+                pronto = jobs[chave].done()
+            except Exception:
+                pronto = True  # O erro aparece no job.result() de finish_load
+            if pronto:
+                pendentes.discard(chave)
+                concluidos.add(chave)
+
+        if not pendentes or (concluidos and return_when == FIRST_COMPLETED):
+            return concluidos, pendentes
+
+        espera = intervalo
+        if timeout is not None:
+            restante = timeout - (time.monotonic() - inicio)
+            if restante <= 0:
+                return concluidos, pendentes
+            espera = min(espera, restante)
+        time.sleep(espera)
+        intervalo = min(intervalo * 2, load_job_poll_interval)
+
+
+# Função para registrar o resumo da execução (um resultado por arquivo, na ordem de entrada)
+def log_summary(resultados):
+    sucessos = sum(1 for r in resultados if r['status'] == 'SUCESSO')
+    ignorados = sum(1 for r in resultados if r['status'] == 'IGNORADO')
+    log(f"Resumo: {len(resultados)} arquivos processados, {sucessos} com sucesso, "
+        f"{ignorados} já carregados, {len(resultados) - sucessos - ignorados} com falha.")
+    for r in resultados:
+        log(f"Resumo: {r['arquivo']} | {r['tabela'] or '-'} | {r['status']}"
+            + (f" | {r['motivo']}" if r['motivo'] else ""))
+
+
+# Função para verificar se a tabela aceita substituir a partição pelo decorator
+# tabela$YYYYMMDD (particionamento diário pela coluna PARTITIONDATE, como em
+# create_table_if_not_exists)
+def supports_partition_truncate(table):
+    from google.cloud import bigquery
+
+    partitioning = table.time_partitioning
+    return (
+        partitioning is not None
+        and partitioning.type_ == bigquery.TimePartitioningType.DAY
+        and partitioning.field == 'PARTITIONDATE'
+    )
+
+
+# Função para preparar a substituição da partição do arquivo.
+# Retorna o destino da carga e o write_disposition: no modo 'truncate' a própria
+# carga substitui a partição (WRITE_TRUNCATE em tabela$YYYYMMDD); no modo 'dml' ou
+# quando o particionamento da tabela não confere, a partição é apagada aqui com DELETE
+# e a carga é feita em WRITE_APPEND.
+def prepare_partition_replace(client, table_id, partition_date, mode='truncate'):
+    from google.cloud import bigquery
+
+    if mode == 'truncate' and supports_partition_truncate(table_cache.get(table_id)):
+        log(f"Partição {partition_date} de {table_id} será substituída pela carga (WRITE_TRUNCATE).")
+        return f"{table_id}${partition_date.strftime('%Y%m%d')}", bigquery.WriteDisposition.WRITE_TRUNCATE
+
+    delete_existing_partition_data(client, table_id, partition_date)
+    log(f"Dados com PARTITIONDATE {partition_date} removidos de {table_id} (se existiam).")
+    return table_id, bigquery.WriteDisposition.WRITE_APPEND
+
 
 # Função para excluir dados com a mesma PARTITIONDATE
 def delete_existing_partition_data(client, table_id, partition_date):
@@ -347,63 +1517,775 @@ def tem_colunas_excedentes(content):
 
     
 
-# Função para substituir caracteres inválidos e remover quebras de linha
-def replace_invalid_characters(content):
-    content = content.replace('"', '')
-    linhas = content.splitlines()
-    header = linhas[0].strip()
-    num_separadores = header.count("|")
+# Função geradora que remonta os registros quebrados em uma única passada.
+# Recebe qualquer iterável de linhas (arquivo, StringIO, blocos decodificados),
+# remove as aspas e junta as linhas até que o registro tenha o mesmo número de
+# separadores "|" do header, entregando um registro corrigido por vez.
+def iter_registros_corrigidos(linhas, num_separadores=None):
+    pendentes = []  # pedaços do registro quebrado, juntados quando o registro fecha
+    separadores_pendentes = 0
 
-    texto_corrigido = content  # Inicializa com o texto original
-    while True:
-        linhas = texto_corrigido.splitlines()
-        linhas_corrigidas = []
-        linha_pendente = ""
-        mudou = False  # Flag para verificar se houve alguma mudança
-
-        for linha in linhas:
+    for bloco in linhas:
+        for linha in bloco.replace('"', '').splitlines():
             linha = linha.strip()
 
+            # O header é sempre a primeira linha do conteúdo (mesmo se estiver em branco)
+            if num_separadores is None:
+                num_separadores = linha.count("|")
+
             if not linha:
                 continue
 
-            if linha_pendente:
-                linha = linha_pendente + linha
-                linha_pendente = ""
+            separadores = linha.count("|")
+            if pendentes:
+                separadores += separadores_pendentes
 
-            if linha.count("|") == num_separadores:
-                linhas_corrigidas.append(linha)
+            if separadores == num_separadores:
+                if pendentes:
+                    pendentes.append(linha)
+                    linha = "".join(pendentes)
+                    pendentes = []
+                yield linha
             else:
-                linha_pendente = linha + " "
-                mudou = True  # Indica que uma linha foi quebrada e precisa ser corrigida
+                pendentes += [linha, " "]
+                separadores_pendentes = separadores
 
-        if linha_pendente:
-            linhas_corrigidas.append(linha_pendente)
-            mudou = True  # Garante que a última linha pendente seja considerada
+    # Registro incompleto no fim do arquivo é entregue como está (sem o espaço de junção)
+    if pendentes:
+        yield "".join(pendentes).rstrip()
 
-        texto_corrigido = "\n".join(linhas_corrigidas)
 
-        if not mudou:
-            break  # Se não houve mudanças, todas as quebras foram corrigidas
-    
-    content = content.replace('"', '') 
-    return texto_corrigido
+# Função para substituir caracteres inválidos e remover quebras de linha
+def replace_invalid_characters(content):
+    return "\n".join(iter_registros_corrigidos(StringIO(content)))
            
            
-# Função para comparar colunas do arquivo com a tabela no BigQuery
-def compare_columns(file, columns, table_id):
-    client = bigquery.Client()
-    table = client.get_table(table_id)
+# ---- PIPELINE EM STREAMING (blob -> validação -> correção -> PARTITIONDATE -> upload) ----
+# Cada etapa é um gerador que recebe a saída da etapa anterior, então o arquivo
+# nunca é carregado inteiro em memória. As etapas aceitam qualquer objeto com
+# open('rb')/open('wb') (blobs do Cloud Storage ou arquivos locais de teste).
+
+# Etapa 1: lê o blob em blocos de bytes
+def iter_blocos_blob(blob, chunk_size=None, relatorio=None):
+    chunk_size = chunk_size or stream_chunk_size
+    with blob.open('rb', chunk_size=chunk_size) as arquivo:
+        while True:
+            inicio = time.monotonic()
+            bloco = arquivo.read(chunk_size)
+            if relatorio is not None:  # tempo de download e bytes lidos (métricas)
+                relatorio.tempo_leitura += time.monotonic() - inicio
+                relatorio.bytes_lidos += len(bloco)
+            if not bloco:
+                break
+            yield bloco
+
+
+# Decodifica os blocos de forma incremental. Com encoding 'auto' o arquivo é lido como
+# UTF-8 até o primeiro byte fora do ASCII decidir o encoding: se ali o UTF-8 já é
+# inválido, tudo o que veio antes era ASCII (igual em UTF-8 e ISO-8859-1) e o restante
+# é decodificado como ISO-8859-1 sem baixar o arquivo de novo. Um erro de UTF-8 depois
+# disso (arquivo com os dois encodings) é propagado, e o chamador refaz a leitura
+# inteira em ISO-8859-1, como antes.
+def iter_textos_decodificados(blocos, encoding='utf-8', relatorio=None):
+    decoder = codecs.getincrementaldecoder('utf-8' if encoding == 'auto' else encoding)()
+    decidido = encoding != 'auto'
+
+    # O último "bloco" vazio com final=True valida o fim do arquivo
+    for bloco, final in itertools.chain(((bloco, False) for bloco in blocos), [(b'', True)]):
+        if decidido:
+            yield decoder.decode(bloco, final)
+            continue
+        pendente = decoder.getstate()[0]  # início de caractere multibyte do bloco anterior
+        try:
+            texto = decoder.decode(bloco, final)
+            if not texto.isascii():
+                decidido = True
+                if relatorio is not None:
+                    relatorio.deteccao_encoding = 'utf-8'
+        except UnicodeDecodeError as e:
+            dados = pendente + bloco  # as posições do erro contam a partir do pendente
+            if not dados[:e.start].isascii():
+                raise
+            decoder = codecs.getincrementaldecoder('ISO-8859-1')()
+            texto = decoder.decode(dados, final)
+            decidido = True
+            if relatorio is not None:
+                relatorio.encoding, relatorio.deteccao_encoding = 'ISO-8859-1', 'troca'
+        yield texto
+
+
+# Etapa 2: decodifica os blocos de forma incremental e entrega uma linha por vez
+# (com a quebra de linha, como content.splitlines(keepends=True)), removendo o BOM
+# (registrado no relatório, quando informado)
+def iter_linhas_decodificadas(blocos, encoding='utf-8', relatorio=None):
+    pendente = ""
+    inicio = True
+
+    for texto in iter_textos_decodificados(blocos, encoding, relatorio):
+        if inicio:
+            if relatorio is not None and texto.startswith('\ufeff'):
+                relatorio.bom = True
+            texto = texto.lstrip('\ufeff')
+            inicio = not texto
+        pendente += texto
+        # Só corta no último \n para não separar um \r\n que chegou em blocos diferentes
+        corte = pendente.rfind('\n')
+        if corte >= 0:
+            yield from pendente[:corte + 1].splitlines(keepends=True)
+            pendente = pendente[corte + 1:]
+
+    if pendente:
+        yield from pendente.splitlines(keepends=True)
+
+
+# Relatório de validação de um arquivo, preenchido em uma única passada por
+# iter_registros_validados (primeira linha, colunas por linha, header, encoding/BOM)
+class ValidationReport:
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self.bom = False
+        self.bytes = 0  # tamanho do arquivo de carga gravado (quando há)
+        self.bytes_lidos = 0  # tamanho do arquivo de origem
+        self.tempo_leitura = 0.0  # segundos esperando o download dos blocos
+        self.tempo_gravacao = 0.0  # segundos enviando o arquivo de carga
+        self.tempo_descartado = 0.0  # segundos gastos em tentativas com outro encoding
+        self.bytes_descartados = 0  # bytes baixados nessas tentativas
+        # Como o encoding foi definido: 'ascii' (nenhum byte fora do ASCII), 'utf-8',
+        # 'troca' (ISO-8859-1 detectado durante a leitura) ou 'releitura' (ISO-8859-1
+        # após descartar uma leitura em UTF-8)
+        self.deteccao_encoding = 'ascii'
+        self.linhas = 0  # linhas não vazias do arquivo de origem
+        self.primeira_linha_em_branco = True
+        self.colunas_header = 0  # colunas da primeira linha não vazia
+        self.linhas_excedentes = []  # números (entre as linhas não vazias) com mais colunas que o header
+        self.registro_muito_longo = 0  # linha em que um registro quebrado passou de max_registro_chars
+        self.separadores = Counter()  # quantidade de linhas por número de separadores "|"
+        self.linhas_juntadas = 0  # linhas quebradas juntadas ao registro anterior
+        self.registros = 0  # registros após a correção (incluindo o header)
+        self.header = []  # primeiro registro com todas as colunas preenchidas
+        self.header_linha = ''  # o mesmo registro sem separar (chave do cache de normalize_header)
+        self.header_no_primeiro_registro = False
+        self.registro_header = 0  # posição do header entre os registros (1 = primeiro)
+        self.registros_fora_do_header = 0  # registros com quantidade de colunas diferente do primeiro
+        self.partes = []  # arquivos de carga gravados na carga em partes
+
+    # Maior quantidade de colunas encontrada em uma linha
+    @property
+    def colunas_max(self):
+        return max(self.separadores) + 1 if self.separadores else 0
+
+    # Motivo da rejeição do arquivo, na ordem das validações, ou None se o arquivo é válido
+    def motivo_rejeicao(self):
+        if self.primeira_linha_em_branco:
+            return 'Primeira linha em branco'
+        if self.linhas_excedentes:
+            return (f"{len(self.linhas_excedentes)} linhas com mais colunas que o header "
+                    f"(header com {self.colunas_header}, até {self.colunas_max} colunas)")
+        if self.registro_muito_longo:
+            return (f"Registro quebrado sem fechar as colunas do header até a linha {self.registro_muito_longo} "
+                    f"(limite de {max_registro_chars} caracteres)")
+        if not self.header:
+            return f"Header inválido: nenhum dos {self.registros} registros tem todas as colunas preenchidas"
+        return None
+
+    # Soma a este relatório o de uma parte do arquivo (carga em partes), continuando a
+    # numeração das linhas e dos registros. A primeira parte traz a primeira linha e o BOM.
+    def acumular(self, parcial, primeira=False):
+        if primeira:
+            self.bom = parcial.bom
+            self.primeira_linha_em_branco = parcial.primeira_linha_em_branco
+        self.colunas_header = self.colunas_header or parcial.colunas_header
+        self.linhas_excedentes.extend(self.linhas + numero for numero in parcial.linhas_excedentes)
+        if parcial.registro_muito_longo and not self.registro_muito_longo:
+            self.registro_muito_longo = self.linhas + parcial.registro_muito_longo
+        if not self.header and parcial.header:
+            self.header, self.header_linha = parcial.header, parcial.header_linha
+            self.registro_header = self.registros + parcial.registro_header
+            self.header_no_primeiro_registro = self.registro_header == 1
+        self.linhas += parcial.linhas
+        self.separadores.update(parcial.separadores)
+        self.linhas_juntadas += parcial.linhas_juntadas
+        self.registros += parcial.registros
+        self.registros_fora_do_header += parcial.registros_fora_do_header
+
+
+# Etapas 3 a 5 em uma única passada: para cada linha faz o strip e a contagem dos
+# separadores uma vez só e, com eles, valida (primeira linha em branco, linhas com mais
+# colunas que o header, mesmas regras de tem_colunas_excedentes), junta as linhas
+# quebradas (mesma regra de iter_registros_corrigidos) e procura o primeiro header
+# válido (mesma regra de find_valid_header), entregando os registros corrigidos.
+# Depois que o arquivo é rejeitado (primeira linha em branco, linha com colunas a mais ou
+# registro quebrado maior que max_registro_chars) só continua contando as linhas, para o
+# relatório: nenhum registro é juntado nem entregue.
+# Na carga em partes, estado (dict) traz o que veio das partes anteriores (separadores
+# do header, registro pendente...) e recebe o estado no fim desta parte; com final=False
+# o registro pendente não é entregue, pois pode continuar na parte seguinte.
+def iter_registros_validados(linhas, relatorio, estado=None, final=True):
+    estado = {} if estado is None else estado
+    num_separadores = estado.get('num_separadores')
+    # Pedaços do registro quebrado, juntados só quando o registro fecha
+    pendentes = [estado['linha_pendente']] if estado.get('linha_pendente') else []
+    tamanho_pendente = len(pendentes[0]) if pendentes else 0
+    separadores_pendentes = estado.get('separadores_pendentes', 0)
+    separadores_primeiro = estado.get('separadores_primeiro')
+    rejeitado = estado.get('rejeitado', False)
+
+    # Contabiliza um registro corrigido (header e quantidade de colunas)
+    def registrar(registro, separadores):
+        nonlocal separadores_primeiro
+        relatorio.registros += 1
+        if not relatorio.header and all(col.strip() != '' for col in registro.split('|')):
+            relatorio.header = registro.split('|')
+            relatorio.header_linha = registro
+            relatorio.registro_header = relatorio.registros
+            relatorio.header_no_primeiro_registro = relatorio.registros == 1
+        # Só o registro incompleto do fim do arquivo pode ter outra quantidade de colunas
+        if separadores_primeiro is None:
+            separadores_primeiro = separadores
+        elif separadores != separadores_primeiro:
+            relatorio.registros_fora_do_header += 1
+
+    for bloco in linhas:
+        for linha in bloco.splitlines():
+            linha = linha.strip()
+            separadores = linha.count('|')
 
-    # Remove PARTITIONDATE se existir
-    table_columns = [field.name for field in table.schema if field.name != 'PARTITIONDATE']
-    file_columns = [sanitize_column_name(col) for col in columns]
+            # O header é sempre a primeira linha do conteúdo (mesmo se estiver em branco)
+            if num_separadores is None:
+                num_separadores = separadores
+                relatorio.primeira_linha_em_branco = rejeitado = not linha
+            if not linha:
+                continue
 
-    # Se forem exatamente iguais
-    if file_columns == table_columns:
-        log(f"Tabela e arquivo possuem o mesmo schema para {table_id}")
+            relatorio.linhas += 1
+            relatorio.separadores[separadores] += 1
+            if not relatorio.colunas_header:  # primeira linha não vazia
+                relatorio.colunas_header = separadores + 1
+            elif separadores >= relatorio.colunas_header:
+                relatorio.linhas_excedentes.append(relatorio.linhas)
+                rejeitado = True
+            if rejeitado:
+                continue
+
+            # Remoção das aspas (não altera a quantidade de separadores)
+            if '"' in linha:
+                linha = linha.replace('"', '').strip()
+                if not linha:
+                    continue
+
+            if pendentes:
+                separadores += separadores_pendentes
+                relatorio.linhas_juntadas += 1
+
+            if separadores == num_separadores:
+                if pendentes:
+                    pendentes.append(linha)
+                    linha = "".join(pendentes)
+                    pendentes, tamanho_pendente = [], 0
+                registrar(linha, separadores)
+                yield linha
+            else:
+                pendentes += [linha, " "]
+                tamanho_pendente += len(linha) + 1
+                separadores_pendentes = separadores
+                if tamanho_pendente > max_registro_chars:
+                    relatorio.registro_muito_longo = relatorio.linhas
+                    rejeitado = True
+                    pendentes, tamanho_pendente = [], 0
+
+    # Registro incompleto no fim do arquivo é entregue como está (sem o espaço de junção)
+    linha_pendente = "".join(pendentes)
+    if final and linha_pendente and not rejeitado:
+        registrar(linha_pendente.rstrip(), separadores_pendentes)
+        yield linha_pendente.rstrip()
+        linha_pendente = ""
+    estado.update(num_separadores=num_separadores, linha_pendente=linha_pendente,
+                  separadores_pendentes=separadores_pendentes, separadores_primeiro=separadores_primeiro,
+                  rejeitado=rejeitado)
+
+
+# Etapa 6: prefixa os registros com a PARTITIONDATE e entrega os bytes do arquivo de carga.
+# O primeiro registro vira a linha de header (ignorada na carga com skip_leading_rows=1)
+def iter_linhas_particionadas(registros, partition_date):
+    primeiro = True
+    for registro in registros:
+        if primeiro:
+            yield f"PARTITIONDATE|{registro}\n".encode('utf-8')
+            primeiro = False
+        else:
+            yield f"{partition_date}|{registro}\n".encode('utf-8')
+
+
+# Etapa 6 (saída Parquet): converte os registros em lotes de colunas e entrega os bytes
+# de um arquivo Parquet comprimido com PARTITIONDATE (DATE) + colunas sanitizadas (STRING).
+# O primeiro registro é o header (como no CSV, não vira dado). Campos vazios viram NULL,
+# como acontece na carga CSV do BigQuery.
+def iter_parquet_particionado(registros, partition_date, batch_rows=None):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    batch_rows = batch_rows or parquet_batch_rows
+    registros = iter(registros)
+    columns = normalize_header(next(registros, ''))
+    schema = pa.schema(
+        [pa.field('PARTITIONDATE', pa.date32())] + [pa.field(col, pa.string()) for col in columns]
+    )
+    nulo = pa.scalar(None, pa.string())
+    buffer = io.BytesIO()
+
+    # Quebra o lote de registros nas colunas com o pyarrow (sem laço por campo em Python)
+    def gravar_lote(writer, lote):
+        campos = pc.split_pattern(pa.array(lote, pa.string()), pattern='|')
+        arrays = [pa.array([partition_date] * len(lote), pa.date32())]
+        for i in range(len(columns)):
+            coluna = pc.list_element(campos, i)
+            arrays.append(pc.if_else(pc.equal(coluna, ''), nulo, coluna))
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+    # Entrega o que o writer já gravou no buffer e o esvazia
+    def esvaziar():
+        dados = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return dados
+
+    writer = pq.ParquetWriter(buffer, schema, compression=parquet_compression)
+    lote = []
+    for registro in registros:
+        lote.append(registro)
+        if len(lote) >= batch_rows:
+            gravar_lote(writer, lote)
+            lote = []
+            yield esvaziar()
+    if lote:
+        gravar_lote(writer, lote)
+    writer.close()
+    yield esvaziar()
+
+
+# Escolhe o formato do arquivo de carga. O Parquet só é usado quando o header é o
+# primeiro registro (nomes das colunas no arquivo = schema da tabela) e nenhum registro
+# tem quantidade de colunas diferente; caso contrário mantém o CSV, que falha ou carrega
+# exatamente como antes.
+def choose_load_format(relatorio, output_format='csv'):
+    if (output_format == 'parquet' and relatorio.header_no_primeiro_registro
+            and not relatorio.registros_fora_do_header):
+        return 'parquet'
+    return 'csv'
+
+
+# Lê o arquivo de origem e entrega os bytes do arquivo de carga no formato escolhido
+# (registros corrigidos com PARTITIONDATE, em CSV ou Parquet)
+def iter_load_bytes(blob, encoding, partition_date, formato='csv', chunk_size=None):
+    linhas = iter_linhas_decodificadas(iter_blocos_blob(blob, chunk_size), encoding)
+    registros = iter_registros_corrigidos(linhas)
+    if formato == 'parquet':
+        return iter_parquet_particionado(registros, partition_date)
+    return iter_linhas_particionadas(registros, partition_date)
+
+
+# Etapa 7: grava os bytes no destino (blob temporário) em blocos, retornando o total gravado
+def upload_stream_to_blob(partes, blob, chunk_size=None, relatorio=None):
+    total = 0
+    gravacao = 0.0
+    with blob.open('wb', chunk_size=chunk_size or stream_chunk_size) as destino:
+        for parte in partes:
+            inicio = time.monotonic()
+            destino.write(parte)
+            gravacao += time.monotonic() - inicio
+            total += len(parte)
+        inicio = time.monotonic()
+    gravacao += time.monotonic() - inicio  # envio do último bloco no close
+    if relatorio is not None:
+        relatorio.tempo_gravacao += gravacao
+    return total
+
+
+# Envio do arquivo de carga interrompido porque o arquivo foi rejeitado na validação
+class ArquivoRejeitado(Exception):
+    pass
+
+
+# Repassa os bytes do arquivo de carga e, no fim, interrompe o envio se o arquivo foi
+# rejeitado: com a exceção dentro do blob.open('wb') o upload resumable é cancelado e
+# nenhum arquivo de carga fica na pasta temp. Depois da rejeição a validação não entrega
+# mais registros, então o restante do arquivo não chega a ser enviado.
+def iter_envio_validado(partes, relatorio):
+    yield from partes
+    motivo = relatorio.motivo_rejeicao()
+    if motivo:
+        raise ArquivoRejeitado(motivo)
+
+
+# Relatório de uma tentativa de leitura ('auto' começa como UTF-8; ver iter_textos_decodificados)
+def new_report(encoding, descartado=0.0, bytes_descartados=0):
+    relatorio = ValidationReport('utf-8' if encoding == 'auto' else encoding)
+    relatorio.tempo_descartado = descartado
+    relatorio.bytes_descartados = bytes_descartados
+    if encoding != 'auto':
+        relatorio.deteccao_encoding = 'releitura'
+    return relatorio
+
+
+# Percorre o arquivo apenas para validação (sem gravar nada) e retorna o mesmo
+# relatório de stream_file_to_temp_blob. Usado pelo backend 'file'.
+def scan_file(blob, chunk_size=None):
+    descartado, bytes_descartados = 0.0, 0
+    for encoding in ('auto', 'ISO-8859-1'):
+        inicio = time.monotonic()
+        relatorio = new_report(encoding, descartado, bytes_descartados)
+        linhas = iter_linhas_decodificadas(iter_blocos_blob(blob, chunk_size, relatorio), encoding, relatorio)
+        try:
+            for _ in iter_registros_validados(linhas, relatorio):
+                pass
+            return relatorio
+        except UnicodeDecodeError:
+            descartado += time.monotonic() - inicio
+            bytes_descartados += relatorio.bytes_lidos
+            continue
+
+
+# Valida o arquivo (como scan_file) e guarda os registros corrigidos em um arquivo
+# local temporário (UTF-8, um por linha), na mesma leitura do blob. Usado pelo backend
+# 'file': a carga envia os registros a partir do arquivo local, sem baixar o blob de
+# novo. Retorna (relatório, arquivo local); o chamador fecha o arquivo (que é apagado).
+def spool_file_records(blob, chunk_size=None):
+    descartado, bytes_descartados = 0.0, 0
+    local = tempfile.TemporaryFile(dir=local_spool_dir)
+    try:
+        for encoding in ('auto', 'ISO-8859-1'):
+            inicio = time.monotonic()
+            relatorio = new_report(encoding, descartado, bytes_descartados)
+            linhas = iter_linhas_decodificadas(iter_blocos_blob(blob, chunk_size, relatorio), encoding, relatorio)
+            local.seek(0)
+            local.truncate()
+            try:
+                for registro in iter_registros_validados(linhas, relatorio):
+                    local.write(registro.encode('utf-8') + b"\n")
+            except UnicodeDecodeError:
+                descartado += time.monotonic() - inicio
+                bytes_descartados += relatorio.bytes_lidos
+                continue
+            local.seek(0)
+            return relatorio, local
+    except BaseException:
+        local.close()
+        raise
+
+
+# Registros guardados por spool_file_records
+def iter_registros_locais(local):
+    local.seek(0)
+    for linha in local:
+        yield linha[:-1].decode('utf-8')
+
+
+# Adapta um gerador de bytes para um arquivo binário somente leitura, que é o que
+# load_table_from_file espera. read(n) sempre devolve n bytes (exceto no fim), pois
+# o upload resumable interpreta uma leitura menor como fim do arquivo. Não permite
+# seek: um upload interrompido não é retomado do meio, e sim refeito do início por
+# stream_file_to_load_job.
+class GeneratorReader(io.RawIOBase):
+    def __init__(self, partes):
+        self._partes = iter(partes)
+        self._buffer = b""
+        self._posicao = 0
+
+    def readable(self):
         return True
 
+    def tell(self):
+        return self._posicao
+
+    def read(self, size=-1):
+        blocos = [self._buffer]
+        total = len(self._buffer)
+        while size < 0 or total < size:
+            parte = next(self._partes, None)
+            if parte is None:
+                break
+            blocos.append(parte)
+            total += len(parte)
+        dados = b"".join(blocos)
+        if size >= 0:
+            dados, self._buffer = dados[:size], dados[size:]
+        else:
+            self._buffer = b""
+        self._posicao += len(dados)
+        return dados
+
+    def readinto(self, b):
+        dados = self.read(len(b))
+        b[:len(dados)] = dados
+        return len(dados)
+
+
+# Envia os registros corrigidos (arquivo local de spool_file_records), prefixados com
+# PARTITIONDATE, direto para o BigQuery com load_table_from_file (upload resumable em
+# streaming, sem blob temporário). Retorna o load job já criado, sem esperar a conclusão.
+# O cliente do BigQuery não retoma um upload interrompido (só repete o bloco em envio),
+# então uma falha no upload refaz o envio inteiro a partir do arquivo local, até
+# file_upload_attempts vezes. Erros 4xx não são repetidos.
+def stream_file_to_load_job(client, local, table_id, partition_date, job_config, formato='csv'):
+    from google.api_core.exceptions import ClientError
+
+    for tentativa in range(1, file_upload_attempts + 1):
+        registros = iter_registros_locais(local)
+        if formato == 'parquet':
+            partes = iter_parquet_particionado(registros, partition_date)
+        else:
+            partes = iter_linhas_particionadas(registros, partition_date)
+        try:
+            return client.load_table_from_file(GeneratorReader(partes), table_id, job_config=job_config)
+        except ClientError:
+            raise
+        except Exception as e:
+            if tentativa == file_upload_attempts:
+                raise
+            log(f"Envio para {table_id} interrompido (tentativa {tentativa} de {file_upload_attempts}): {e}. "
+                f"Refazendo o envio a partir do arquivo local.")
+
+
+# Monta o pipeline completo de um arquivo: lê o blob de origem, valida, corrige as
+# linhas quebradas, prefixa a PARTITIONDATE e grava no blob temporário.
+# Retorna o relatório de validação (ValidationReport). Arquivos rejeitados não gravam
+# o blob temporário (relatorio.bytes fica 0).
+def stream_file_to_temp_blob(blob, temp_blob, partition_date, chunk_size=None):
+    descartado, bytes_descartados = 0.0, 0
+    for encoding in ('auto', 'ISO-8859-1'):
+        inicio = time.monotonic()
+        relatorio = new_report(encoding, descartado, bytes_descartados)
+        linhas = iter_linhas_decodificadas(iter_blocos_blob(blob, chunk_size, relatorio), encoding, relatorio)
+        registros = iter_registros_validados(linhas, relatorio)
+        try:
+            relatorio.bytes = upload_stream_to_blob(
+                iter_envio_validado(iter_linhas_particionadas(registros, partition_date), relatorio),
+                temp_blob, chunk_size, relatorio
+            )
+            return relatorio
+        except ArquivoRejeitado:
+            return relatorio
+        except UnicodeDecodeError:
+            # UTF-8 inválido depois de caracteres UTF-8 válidos: refaz o streaming
+            # como ISO-8859-1 (sobrescreve o temp)
+            descartado += time.monotonic() - inicio
+            bytes_descartados += relatorio.bytes_lidos
+            continue
+
+
+# ---- CARGA EM PARTES (arquivos grandes) ----
+# O arquivo é lido uma vez e dividido em partes terminadas em \n. Cada parte é validada,
+# corrigida e comprimida em um processo do pool, supondo que começa em um registro novo
+# (sem registro quebrado vindo da parte anterior). Os resultados são juntados na ordem:
+# se a parte anterior terminou no meio de um registro, ou se o encoding mudou depois do
+# envio, a parte é refeita no processo principal com o estado correto. Assim os registros
+# e o relatório são os mesmos do streaming em um único arquivo.
+
+# Pool de processos da carga em partes, criado no primeiro uso e reaproveitado pelas
+# requisições seguintes. Usa 'spawn': o processo do gunicorn tem threads (logger,
+# requisições) e um fork copiaria locks em uso por elas.
+class ShardPool:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get(self):
+        with self._lock:
+            if self._executor is None:
+                import atexit
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+shard_pool = ShardPool(shard_workers)
+
+
+# Junta os blocos lidos em partes de pelo menos tamanho bytes, cortadas depois de um \n
+# (o \n nunca faz parte de um caractere multibyte, então cada parte decodifica sozinha).
+# Entrega (parte, final); final indica a última parte do arquivo.
+def iter_partes_bytes(blocos, tamanho):
+    acumulado = bytearray()
+    anterior = None
+    for bloco in blocos:
+        acumulado += bloco
+        inicio = 0
+        while len(acumulado) - inicio >= tamanho:
+            corte = acumulado.find(b'\n', inicio + tamanho - 1)
+            if corte < 0:
+                break
+            if anterior is not None:
+                yield anterior, False
+            anterior = bytes(acumulado[inicio:corte + 1])
+            inicio = corte + 1
+        del acumulado[:inicio]
+    if acumulado:
+        if anterior is not None:
+            yield anterior, False
+        anterior = bytes(acumulado)
+    if anterior is not None:
+        yield anterior, True
+
+
+# Valida, corrige e comprime uma parte do arquivo (executada no pool de processos).
+# estado: estado de iter_registros_validados no início da parte, mais colunas_header e
+# primeiro_registro (linha de header repetida em cada parte, já que skip_leading_rows
+# vale para cada arquivo da carga). Retorna (relatório da parte, estado no fim da parte,
+# arquivo de carga em gzip ou None se a parte não tem registros, parte só com ASCII).
+# Erros de decodificação são propagados.
+def process_shard(dados, encoding, estado, partition_date, primeira=False, final=True):
+    import gzip
+
+    estado = dict(estado)
+    relatorio = ValidationReport(encoding)
+    relatorio.colunas_header = estado.get('colunas_header', 0)
+    texto = dados.decode(encoding)
+    if primeira:
+        relatorio.bom = texto.startswith('\ufeff')
+        texto = texto.lstrip('\ufeff')
+
+    # O primeiro registro do arquivo é a linha de header do arquivo de carga; nas partes
+    # seguintes ele é repetido como primeira linha
+    registros = iter_registros_validados([texto], relatorio, estado, final)
+    primeiro = estado.get('primeiro_registro')
+    if primeiro is None:
+        primeiro = estado['primeiro_registro'] = next(registros, None)
+    if primeiro is not None:
+        registros = itertools.chain([primeiro], registros)
+    conteudo = b"".join(iter_linhas_particionadas(registros, partition_date))
+
+    estado['colunas_header'] = relatorio.colunas_header
+    if not relatorio.registros:
+        return relatorio, estado, None, dados.isascii()
+    return relatorio, estado, gzip.compress(conteudo, compresslevel=shard_gzip_level), dados.isascii()
+
+
+# Uma tentativa da carga em partes com um encoding ('auto' ou 'ISO-8859-1'): envia as
+# partes para o pool, junta os resultados na ordem, preenche o relatório e grava as
+# partes em temp_prefix.parteNNNNN.csv.gz (nomes em relatorio.partes)
+def upload_file_shards(blob, bucket, temp_prefix, partition_date, encoding, relatorio, shard_size, chunk_size=None):
+    pool = shard_pool.get()
+    atual = relatorio.encoding  # 'auto' começa como UTF-8
+    decidido = encoding != 'auto'
+    estado = {}
+    # (índice, parte, final, future ou None = processar no processo principal, encoding do envio)
+    fila = deque()
+    envios = []
+
+    # Estado de início de parte usado nos envios ao pool: header e colunas já conhecidos
+    # e nenhum registro pendente
+    def estado_base():
+        if estado.get('primeiro_registro') is None or estado.get('separadores_primeiro') is None:
+            return None
+        return dict(estado, linha_pendente="", separadores_pendentes=0)
+
+    # Processa uma parte no processo principal com o estado atual. Se o UTF-8 falha e tudo
+    # antes do erro era ASCII, continua em ISO-8859-1 (mesma regra de iter_textos_decodificados)
+    def processar_aqui(indice, parte, final):
+        nonlocal atual, decidido
+        try:
+            return process_shard(parte, atual, estado, partition_date, indice == 0, final)
+        except UnicodeDecodeError as e:
+            if decidido or not parte[:e.start].isascii():
+                raise
+            atual, decidido = 'ISO-8859-1', True
+            relatorio.encoding, relatorio.deteccao_encoding = 'ISO-8859-1', 'troca'
+            return process_shard(parte, atual, estado, partition_date, indice == 0, final)
+
+    # Conclui a parte mais antiga da fila: confere o resultado do pool, junta ao relatório
+    # e agenda o envio ao Cloud Storage
+    def concluir(uploads):
+        nonlocal estado, decidido
+        indice, parte, final, future, encoding_envio = fila.popleft()
+        resultado = None
+        if future is not None:
+            try:
+                resultado = future.result()
+            except UnicodeDecodeError:
+                resultado = None
+            if resultado is not None and (estado.get('linha_pendente') or estado.get('rejeitado')
+                                          or not resultado[3] and encoding_envio != atual):
+                resultado = None  # começou no meio de um registro, com outro encoding ou após a rejeição
+        if resultado is None:
+            resultado = processar_aqui(indice, parte, final)
+
+        parcial, estado, carga, ascii_ = resultado
+        if not ascii_ and not decidido:
+            decidido = True
+            relatorio.deteccao_encoding = 'utf-8'
+        relatorio.acumular(parcial, primeira=indice == 0)
+        if carga is not None and not estado.get('rejeitado'):
+            nome = f"{temp_prefix}.parte{indice:05d}.csv.gz"
+            relatorio.partes.append(nome)
+            relatorio.bytes += len(carga)
+            envios.append(uploads.submit(
+                bucket.blob(nome).upload_from_string, carga, content_type='application/gzip'
+            ))
+
+    with ThreadPoolExecutor(max_workers=shard_upload_workers) as uploads:
+        for indice, (parte, final) in enumerate(iter_partes_bytes(iter_blocos_blob(blob, chunk_size, relatorio), shard_size)):
+            base = estado_base() if indice else None
+            future = pool.submit(process_shard, parte, atual, base, partition_date, False, final) if base else None
+            fila.append((indice, parte, final, future, atual))
+            # Partes sem envio ao pool (header ainda desconhecido) e o limite de partes
+            # em memória: conclui as mais antigas
+            while fila and (fila[0][3] is None or len(fila) > shard_pool.max_workers):
+                concluir(uploads)
+        while fila:
+            concluir(uploads)
+
+        inicio = time.monotonic()
+        for envio in envios:
+            envio.result()
+        relatorio.tempo_gravacao += time.monotonic() - inicio
+
+
+# Carga em partes de um arquivo grande: mesmo resultado de stream_file_to_temp_blob, mas
+# com o arquivo de carga dividido em partes comprimidas (nomes em relatorio.partes).
+# Retorna o relatório de validação (ValidationReport).
+def stream_file_to_temp_shards(blob, bucket, temp_prefix, partition_date, shard_size=None, chunk_size=None):
+    shard_size = shard_size or int(shard_size_mb * 1024 * 1024)
+    descartado, bytes_descartados = 0.0, 0
+    descartadas = []
+    for encoding in ('auto', 'ISO-8859-1'):
+        inicio = time.monotonic()
+        relatorio = new_report(encoding, descartado, bytes_descartados)
+        try:
+            upload_file_shards(blob, bucket, temp_prefix, partition_date, encoding, relatorio, shard_size, chunk_size)
+            break
+        except UnicodeDecodeError:
+            # UTF-8 inválido depois de caracteres UTF-8 válidos: refaz tudo como ISO-8859-1
+            descartado += time.monotonic() - inicio
+            bytes_descartados += relatorio.bytes_lidos
+            descartadas = relatorio.partes
+    # Arquivo rejeitado: as partes enviadas antes da rejeição são removidas
+    if relatorio.motivo_rejeicao():
+        descartadas, relatorio.partes, relatorio.bytes = descartadas + relatorio.partes, [], 0
+    # Partes da tentativa descartada (ou do arquivo rejeitado) que não foram regravadas
+    for nome in set(descartadas) - set(relatorio.partes):
+        bucket.delete_blob(nome)
+    return relatorio
+
+
+# Colunas de uma tabela do BigQuery, sem a PARTITIONDATE
+def table_column_names(table):
+    return [field.name for field in table.schema if field.name != 'PARTITIONDATE']
+
+
+# Função para registrar no log a comparação coluna a coluna entre a tabela e o arquivo
+def log_schema_comparison(table_columns, file_columns):
     comparison_lines = ["Tabela|Arquivo|Status"]
 
     i = j = 0
@@ -436,7 +2318,11 @@ def compare_columns(file, columns, table_id):
     comparison_text = "\n".join(comparison_lines)
     log(f"\n{comparison_text}")
 
-    # ---- REGRAS DE ALTERAÇÃO DE SCHEMA ----
+
+# ---- REGRAS DE ALTERAÇÃO DE SCHEMA ----
+# O arquivo é aceito quando traz as colunas da tabela na mesma ordem, seguidas ou não
+# de colunas novas no fim. Retorna (colunas novas, None) ou (None, mensagem de erro).
+def schema_change(table_columns, file_columns):
     table_columns_set = set(table_columns)
     file_columns_set = set(file_columns)
 
@@ -448,50 +2334,168 @@ def compare_columns(file, columns, table_id):
                 last_table_col_index = file_columns.index(table_columns[-1])
                 first_new_col_index = file_columns.index(new_columns[0])
                 if first_new_col_index > last_table_col_index:
-                    new_fields = [bigquery.SchemaField(col, "STRING") for col in new_columns]
-                    updated_schema = table.schema + new_fields
-                    table.schema = updated_schema
-                    client.update_table(table, ["schema"])
-                    log(f"Novas colunas {new_columns} adicionadas à tabela {table_id}.")
-                    return True
-                else:
-                    log(f"ERRO: Coluna nova encontrada no meio da estrutura. "
-                        f"As novas colunas devem estar após {table_columns[-1]}. Nenhuma alteração realizada.")
-                    return False
-            return True
+                    return new_columns, None
+                return None, (f"ERRO: Coluna nova encontrada no meio da estrutura. "
+                              f"As novas colunas devem estar após {table_columns[-1]}. Nenhuma alteração realizada.")
+            return [], None
 
-    log("ERRO: Divergência de schema detectada. Nenhuma alteração realizada.")
-    return False
+    return None, "ERRO: Divergência de schema detectada. Nenhuma alteração realizada."
 
-# Função para salvar logs no BigQuery
-def save_logs_to_bigquery(execution_logs, project_id, log_dataset_name, log_table_name):
-    client = bigquery.Client()
+
+# Função para acrescentar colunas STRING no fim do schema da tabela (atualiza o cache)
+def add_table_columns(table_id, table, new_columns):
+    from google.cloud import bigquery
+
+    new_fields = [bigquery.SchemaField(col, "STRING") for col in new_columns]
+    updated_schema = table.schema + new_fields
+    table.schema = updated_schema
+    try:
+        table = get_bigquery_client().update_table(table, ["schema"])
+    except Exception:
+        table_cache.invalidate(table_id)  # O objeto em cache foi alterado acima
+        raise
+    table_cache.put(table_id, table)
+    log(f"Novas colunas {new_columns} adicionadas à tabela {table_id}.")
+    return table
+
+
+# Função para comparar colunas do arquivo com a tabela no BigQuery
+def compare_columns(file, columns, table_id):
+    table = table_cache.get(table_id)
+
+    # Remove PARTITIONDATE se existir
+    table_columns = table_column_names(table)
+    file_columns = [sanitize_column_name(col) for col in columns]
+
+    # Se forem exatamente iguais
+    if file_columns == table_columns:
+        log(f"Tabela e arquivo possuem o mesmo schema para {table_id}")
+        return True
+
+    log_schema_comparison(table_columns, file_columns)
+
+    new_columns, erro = schema_change(table_columns, file_columns)
+    if new_columns is None:
+        log(erro)
+        return False
+    if new_columns:
+        add_table_columns(table_id, table, new_columns)
+    return True
+
+
+# ---- PLANEJAMENTO DO SCHEMA (antes das cargas) ----
+
+# Lê do blob só o necessário para encontrar o header, com a mesma regra da validação
+# completa (primeiro registro corrigido com todas as colunas preenchidas), até max_bytes.
+# Retorna o registro do header ou None (primeira linha em branco ou header fora do
+# início do arquivo: o arquivo segue o caminho de sempre).
+def read_header(blob, max_bytes=None):
+    max_bytes = max_bytes or header_plan_max_bytes
+    for encoding in ('auto', 'ISO-8859-1'):
+        relatorio = new_report(encoding)
+        blocos = iter_blocos_blob(blob, header_plan_chunk_size, relatorio)
+        registros = iter_registros_validados(iter_linhas_decodificadas(blocos, encoding, relatorio), relatorio)
+        try:
+            for _ in registros:
+                if relatorio.header or relatorio.bytes_lidos >= max_bytes:
+                    break
+        except UnicodeDecodeError:
+            continue
+        finally:
+            registros.close()
+            blocos.close()
+        if relatorio.primeira_linha_em_branco:
+            return None
+        return relatorio.header_linha or None
+
+
+# Compara o header de cada arquivo pendente com o schema atual da tabela, sem alterar
+# nada. Tabelas só ganham colunas no fim, então um arquivo incompatível com a tabela
+# atual continua incompatível depois das cargas dos arquivos anteriores.
+# colunas_tabelas: {tabela: colunas atuais}; headers: lista de (arquivo, tabela, registro
+# do header). Retorna {arquivo: (colunas do arquivo, colunas da tabela, erro)} dos incompatíveis.
+def plan_schema_conflicts(colunas_tabelas, headers):
+    conflitos = {}
+    for file, table_name, header_linha in headers:
+        table_columns = colunas_tabelas[table_name]
+        file_columns = [sanitize_column_name(col) for col in normalize_header(header_linha)]
+        if file_columns != table_columns:
+            new_columns, erro = schema_change(table_columns, file_columns)
+            if new_columns is None:
+                conflitos[file] = (file_columns, table_columns, erro)
+    return conflitos
+
+
+# Schema da tabela de logs. Data e TXT são as colunas originais (usadas nos dashboards);
+# as demais são adicionadas à tabela existente na primeira gravação. Pares (nome, tipo),
+# convertidos em SchemaField em ensure_log_table.
+log_table_schema = [
+    ("Data", "TIMESTAMP"),
+    ("TXT", "STRING"),
+    ("Execucao", "STRING"),
+    ("Sequencia", "INTEGER"),
+    ("Arquivo", "STRING"),
+    ("Tabela", "STRING"),
+    ("Fase", "STRING"),
+    ("Duracao", "FLOAT"),
+]
+metrics_table_schema = [
+    ("Data", "TIMESTAMP"),
+    ("Execucao", "STRING"),
+    ("Arquivo", "STRING"),
+    ("Tabela", "STRING"),
+    ("Fase", "STRING"),
+    ("Duracao", "FLOAT"),
+    ("Bytes", "INTEGER"),
+    ("Linhas", "INTEGER"),
+    ("Status", "STRING"),
+    ("Encoding", "STRING"),
+]
+log_table_schemas = {log_table_name: log_table_schema, metrics_table_name: metrics_table_schema}
+log_table_ready = set()  # tabelas de log já verificadas neste processo
+
+
+# Função para criar a tabela de logs/métricas, ou adicionar as colunas que faltam, uma vez por processo
+def ensure_log_table(project_id, log_dataset_name, log_table_name):
     log_table_id = f"{project_id}.{log_dataset_name}.{log_table_name}"
+    if log_table_id in log_table_ready:
+        return log_table_id
+    from google.cloud import bigquery
 
-    rows_to_insert = [
-        {"Data": datetime.now().isoformat(), "TXT": log}
-        for log in execution_logs  # Uso do set evita duplicação
-    ]
+    client = get_bigquery_client()
+    schema = [bigquery.SchemaField(nome, tipo) for nome, tipo in log_table_schemas[log_table_name]]
 
-    # Verifica se a tabela de logs existe, se não, cria a tabela
     if not check_table_exists(project_id, log_dataset_name, log_table_name):
-        schema = [
-            bigquery.SchemaField("Data", "TIMESTAMP"),
-            bigquery.SchemaField("TXT", "STRING"),
-        ]
-        table = bigquery.Table(log_table_id, schema=schema)
-        client.create_table(table)
-        log(f"Tabela {log_table_id} criada para armazenar logs.")
-
-    errors = client.insert_rows_json(log_table_id, rows_to_insert)
+        table = client.create_table(bigquery.Table(log_table_id, schema=schema))
+        table_cache.put(log_table_id, table)
+        print(f"Tabela {log_table_id} criada para armazenar logs.")
+    else:
+        table = table_cache.get(log_table_id)
+        existentes = {field.name for field in table.schema}
+        novas = [field for field in schema if field.name not in existentes]
+        if novas:
+            table.schema = list(table.schema) + novas
+            table = client.update_table(table, ["schema"])
+            table_cache.put(log_table_id, table)
+            print(f"Colunas {[field.name for field in novas]} adicionadas à tabela {log_table_id}.")
+
+    log_table_ready.add(log_table_id)
+    return log_table_id
+
+
+# Função para salvar logs no BigQuery (um lote de linhas montadas pelo ExecutionLogger,
+# na tabela de logs ou de métricas).
+# Chamada pela thread do logger, por isso as mensagens daqui vão só para o stdout.
+def save_logs_to_bigquery(rows_to_insert, project_id, log_dataset_name, log_table_name):
+    log_table_id = ensure_log_table(project_id, log_dataset_name, log_table_name)
+
+    errors = get_bigquery_client().insert_rows_json(log_table_id, rows_to_insert)
     if errors == []:
-        print(f"Logs salvos com sucesso na tabela {log_table_id}.")
+        print(f"Logs salvos com sucesso na tabela {log_table_id} ({len(rows_to_insert)} linhas).")
     else:
+        log_table_ready.discard(log_table_id)  # Verifica a tabela de novo no próximo lote
         print(f"Erros ao salvar logs: {errors}")
 
-        
-        
-
 
 # NOVO: Importar Flask
 from flask import Flask, request
@@ -506,8 +2510,7 @@ app = Flask(__name__)
 # Função principal (main) adaptada para ser um endpoint Flask
 @app.route('/', methods=['GET', 'POST'])
 def process_data():
-    global execution_logs # Garante que as funções internas possam preencher o set
-    execution_logs = set() # Limpa logs a cada nova requisição
+    logger.start_execution('varredura')  # Logs desta requisição (gravados em LOG.LOGS)
     
     # Simula o comportamento de uma Cloud Function, chamando a lógica principal
     try:
@@ -518,37 +2521,180 @@ def process_data():
         # principal nem precisa disso, pois ela varre o bucket.
         
         log("Execução iniciada.")
-        create_dataset_if_not_exists(dataset_name)
-        create_dataset_if_not_exists(log_dataset_name)
-        ensure_folder_structure(bucket_name, target_folder, success_folder, failure_folder)
+        prepare_instance()
 
-        # Busca arquivos .txt na pasta
-        txt_files = get_txt_files(bucket_name, folder_name)
+        # Busca arquivos .txt na pasta (com os metadados usados pelo manifesto)
+        with span('listagem') as medida:
+            txt_blobs = get_txt_blobs(bucket_name, folder_name)
+            medida['linhas'] = len(txt_blobs)
+        txt_files = list(txt_blobs)
 
         if not txt_files:
             log(f"Nenhum arquivo .txt encontrado na pasta {folder_name}. Encerrando execução.")
-            save_logs_to_bigquery(execution_logs, project_id, log_dataset_name, "LOGS")
+            log(f"Clientes GCP criados nesta requisição: {execution_count('clientes_criados')}.")
             log("Execução concluída.")
+            flush_execution_logs()
             return "Nenhum arquivo encontrado. Execução concluída.", 200
 
-        create_partitioned_tables_and_insert_data(
+        process_files(txt_files, txt_blobs)
+
+        log(f"Clientes GCP criados nesta requisição: {execution_count('clientes_criados')}.")
+        log("Execução concluída.")
+        flush_execution_logs()
+        return "Execução finalizada com sucesso", 200
+
+    except Exception as e:
+        log(f"##FALHA GERAL## Erro na execução principal: {str(e)}")
+        log(f"Clientes GCP criados nesta requisição: {execution_count('clientes_criados')}.")
+        flush_execution_logs()
+        return f"Erro na execução principal: {str(e)}", 500
+
+# Endpoint orientado a eventos: recebe a notificação de finalize do GCS (push do
+# Pub/Sub ou Eventarc) e processa só o objeto enviado, com as mesmas validações e
+# carga da varredura. Sempre responde 2xx quando o evento foi tratado ou descartado
+# (evita reentregas); 500 só em falha geral, para que o evento seja reentregue.
+@app.route('/evento', methods=['POST'])
+def process_event():
+    logger.start_execution('evento')
+
+    try:
+        evento = parse_gcs_event(request.get_json(silent=True), request.headers)
+    except ValueError as e:
+        # Corpo malformado: um 5xx faria o Pub/Sub reentregar a mesma mensagem sem fim
+        log(f"##FALHA## Evento inválido descartado: {str(e)}")
+        flush_execution_logs()
+        return "Evento inválido.", 200
+    # Eventos de outros buckets/pastas (inclusive as cópias para BI_SI_FILES feitas
+    # pela própria carga) são descartados sem gravar log
+    if not evento or evento['bucket'] != bucket_name or not is_input_file(evento['name'] or '', folder_name):
+        return "Evento ignorado.", 200
+
+    file = evento['name']
+    chave = f"{evento['bucket']}/{file}#{evento['generation']}"
+    if not event_dedup.begin(chave):
+        return "Evento duplicado ignorado.", 200
+
+    try:
+        log(f"Execução iniciada pelo evento {evento['id']} ({file}, generation {evento['generation']}).")
+        prepare_instance()
+
+        # Reentrega de um evento já tratado (por esta ou outra instância): o arquivo já
+        # foi movido de DADOS_1 ou foi substituído por uma versão mais nova
+        blob = get_storage_client().bucket(bucket_name).get_blob(file)
+        if blob is None or (evento['generation'] and str(blob.generation) != evento['generation']):
+            log(f"Arquivo {file} (generation {evento['generation']}) não está mais em {folder_name}. "
+                f"Evento já processado ou arquivo substituído.")
+        else:
+            process_files([file], {file: blob})
+
+        event_dedup.finish(chave)
+        log(f"Clientes GCP criados nesta requisição: {execution_count('clientes_criados')}.")
+        log("Execução concluída.")
+        flush_execution_logs()
+        return "Evento processado com sucesso", 200
+
+    except Exception as e:
+        event_dedup.finish(chave, sucesso=False)
+        log(f"##FALHA GERAL## Erro no processamento do evento {evento['id']}: {str(e)}")
+        log(f"Clientes GCP criados nesta requisição: {execution_count('clientes_criados')}.")
+        flush_execution_logs()
+        return f"Erro no processamento do evento: {str(e)}", 500
+
+
+# Totais por fase e por tabela desde o início da instância, no formato do Prometheus
+# (desligado com METRICS_ENDPOINT=0)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not metrics_endpoint_enabled:
+        return "Not Found", 404
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# Aquecimento da instância, para a startup probe do Cloud Run ou um GET logo após o
+# deploy: a primeira requisição de dados não paga os imports, a criação dos clientes e
+# as verificações de datasets, pastas e tabelas de log. 503 se alguma etapa falhar.
+@app.route('/warmup', methods=['GET'])
+def warmup():
+    # Execução própria, como nas outras rotas: sem ela os logs do aquecimento iriam para
+    # a última execução que rodou nesta thread do gunicorn
+    logger.start_execution('aquecimento')
+    try:
+        tempos = warm_up()
+    except Exception as e:
+        log(f"##FALHA## Erro no aquecimento da instância: {str(e)}")
+        flush_execution_logs()
+        return f"Erro no aquecimento da instância: {str(e)}", 503
+    resumo = ", ".join(f"{etapa} {duracao:.3f}s" for etapa, duracao in tempos.items())
+    log(f"Instância aquecida: {resumo}.")
+    flush_execution_logs()
+    return f"Instância aquecida: {resumo}.", 200
+
+
+# Função para aquecer a instância. Retorna a duração (segundos) de cada etapa.
+def warm_up():
+    def importar_bibliotecas():
+        from google.cloud import bigquery, storage  # noqa: F401
+        if output_format == 'parquet':
+            import pyarrow  # noqa: F401
+
+    def criar_clientes():
+        get_bigquery_client()
+        get_storage_client()
+
+    def preparar_tabelas_log():
+        for tabela in log_table_schemas:
+            ensure_log_table(project_id, log_dataset_name, tabela)
+
+    # Inicia os processos do pool da carga em partes (cada um importa este módulo)
+    def iniciar_pool_partes():
+        if sharded_load_min_mb > 0:
+            pool = shard_pool.get()
+            for future in [pool.submit(int) for _ in range(shard_pool.max_workers)]:
+                future.result()
+
+    tempos = {}
+    for etapa, funcao in [('imports', importar_bibliotecas), ('clientes', criar_clientes),
+                          ('estrutura', prepare_instance), ('tabelas_log', preparar_tabelas_log),
+                          ('pool_partes', iniciar_pool_partes)]:
+        inicio = time.monotonic()
+        funcao()
+        tempos[etapa] = time.monotonic() - inicio
+    return tempos
+
+
+# Função para encerrar os logs da requisição: espera a thread do logger gravar no
+# BigQuery as linhas desta execução (no Cloud Run a CPU pode ser limitada após a resposta)
+def flush_execution_logs():
+    if not logger.flush(timeout=log_flush_timeout):
+        print(f"Tempo esgotado ({log_flush_timeout}s) aguardando a gravação dos logs no BigQuery.")
+
+
+# Função para processar uma lista de arquivos de DADOS_1 (varredura ou evento) com a
+# configuração do módulo e registrar o resumo da execução
+def process_files(txt_files, txt_blobs=None):
+    with span('execucao') as medida:
+        resultados = create_partitioned_tables_and_insert_data(
             txt_files,
             project_id,
             dataset_name,
             bucket_name,
             target_folder,
             success_folder,
-            failure_folder
+            failure_folder,
+            max_workers,
+            ingest_backend,
+            partition_replace_mode,
+            output_format,
+            use_manifest,
+            txt_blobs,
+            schema_plan
         )
+        medida['linhas'] = len(txt_files)
+    log_summary(resultados)
+    log(f"Metadados de tabelas: {execution_count('cache_tabelas_consultas')} consultas ao BigQuery, "
+        f"{execution_count('cache_tabelas_leituras')} leituras do cache.")
+    return resultados
 
-        save_logs_to_bigquery(execution_logs, project_id, log_dataset_name, "LOGS")
-        log("Execução concluída.")
-        return "Execução finalizada com sucesso", 200
-
-    except Exception as e:
-        log(f"##FALHA GERAL## Erro na execução principal: {str(e)}")
-        save_logs_to_bigquery(execution_logs, project_id, log_dataset_name, "LOGS")
-        return f"Erro na execução principal: {str(e)}", 500
 
 # NOVO: Ponto de entrada do Gunicorn (usado pelo Buildpack)
 if __name__ == "__main__":